@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Benchmark the JSON search API against the HTML search page it shares its queries with.
+# Requests are made through the Flask test client after one warm-up request,
+# so the times cover the cached query path plus rendering, not the SQLite queries themselves.
+# Run from the repository root after `make iedb`.
+# Prints one JSON object with the median seconds and response bytes per tab for each format.
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "iedbtk"))
+import server  # noqa: E402
+
+tabs = {
+    "epitope": {"tab": "epitope"},
+    "antigen": {"tab": "antigen"},
+    "assay/tcell": {"tab": "assay", "tab2": "tcell"},
+    "assay/bcell": {"tab": "assay", "tab2": "bcell"},
+    "receptor/tcr": {"tab": "receptor", "tab2": "tcr"},
+    "reference": {"tab": "reference"},
+}
+
+
+def median_request(client, url, repeat):
+    """Given a test client, a URL, and a number of requests,
+    return the median seconds per request and the response size in bytes."""
+    client.get(url)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        times.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise Exception(f"Failed to get {url}: {response.status_code}")
+    return {"seconds": round(statistics.median(times), 5), "bytes": len(response.data)}
+
+
+def benchmark(repeat=20, args=None):
+    args = args or {"positive_assays_only": "true"}
+    client = server.app.test_client()
+    results = {}
+    for name, tab in tabs.items():
+        query = urlencode({**args, **tab})
+        results[name] = {
+            "html": median_request(client, f"/search/?{query}", repeat),
+            "json": median_request(client, f"/api/search?{query}", repeat),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON search API against HTML")
+    parser.add_argument("--repeat", type=int, default=20, help="The requests per URL")
+    args = parser.parse_args()
+
+    results = benchmark(args.repeat)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
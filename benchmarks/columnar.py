@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Benchmark the aggregation tabs of the search page:
+# SQLite GROUP BY queries on build/iedb.db against the columnar snapshot in build/snapshot.
+# Run from the repository root after `make snapshot`.
+# Prints one JSON object with the median seconds per tab and filter for each engine.
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "iedbtk"))
+import columnar  # noqa: E402
+import server  # noqa: E402
+
+filters = {
+    "none": {},
+    "positive": {"positive_assays_only": "true"},
+    "organism": {"source_organism": "NCBITaxon:10239"},
+    "nonpeptide": {"nonpeptide": "IEDB:non-peptidic-material"},
+}
+
+
+def sql_query(cur, name, args, offset):
+    """Given a cursor, a snapshot_tabs name, request args, and an offset,
+    run the equivalent GROUP BY query in SQLite and return the rows."""
+    spec = server.snapshot_tabs[name]
+    q = server.my_count(cur, args)["search"]
+    q["select"] = [f'{column} AS "{alias}"' for alias, column in spec["columns"].items()]
+    q["select"] += [
+        f'count(distinct {column}) AS "{alias}"' for alias, column in spec.get("counts", {}).items()
+    ]
+    q["from"] = [f"{spec['table']} AS s"]
+    q["where"] = q["where"] + [f"{column} IS NOT NULL" for column in spec.get("not null", [])]
+    q["group by"] = [spec["group by"]]
+    alias, descending = spec["order by"]
+    q["order by"] = [f'"{alias}"' + (" DESC" if descending else " ASC")]
+    q["limit"] = server.limit
+    q["offset"] = offset
+    return cur.execute(server.build_query(q), q["params"]).fetchall()
+
+
+def median_seconds(function, *args, repeat=5):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times), 4)
+
+
+def benchmark(db_path, snapshot_path, repeat=5, offset=0):
+    start = time.perf_counter()
+    snapshot = columnar.load_snapshot(snapshot_path, db_path)
+    if snapshot is None:
+        raise Exception(f"No current snapshot in {snapshot_path}; run `make snapshot`")
+    server.snapshot = snapshot
+    results = {"load_snapshot": round(time.perf_counter() - start, 4), "seconds": {}}
+
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        conn.row_factory = server.dict_factory
+        cur = conn.cursor()
+        for name in server.snapshot_tabs:
+            for label, args in filters.items():
+                # Warm the my_count cache, so both sides only time the tab query
+                server.my_count(cur, args)
+                results["seconds"][f"{name}/{label}"] = {
+                    "sqlite": median_seconds(sql_query, cur, name, args, offset, repeat=repeat),
+                    "snapshot": median_seconds(
+                        server.query_snapshot, cur, name, args, offset, repeat=repeat
+                    ),
+                }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite against the columnar snapshot")
+    parser.add_argument("--db", type=str, default="build/iedb.db", help="The SQLite database")
+    parser.add_argument("--snapshot", type=str, default="build/snapshot", help="The snapshot")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of runs per query")
+    parser.add_argument("--offset", type=int, default=0, help="The row offset of the page")
+    args = parser.parse_args()
+
+    results = benchmark(args.db, args.snapshot, args.repeat, args.offset)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
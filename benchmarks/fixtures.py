@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+#
+# Generate a synthetic copy of the build inputs at a chosen size, and build it with the Makefile:
+# a taxdmp.zip with a random taxonomy, the IEDB tables as the TSVs that fetch.py writes,
+# the non-peptide and protein ontologies as statement tables, and data2/prefixes.tsv.
+# For the build pipeline benchmarks it can also write the IEDB tables to a SQLite database
+# that fetch.py reads in place of the IEDB server, and an ontology in Turtle for rdf2tsv.
+# The output directory links to this repository's Makefile and src/,
+# so `make iedb snapshot peptides` runs the real pipeline on the synthetic inputs.
+#
+# The defaults build in about a minute. For production sizes use about
+# `--rows 5000000 --taxa 2700000` (IEDB's simple_search and the NCBI Taxonomy).
+# The same seed and sizes always give the same files.
+
+import argparse
+import csv
+import gzip
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import zipfile
+
+repository = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+residues = "ACDEFGHIKLMNPQRSTVWY"
+ranks = ["no rank", "superkingdom", "genus", "species", "subspecies", "species group", "clade"]
+prefixes = [
+    ("rdf", "http://www.w3.org/1999/02/22-rdf-syntax-ns#"),
+    ("rdfs", "http://www.w3.org/2000/01/rdf-schema#"),
+    ("owl", "http://www.w3.org/2002/07/owl#"),
+    ("oio", "http://www.geneontology.org/formats/oboInOwl#"),
+    ("IAO", "http://purl.obolibrary.org/obo/IAO_"),
+    ("PR", "http://purl.obolibrary.org/obo/PR_"),
+    ("CHEBI", "http://purl.obolibrary.org/obo/CHEBI_"),
+    ("IEDB", "http://iedb.org/"),
+    ("NCBITaxon", "http://purl.obolibrary.org/obo/NCBITaxon_"),
+    ("xsd", "http://www.w3.org/2001/XMLSchema#"),
+]
+
+search_columns = [
+    "simple_search_id",
+    "structure_id",
+    "structure_description",
+    "source_antigen_obi_id",
+    "source_antigen_name",
+    "source_antigen_source_org_id",
+    "source_antigen_source_org_name",
+    "source_organism_id",
+    "source_organism_name",
+    "linear_sequence",
+    "non_peptidic_obi_id",
+    "tcell_id",
+    "bcell_id",
+    "elution_id",
+    "assay_id",
+    "as_type_id",
+    "qualitative_measure",
+    "reference_id",
+    "pubmed_id",
+    "reference_author",
+    "reference_title",
+    "reference_date",
+]
+receptor_columns = [
+    "receptor_id",
+    "receptor_group_id",
+    "receptor_type",
+    "receptor_species_names",
+    "chain1_cdr3_seq",
+    "chain2_cdr3_seq",
+]
+assay_columns = [
+    "reference_id",
+    "reference_summary",
+    "structure_id",
+    "epitope_description",
+    "host_organism_id",
+    "host",
+    "immunization_description",
+    "antigen_description",
+    "antigen_er",
+    "mhc_restriction",
+    "assay_description",
+]
+assay_tables = {
+    "tcell_list": ["tcell_id"] + assay_columns,
+    "bcell_list": ["bcell_id"] + assay_columns,
+    "mhc_elution_list": ["elution_id"]
+    + assay_columns
+    + ["merged_host_imm_desc", "quantitative_measure"],
+}
+nonpeptide_columns = ["node_id", "parent_node_id", "obi_id", "display_name", "secondary_names"]
+
+
+def peptide(rng, low=8, high=15):
+    return "".join(rng.choice(residues) for _ in range(rng.randint(low, high)))
+
+
+def write_taxdmp(path, taxa, seed=0):
+    """Given a path, a number of taxa, and a seed, write a taxdmp.zip with a random taxonomy
+    and return the list of taxon IDs.
+    Each taxon's parent is a recent one, so the tree is a few dozen levels deep."""
+    rng = random.Random(seed)
+    nodes = []
+    names = []
+    for tax_id in range(1, taxa + 1):
+        parent = 1 if tax_id <= 2 else tax_id - 1 - int((tax_id - 2) * rng.random() ** 4)
+        fields = [tax_id, parent, rng.choice(ranks), "", 0, 0, 1, 0, 0, 0, 0, 0, ""]
+        nodes.append("\t|\t".join(str(field) for field in fields) + "\t|\n")
+        # Some scientific names are shared, so they need a unique name
+        name = f"Taxon {tax_id % (taxa // 3 + 1)}"
+        unique = f"Taxon {tax_id} <{tax_id}>" if tax_id > taxa // 3 else ""
+        names.append(f"{tax_id}\t|\t{name}\t|\t{unique}\t|\tscientific name\t|\n")
+        if tax_id % 3 == 0:
+            names.append(f'{tax_id}\t|\tSynonym "{tax_id}"\t|\t\t|\tsynonym\t|\n')
+        if tax_id % 5 == 0:
+            names.append(f"{tax_id}\t|\tCommon {tax_id}\t|\t\t|\tgenbank common name\t|\n")
+    merged = [f"{taxa + i}\t|\t{rng.randint(1, taxa)}\t|\n" for i in range(1, taxa // 10)]
+    deleted = [f"{2 * taxa + i}\t|\n" for i in range(1, taxa // 10)]
+    citations = []
+    for citation_id in range(taxa // 20):
+        tax_ids = " ".join(str(rng.randint(1, taxa)) for _ in range(rng.randint(0, 5)))
+        fields = [citation_id, f"key{citation_id}", 0, rng.choice([0, 1000 + citation_id])]
+        fields += ["", "text", tax_ids]
+        citations.append("\t|\t".join(str(field) for field in fields) + "\t|\n")
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as taxdmp:
+        taxdmp.writestr("nodes.dmp", "".join(nodes))
+        taxdmp.writestr("names.dmp", "".join(names))
+        taxdmp.writestr("merged.dmp", "".join(merged))
+        taxdmp.writestr("delnodes.dmp", "".join(deleted))
+        taxdmp.writestr("citations.dmp", "".join(citations))
+    return list(range(1, taxa + 1))
+
+
+def write_tsv(path, columns, rows):
+    """Given a path, the column names, and an iterable of rows,
+    write a gzipped TSV in the format of fetch.py."""
+    with gzip.open(path, "wt", compresslevel=1, newline="") as tsv:
+        writer = csv.writer(tsv, delimiter="\t", lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def write_iedb(directory, rows, tax_ids, seed=0):
+    """Given a directory, a number of simple_search rows, the taxon IDs, and a seed,
+    write the IEDB tables listed in the Makefile as gzipped TSVs.
+    About one row in four is a new epitope, one in ten a new reference,
+    and receptors are taken from one row in ten."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    organisms = rng.sample(tax_ids, min(len(tax_ids), max(100, rows // 300)))
+    chemicals = [f"CHEBI:{i}" for i in range(2, 200)]
+
+    epitopes = {}
+    search = []
+    assays = {table: [] for table in assay_tables}
+    for row_id in range(1, rows + 1):
+        structure_id = rng.randint(1, max(1, rows // 4))
+        if structure_id not in epitopes:
+            sequence = peptide(rng) if rng.random() < 0.95 else ""
+            chemical = "" if sequence else rng.choice(chemicals)
+            epitopes[structure_id] = (
+                sequence,
+                chemical,
+                rng.choice(organisms),
+                rng.randint(1, max(1, rows // 100)),
+            )
+        sequence, chemical, organism, antigen = epitopes[structure_id]
+        table = rng.choice(list(assay_tables))
+        reference_id = rng.randint(1, max(1, rows // 10))
+        search.append(
+            [
+                row_id,
+                structure_id,
+                sequence or f"chemical {chemical}",
+                f"UNIPROT:P{antigen}",
+                f"antigen {antigen}",
+                f"NCBITaxon:{organism}",
+                f"Taxon {organism}",
+                f"NCBITaxon:{organism}",
+                f"Taxon {organism}",
+                sequence,
+                chemical,
+                row_id if table == "tcell_list" else "",
+                row_id if table == "bcell_list" else "",
+                row_id if table == "mhc_elution_list" else "",
+                row_id,
+                f"OBI:{rng.randint(1, 50)}",
+                rng.choice(["Positive", "Positive-High", "Positive-Low", "Negative"]),
+                reference_id,
+                reference_id + 100000,
+                f"Author {reference_id}",
+                f"Title {reference_id}",
+                1990 + reference_id % 30,
+            ]
+        )
+        assay = [row_id, reference_id, f"Reference {reference_id}", structure_id, sequence]
+        assay += ["NCBITaxon:9606", "Homo sapiens", "immunized", "antigen", "epitope"]
+        assay += [rng.choice(["HLA-A*02:01", "HLA-B*07:02", "H2-Kb"]), "assay"]
+        if table == "mhc_elution_list":
+            assay += ["processed", ""]
+        assays[table].append(assay)
+
+    write_tsv(os.path.join(directory, "simple_search.tsv.gz"), search_columns, search)
+    for table, columns in assay_tables.items():
+        write_tsv(os.path.join(directory, f"{table}.tsv.gz"), columns, assays[table])
+    for table in ["tcell_receptor_list", "bcell_receptor_list"]:
+        receptors = []
+        for row in rng.sample(search, len(search) // 10):
+            group_id = rng.randint(1, max(1, len(search) // 20))
+            chain1 = "CASS" + peptide(rng, 6, 10) + "F"
+            chain2 = "CAV" + peptide(rng, 6, 10) + "F"
+            receptor = [len(receptors) + 1, group_id, "alphabeta", "human", chain1, chain2]
+            receptors.append(receptor + row[1:])
+        write_tsv(
+            os.path.join(directory, f"{table}.tsv.gz"),
+            receptor_columns + search_columns[1:],
+            receptors,
+        )
+
+    nodes = [[1, 0, "IEDB:non-peptidic-material", "non-peptidic material", ""]]
+    for i, chemical in enumerate(chemicals, 2):
+        nodes.append([i, rng.randint(1, i - 1), chemical, f"chemical {chemical}", f"alt {i}"])
+    for table in ["molecule_finder_nonpep_tree", "molecule_finder_nonpep_tree_old"]:
+        write_tsv(os.path.join(directory, f"{table}.tsv.gz"), nonpeptide_columns, nodes)
+
+
+def write_nonpeptide(path, chemicals=200, seed=0):
+    """Given a path, a number of chemicals, and a seed,
+    write the non-peptide ontology as a statements table for trees.sql."""
+    rng = random.Random(seed)
+    rows = [
+        ("IEDB:non-peptidic-material", "rdfs:label", None, "non-peptidic material"),
+        ("IEDB:non-peptidic-material", "IEDB:has-sort-name", None, "non-peptidic material"),
+    ]
+    for i in range(2, chemicals):
+        chemical = f"CHEBI:{i}"
+        parent = "IEDB:non-peptidic-material" if i < 10 else f"CHEBI:{rng.randint(2, i - 1)}"
+        rows.append((chemical, "rdfs:subClassOf", parent, None))
+        rows.append((chemical, "rdfs:label", None, f"chemical {chemical}"))
+        rows.append((chemical, "IEDB:has-sort-name", None, f"chemical {chemical}"))
+        rows.append((chemical, "oio:hasExactSynonym", None, f"alt {i}"))
+    write_statements(path, ["subject", "predicate", "object", "value"], rows)
+
+
+def write_pr(path, terms=10000, seed=0):
+    """Given a path, a number of protein terms, and a seed,
+    write the protein ontology database that the term pages read."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(1, terms + 1):
+        term_id = f"PR:{i:09d}"
+        rows.append((term_id, term_id, "rdf:type", "owl:Class", None, None, None))
+        rows.append((term_id, term_id, "rdfs:label", None, f"protein {i}", "xsd:string", None))
+        if i > 1:
+            parent = f"PR:{i - 1 - int((i - 2) * rng.random() ** 4):09d}"
+            rows.append((term_id, term_id, "rdfs:subClassOf", parent, None, None, None))
+        rows.append((term_id, term_id, "oio:hasExactSynonym", None, f"P{i}", "xsd:string", None))
+        rows.append((term_id, term_id, "IAO:0000115", None, f"A protein {i}.", None, "en"))
+    write_statements(
+        path,
+        ["stanza", "subject", "predicate", "object", "value", "datatype", "language"],
+        rows,
+    )
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE prefix (prefix TEXT PRIMARY KEY, base TEXT)")
+        conn.executemany("INSERT INTO prefix VALUES (?, ?)", prefixes)
+        conn.execute("CREATE INDEX statements_stanza ON statements(stanza)")
+        conn.execute("CREATE INDEX statements_object ON statements(object)")
+
+
+def write_statements(path, columns, rows):
+    if os.path.exists(path):
+        os.remove(path)
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"CREATE TABLE statements ({', '.join(columns)})")
+        conn.executemany(f"INSERT INTO statements VALUES ({', '.join('?' * len(columns))})", rows)
+
+
+def write_upstream(path, iedb_directory):
+    """Given a path and a directory of IEDB TSVs, load them into a SQLite database
+    that stands in for the IEDB server, for fetch.py with the "sqlite" client."""
+    if os.path.exists(path):
+        os.remove(path)
+    with sqlite3.connect(path) as conn:
+        for name in sorted(os.listdir(iedb_directory)):
+            if not name.endswith(".tsv.gz"):
+                continue
+            table = name[: -len(".tsv.gz")]
+            with gzip.open(os.path.join(iedb_directory, name), "rt", newline="") as tsv:
+                rows = csv.reader(tsv, delimiter="\t")
+                columns = next(rows)
+                conn.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+                conn.executemany(
+                    f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", rows
+                )
+
+
+def write_rdf(path, terms=10000, seed=0):
+    """Given a path, a number of terms, and a seed, write an ontology in Turtle for rdf2tsv,
+    with a label, a parent, a synonym, and a definition for each term,
+    and an annotated definition on every tenth term."""
+    rng = random.Random(seed)
+    with open(path, "w") as ttl:
+        for prefix, base in prefixes:
+            ttl.write(f"@prefix {prefix}: <{base}> .\n")
+        for i in range(1, terms + 1):
+            term_id = f"PR:{i:09d}"
+            ttl.write(f'\n{term_id} a owl:Class ;\n  rdfs:label "protein {i}" ;\n')
+            if i > 1:
+                parent = f"PR:{i - 1 - int((i - 2) * rng.random() ** 4):09d}"
+                ttl.write(f"  rdfs:subClassOf {parent} ;\n")
+            ttl.write(f'  oio:hasExactSynonym "P{i}"^^xsd:string ;\n')
+            ttl.write(f'  IAO:0000115 "A protein {i}."@en .\n')
+            if i % 10 == 0:
+                ttl.write(
+                    f"[] a owl:Axiom ; owl:annotatedSource {term_id} ;\n"
+                    "  owl:annotatedProperty IAO:0000115 ;\n"
+                    f'  owl:annotatedTarget "A protein {i}."@en ;\n'
+                    f'  oio:hasDbXref "PMID:{i}" .\n'
+                )
+
+
+def generate(directory, rows=100000, taxa=100000, seed=0):
+    """Given a directory, the sizes, and a seed, write the synthetic inputs
+    and link the Makefile and src/ from this repository."""
+    for path in ["build", "cache/iedb", "data2"]:
+        os.makedirs(os.path.join(directory, path), exist_ok=True)
+    for name in ["Makefile", "src"]:
+        link = os.path.join(directory, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(repository, name), link)
+
+    tax_ids = write_taxdmp(os.path.join(directory, "cache", "taxdmp.zip"), taxa, seed)
+    write_iedb(os.path.join(directory, "cache", "iedb"), rows, tax_ids, seed)
+    write_nonpeptide(os.path.join(directory, "build", "nonpeptide.db"), seed=seed)
+    write_pr(os.path.join(directory, "build", "pr.db"), max(1000, taxa // 10), seed)
+    with open(os.path.join(directory, "data2", "prefixes.tsv"), "w") as tsv:
+        for prefix, base in prefixes:
+            tsv.write(f"{prefix}\t{base}\n")
+
+
+def build(directory, targets=("iedb", "snapshot", "peptides")):
+    """Given a directory of synthetic inputs and the make targets, build them there."""
+    subprocess.run(["make", "-C", directory, *targets], check=True, stdout=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and build a synthetic iedb.db")
+    parser.add_argument("directory", type=str, help="The directory to build in")
+    parser.add_argument("--rows", type=int, default=100000, help="The simple_search rows")
+    parser.add_argument("--taxa", type=int, default=100000, help="The taxonomy nodes")
+    parser.add_argument("--seed", type=int, default=0, help="The random seed")
+    parser.add_argument("--no-build", action="store_true", help="Only write the inputs")
+    args = parser.parse_args()
+
+    generate(args.directory, args.rows, args.taxa, args.seed)
+    if not args.no_build:
+        build(args.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# Benchmark the hot paths of the search server on a built iedb.db,
+# usually the synthetic one from `benchmarks/fixtures.py DIRECTORY`:
+# my_count with each kind of filter, every tab at page 1 and at a deep page, make_tree,
+# the /names.json typeahead, term pages (term2rdfa), and render.
+# Caches are cleared before each "cold" call, and the shared disk cache is not used.
+# Prints one JSON object with p50/p99 seconds and calls per second for each case,
+# and with --baseline, the cases that got slower than a stored result.
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+from copy import deepcopy
+from urllib.parse import urlencode
+
+import report
+
+sys.path.insert(0, os.path.join(report.repository, "src", "iedbtk"))
+
+tabs = [
+    ("epitope", None),
+    ("antigen", None),
+    ("assay", "tcell"),
+    ("assay", "bcell"),
+    ("assay", "elution"),
+    ("receptor", "tcr"),
+    ("receptor", "bcr"),
+    ("reference", None),
+]
+
+
+def clear_caches(server):
+    server.counts.clear()
+    with server.cache_lock:
+        server.cache_dict.clear()
+        server.cache_list.clear()
+
+
+def filters(cur):
+    """Given a cursor on iedb.db, return the my_count filters to benchmark,
+    with values taken from the data."""
+    cur.execute("SELECT linear_sequence FROM sequence ORDER BY sequence_id LIMIT 1")
+    sequence = cur.fetchone()["linear_sequence"]
+    cur.execute("SELECT cdr3_sequence FROM cdr3 ORDER BY cdr3_id LIMIT 1")
+    cdr3 = cur.fetchone()["cdr3_sequence"]
+    # A mid-sized organism: the tenth largest at the top of the organism finder
+    cur.execute("SELECT child FROM organism_tree ORDER BY sort LIMIT 1 OFFSET 10")
+    organism_id = cur.fetchone()["child"]
+    positive = {"positive_assays_only": "true"}
+    return {
+        "none": {},
+        "positive": positive,
+        "sequence_exact": {**positive, "sequence": sequence},
+        "sequence_substring": {
+            **positive,
+            "sequence": sequence[2:6],
+            "sequence_mode": "substring",
+        },
+        "sequence_overlap": {**positive, "sequence": sequence, "sequence_mode": "overlap"},
+        "sequence_similar": {
+            **positive,
+            "sequence": sequence,
+            "sequence_mode": "similar",
+            "sequence_distance": "1",
+        },
+        "nonpeptide": {**positive, "nonpeptide": "IEDB:non-peptidic-material"},
+        "nonpeptide_old": {**positive, "nonpeptide_old": "IEDB:non-peptidic-material"},
+        "source_organism": {**positive, "source_organism": organism_id},
+        "cdr3_substring": {**positive, "cdr3": cdr3[3:8], "cdr3_mode": "substring"},
+        "cdr3_distance": {
+            **positive,
+            "cdr3": cdr3,
+            "cdr3_mode": "distance",
+            "cdr3_distance": "2",
+        },
+    }
+
+
+def tab_urls(server, cur, args):
+    """Given the server module, a cursor, and request args,
+    return a URL for page 1 and for a page halfway through the results of each tab."""
+    result = server.my_count(cur, args)
+    urls = {}
+    for tab, tab2 in tabs:
+        name = tab if tab2 is None else f"{tab}/{tab2}"
+        count = result[tab].get(server.tab_count_name(tab, tab2).split(".")[1], 0)
+        deep = count // 2 // server.limit * server.limit
+        params = {**args, "tab": tab, **({"tab2": tab2} if tab2 else {})}
+        urls[f"{name}/page_1"] = "/search/?" + urlencode(params)
+        urls[f"{name}/deep"] = "/search/?" + urlencode({**params, "offset": deep})
+    return urls
+
+
+def get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise Exception(f"Failed to get {url}: {response.status_code}")
+
+
+def benchmark(repeat=50):
+    # The server reads build/ and data2/ relative to the working directory
+    import server
+    import tsv2rdf
+
+    server.build = None
+    client = server.app.test_client()
+    results = {}
+    with sqlite3.connect("file:build/iedb.db?mode=ro", uri=True) as conn:
+        conn.row_factory = server.dict_factory
+        cur = conn.cursor()
+
+        for name, args in filters(cur).items():
+            results[f"my_count/{name}"] = report.measure(
+                lambda: server.my_count(cur, args), repeat, lambda: clear_caches(server)
+            )
+
+        for name, url in tab_urls(server, cur, {"positive_assays_only": "true"}).items():
+            results[f"tab/{name}/cold"] = report.measure(
+                lambda: get(client, url), repeat, lambda: clear_caches(server)
+            )
+            results[f"tab/{name}/warm"] = report.measure(lambda: get(client, url), repeat)
+        results["search_form"] = report.measure(
+            lambda: get(client, "/search/?positive_assays_only=true&tab=search"), repeat
+        )
+
+        cur.execute("SELECT child FROM organism_tree ORDER BY sort DESC LIMIT 1")
+        leaf = cur.fetchone()["child"]
+        for table, field, node_id in [
+            ("organism", "source_organism", "NCBITaxon:1"),
+            ("organism", "source_organism", leaf),
+            ("nonpeptide", "nonpeptide", "IEDB:non-peptidic-material"),
+        ]:
+            name = "root" if node_id in ["NCBITaxon:1", "IEDB:non-peptidic-material"] else "leaf"
+            results[f"make_tree/{table}/{name}"] = report.measure(
+                lambda: server.make_tree(cur, {}, field, table, node_id, node_id), repeat
+            )
+
+    for table, text in [
+        ("organism", "T"),
+        ("organism", "Taxon 12"),
+        ("organism", "Synonym"),
+        ("nonpeptide", "chem"),
+    ]:
+        url = "/names.json?" + urlencode({"table": table, "text": text})
+        results[f"names/{table}/{text}"] = report.measure(lambda: get(client, url), repeat)
+
+    if os.path.exists("build/pr.db"):
+        with sqlite3.connect("file:build/pr.db?mode=ro", uri=True) as conn:
+            conn.row_factory = server.dict_factory
+            cur = conn.cursor()
+            cur.execute("SELECT stanza FROM statements ORDER BY rowid DESC LIMIT 1")
+            term_id = cur.fetchone()["stanza"]
+            results["term2rdfa"] = report.measure(
+                lambda: tsv2rdf.terms2rdfa(cur, "PR", [term_id]), repeat
+            )
+
+    rows = [
+        {column: f"{column} {i}" for column in ["id", "description", "antigen", "organism"]}
+        for i in range(1000)
+    ]
+    with server.app.test_request_context("/search/?positive_assays_only=true"):
+        for size in [25, 1000]:
+            page = server.make_paged_table(rows[:size], len(rows), {})
+            pages = [deepcopy(page) for _ in range(repeat)]
+            results[f"render/{size}_rows"] = report.measure(
+                lambda: tsv2rdf.render(pages.pop()), repeat
+            )
+    return {"snapshot": bool(server.snapshot), "peptide_index": bool(server.peptide_index)}, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the search server hot paths")
+    parser.add_argument(
+        "directory", type=str, nargs="?", default=".", help="The directory with build/iedb.db"
+    )
+    parser.add_argument("--repeat", type=int, default=50, help="The calls per case")
+    parser.add_argument("--baseline", type=str, help="A stored result to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="The slowdown that counts as a regression"
+    )
+    args = parser.parse_args()
+
+    baseline = report.load_baseline(args.baseline) if args.baseline else None
+    os.chdir(args.directory)
+    engines, results = benchmark(args.repeat)
+    output = {
+        "metadata": report.metadata(directory=os.getcwd(), repeat=args.repeat, **engines),
+        "results": results,
+    }
+    if baseline:
+        output["regressions"] = report.compare(results, baseline, threshold=args.threshold)
+    json.dump(output, sys.stdout, indent=2)
+    print()
+    if baseline and output["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# Load test the server under concurrent clients:
+# the threaded Flask development server started by `src/iedbtk/server.py` (app.run),
+# against the ASGI entry point started by `src/iedbtk/asgi.py`.
+# Run from the repository root after `make iedb`; each server is started on its own and stopped.
+# Use --proxy to include the sqlite_web proxy routes, with the sqlite_web servers from run.sh.
+# Prints one JSON object with the requests per second and p50/p99 seconds
+# for each server and number of concurrent clients.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+urls = [
+    "/search/?positive_assays_only=true&tab=epitope",
+    "/search/?positive_assays_only=true&tab=assay&tab2=tcell",
+    "/search/?positive_assays_only=true&tab=reference",
+    "/search/counts.json?positive_assays_only=true",
+    "/api/search?positive_assays_only=true&tab=antigen",
+    "/names.json?table=organism&text=virus",
+    "/finder/organism",
+]
+proxy_urls = [
+    "/iedb.db/",
+    "/iedb.db/epitope/content/",
+]
+
+commands = {
+    "flask": [sys.executable, "src/iedbtk/server.py"],
+    "asgi": [sys.executable, "src/iedbtk/asgi.py", "--port", "5005"],
+}
+
+
+def start(command, base):
+    """Given a command and the base URL it will serve, start it and wait until it answers."""
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            requests.get(base + "/search/stats.json", timeout=1)
+            return process
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise Exception(f"Server did not start: {' '.join(command)}")
+
+
+def client(base, paths, deadline, times, errors):
+    """Request the paths in turn until the deadline, appending the seconds for each."""
+    session = requests.Session()
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.get(base + paths[i % len(paths)], timeout=60)
+            if response.status_code >= 500:
+                errors.append(response.status_code)
+        except requests.exceptions.RequestException as e:
+            errors.append(str(e))
+        times.append(time.perf_counter() - start)
+        i += 1
+
+
+def run(base, paths, concurrency, seconds):
+    """Given a base URL, the paths, a number of clients, and a duration,
+    return the requests per second, p50 and p99 seconds, and error count."""
+    times = []
+    errors = []
+    deadline = time.perf_counter() + seconds
+    clients = [
+        threading.Thread(target=client, args=(base, paths[i:] + paths[:i], deadline, times, errors))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    times.sort()
+    return {
+        "requests_per_second": round(len(times) / elapsed, 1),
+        "p50": round(statistics.median(times), 5),
+        "p99": round(times[int(len(times) * 0.99)], 5),
+        "errors": len(errors),
+    }
+
+
+def benchmark(servers, concurrency, seconds, proxy=False):
+    base = "http://127.0.0.1:5005"
+    paths = urls + (proxy_urls if proxy else [])
+    results = {}
+    for name in servers:
+        process = start(commands[name], base)
+        try:
+            # Warm the caches, so the runs compare serving rather than first queries
+            for path in paths:
+                requests.get(base + path)
+            results[name] = {str(n): run(base, paths, n, seconds) for n in concurrency}
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Flask and ASGI servers")
+    parser.add_argument(
+        "--servers", nargs="+", default=list(commands), choices=list(commands), help="The servers"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 8, 32], help="The concurrent clients"
+    )
+    parser.add_argument("--seconds", type=float, default=10, help="The seconds per run")
+    parser.add_argument("--proxy", action="store_true", help="Include the sqlite_web proxy")
+    args = parser.parse_args()
+
+    if not os.path.exists("build/iedb.db"):
+        raise Exception("Run from the repository root after `make iedb`")
+    results = benchmark(args.servers, args.concurrency, args.seconds, args.proxy)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
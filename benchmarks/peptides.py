@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#
+# Benchmark similar sequence search on the epitope sequences:
+# pulling every sequence of the same length out of SQLite and comparing in Python,
+# against the packed index in build/peptides, with and without the pigeonhole prefilter.
+# Run from the repository root after `make peptides`.
+# Prints one JSON object with the median seconds per search for a sample of query sequences.
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "iedbtk"))
+import peptides  # noqa: E402
+
+
+def sql_hamming(cur, sequence, distance):
+    """Given a cursor, a sequence, and a maximum number of substitutions,
+    return the matching sequence IDs by comparing every same length sequence in Python."""
+    cur.execute(
+        "SELECT sequence_id, linear_sequence FROM sequence WHERE length(linear_sequence) = ?",
+        (len(sequence),),
+    )
+    return [
+        sequence_id
+        for sequence_id, other in cur.fetchall()
+        if sum(a != b for a, b in zip(sequence, other)) <= distance
+    ]
+
+
+def scan_hamming(index, sequence, distance):
+    """Given a loaded index, a sequence, and a maximum number of substitutions,
+    return the matching sequence IDs by counting mismatches for every row, with no prefilter."""
+    group = index[len(sequence)]
+    query = peptides.numpy.array(peptides.pack(sequence), dtype=peptides.numpy.uint64)
+    found = peptides.mismatches(peptides.numpy.asarray(group["words"]), query)
+    return group["ids"][found <= distance].tolist()
+
+
+def median_seconds(function, queries, *args):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query, *args)
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times), 5)
+
+
+def benchmark(db_path, index_path, sample=20, distances=(0, 1, 2, 3)):
+    start = time.perf_counter()
+    index = peptides.load_index(index_path, db_path)
+    if index is None:
+        raise Exception(f"No current index in {index_path}; run `make peptides`")
+    results = {
+        "load_index": round(time.perf_counter() - start, 4),
+        "sequences": {length: len(group["ids"]) for length, group in sorted(index.items())},
+        "seconds": {},
+    }
+
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        cur = conn.cursor()
+        # Query with common lengths by sampling existing sequences
+        random.seed(0)
+        cur.execute("SELECT linear_sequence FROM sequence")
+        sequences = [row[0] for row in cur.fetchall()]
+        queries = [s.upper() for s in random.sample(sequences, min(sample, len(sequences)))]
+
+        for distance in distances:
+            results["seconds"][f"hamming/{distance}"] = {
+                "sqlite_python": median_seconds(
+                    lambda q, d: sql_hamming(cur, q, d), queries, distance
+                ),
+                "packed_scan": median_seconds(
+                    lambda q, d: scan_hamming(index, q, d), queries, distance
+                ),
+                "packed_pigeonhole": median_seconds(
+                    lambda q, d: peptides.hamming(index, q, d), queries, distance
+                ),
+            }
+        results["seconds"]["blosum62/top50"] = {
+            "packed": median_seconds(lambda q: peptides.blosum(index, q, 50), queries)
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark similar sequence search")
+    parser.add_argument("--db", type=str, default="build/iedb.db", help="The SQLite database")
+    parser.add_argument("--index", type=str, default="build/peptides", help="The packed index")
+    parser.add_argument("--sample", type=int, default=20, help="The number of query sequences")
+    args = parser.parse_args()
+
+    results = benchmark(args.db, args.index, args.sample)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# Benchmark the offline build pipeline on synthetic inputs from fixtures.py at several sizes:
+# fetch.py against a local SQLite copy of the IEDB tables, the build/source.db import,
+# the taxdmp TSVs and taxdmp.sql, organism.sql, the weights, active.sql,
+# search.sql, sequence.sql, trees.sql, `ncbitaxon2tsv.py convert`, and rdf2tsv.
+# Each stage runs its Makefile recipe in DIRECTORY/<rows>/, without the build cache.
+# Prints one JSON object with the seconds, peak RSS, and rows per second of each stage
+# at each size, how each stage scales with the size (1.0 is linear),
+# and with --baseline, the stages that got slower or bigger than a stored result.
+
+import argparse
+import gzip
+import importlib.util
+import json
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import fixtures
+import report
+
+taxdmp_names = ["nodes", "names", "citations", "merged", "delnodes"]
+
+# Each stage runs from this small process, which prints the peak RSS of the stage:
+# a child starts from the peak RSS of the process that forked it, so a stage run directly
+# from the benchmark would never report less than the benchmark itself.
+launcher = """
+import resource, subprocess, sys
+command = ["bash", "-eu", "-o", "pipefail", "-c", sys.argv[1]]
+code = subprocess.call(command, stdout=subprocess.DEVNULL)
+print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+sys.exit(code)
+"""
+
+
+def count_table(path, *tables):
+    """Given a SQLite database and table names, return their total rows."""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        return sum(conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in tables)
+
+
+def count_lines(*paths, header=True):
+    """Given (gzipped) text files, return their total lines, less a header line for each."""
+    total = 0
+    for path in paths:
+        with gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb") as f:
+            total += sum(1 for _ in f) - (1 if header else 0)
+    return total
+
+
+def stages(tables):
+    """Given the IEDB table names, return a list of (name, shell command, row count function)
+    for the stages of the build, in order."""
+    iedb_tsvs = [f"cache/iedb/{table}.tsv.gz" for table in tables]
+    taxdmp_tsvs = [f"build/taxdmp/{name}.tsv" for name in taxdmp_names]
+    result = [
+        (
+            "fetch",
+            "export BENCH_CLIENT=sqlite BENCH_DATABASE=build/upstream.db; "
+            + "; ".join(
+                f"python3 src/iedbtk/fetch.py BENCH {table} | gzip > cache/iedb/{table}.tsv.gz"
+                for table in tables
+            ),
+            lambda: count_lines(*iedb_tsvs),
+        ),
+        (
+            "source.db",
+            "rm -f build/source.db && make --no-print-directory build/source.db",
+            lambda: count_table("build/source.db", *tables),
+        ),
+        (
+            "taxdmp_tsv",
+            "mkdir -p build/taxdmp; "
+            + "; ".join(
+                f"python3 src/iedbtk/ncbitaxon2tsv.py tsv cache/taxdmp.zip {name} "
+                f"build/taxdmp/{name}.tsv"
+                for name in taxdmp_names
+            )
+            + "; python3 src/iedbtk/ncbitaxon2tsv.py intervals cache/taxdmp.zip "
+            "build/taxdmp/intervals.tsv",
+            lambda: count_lines(*taxdmp_tsvs, header=False),
+        ),
+        (
+            "taxdmp.sql",
+            "rm -f build/taxdmp.db && sqlite3 build/taxdmp.db < src/iedbtk/taxdmp.sql",
+            lambda: count_table("build/taxdmp.db", *taxdmp_names, "intervals"),
+        ),
+        (
+            "organism.sql",
+            "rm -f build/organism.db && sqlite3 build/organism.db < src/iedbtk/organism.sql",
+            lambda: count_table("build/organism.db", "statements"),
+        ),
+        (
+            "weights",
+            "python3 src/iedbtk/ncbitaxon2tsv.py weights build/source.db cache/weights.tsv",
+            lambda: count_table("build/source.db", "simple_search"),
+        ),
+        (
+            "active.sql",
+            "rm -f build/trees.db && cp build/organism.db build/trees.db "
+            "&& sqlite3 build/trees.db < src/iedbtk/active.sql",
+            lambda: count_table("build/trees.db", "active"),
+        ),
+        (
+            "search.sql",
+            "rm -f build/iedb.db && sqlite3 build/iedb.db < src/iedbtk/search.sql",
+            lambda: count_table("build/source.db", *tables),
+        ),
+        (
+            "sequence.sql",
+            "sqlite3 build/iedb.db < src/iedbtk/sequence.sql",
+            lambda: count_table("build/iedb.db", "sequence_kmer", "cdr3_kmer"),
+        ),
+        (
+            "trees.sql",
+            "sqlite3 build/iedb.db < src/iedbtk/trees.sql",
+            lambda: count_table(
+                "build/iedb.db", "organism_tree", "nonpeptide_tree", "nonpeptide_old_tree"
+            ),
+        ),
+        (
+            "ncbitaxon2tsv_convert",
+            "rm -rf build/ncbitaxon && mkdir build/ncbitaxon "
+            "&& python3 src/iedbtk/ncbitaxon2tsv.py convert "
+            "cache/taxdmp.zip cache/weights.tsv build/ncbitaxon",
+            lambda: count_table("build/taxdmp.db", "nodes"),
+        ),
+    ]
+    if importlib.util.find_spec("rdflib"):
+        result.append(
+            (
+                "rdf2tsv",
+                "python3 src/iedbtk/rdf2tsv.py data2/prefixes.tsv build/bench.ttl build/bench.tsv",
+                lambda: count_lines("build/bench.tsv"),
+            )
+        )
+    else:
+        print("Skipping rdf2tsv: rdflib is not installed", file=sys.stderr)
+    return result
+
+
+def run(command):
+    """Given a shell command, run it in the current directory
+    and return its seconds and the peak RSS in KB of its processes."""
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-c", launcher, command], capture_output=True, text=True
+    )
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise Exception(f"Failed ({process.returncode}): {command}\n{process.stderr}")
+    return seconds, int(process.stdout)
+
+
+def benchmark(directory, rows, taxa, seed=0):
+    """Given a directory, the sizes, and a seed, generate the inputs there,
+    run each stage, and return a dict from stage name to its measurements."""
+    fixtures.generate(directory, rows, taxa, seed)
+    os.chdir(directory)
+    fixtures.write_upstream("build/upstream.db", "cache/iedb")
+    fixtures.write_rdf("build/bench.ttl", max(1000, taxa // 10), seed)
+    tables = sorted(name[: -len(".tsv.gz")] for name in os.listdir("cache/iedb"))
+
+    results = {}
+    for name, command, count in stages(tables):
+        seconds, max_rss_kb = run(command)
+        count = count()
+        results[name] = {
+            "seconds": round(seconds, 3),
+            "max_rss_kb": max_rss_kb,
+            "rows": count,
+            "rows_per_second": round(count / seconds, 1) if seconds else None,
+        }
+        print(f"{rows} {name}: {seconds:.2f}s", file=sys.stderr)
+    return results
+
+
+def scaling(results):
+    """Given results by size, return for each stage the exponent of its seconds
+    against the size, between the smallest and the largest size: 1.0 is linear."""
+    sizes = sorted(results, key=int)
+    if len(sizes) < 2:
+        return {}
+    small, large = results[sizes[0]], results[sizes[-1]]
+    ratio = math.log(int(sizes[-1]) / int(sizes[0]))
+    return {
+        name: round(math.log(large[name]["seconds"] / small[name]["seconds"]) / ratio, 2)
+        for name in small
+        if name in large and small[name]["seconds"] > 0 and large[name]["seconds"] > 0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the offline build pipeline")
+    parser.add_argument("directory", type=str, help="The directory to build in")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[20000, 100000], help="The simple_search rows"
+    )
+    parser.add_argument(
+        "--taxa-per-row", type=float, default=1.0, help="The taxonomy nodes per row"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="The random seed")
+    parser.add_argument("--baseline", type=str, help="A stored result to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="The slowdown that counts as a regression"
+    )
+    args = parser.parse_args()
+
+    baseline = report.load_baseline(args.baseline) if args.baseline else None
+    directory = os.path.abspath(args.directory)
+    results = {}
+    for rows in args.sizes:
+        taxa = max(1000, int(rows * args.taxa_per_row))
+        results[str(rows)] = benchmark(os.path.join(directory, str(rows)), rows, taxa, args.seed)
+    output = {
+        "metadata": report.metadata(
+            directory=directory, taxa_per_row=args.taxa_per_row, seed=args.seed
+        ),
+        "results": results,
+        "scaling": scaling(results),
+    }
+    if baseline:
+        output["regressions"] = report.compare(
+            results, baseline, keys=("seconds", "max_rss_kb"), threshold=args.threshold
+        )
+    json.dump(output, sys.stdout, indent=2)
+    print()
+    if baseline and output["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
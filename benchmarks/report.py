@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Shared helpers for the benchmark scripts:
+# latency summaries, a description of the build being measured,
+# and comparison of a result against a stored baseline.
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+repository = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def summarize(times):
+    """Given a list of seconds, return the count, p50, p99, mean, and calls per second."""
+    times = sorted(times)
+    total = sum(times)
+    return {
+        "n": len(times),
+        "p50": round(statistics.median(times), 6),
+        "p99": round(times[min(len(times) - 1, int(len(times) * 0.99))], 6),
+        "mean": round(total / len(times), 6),
+        "per_second": round(len(times) / total, 1) if total else None,
+    }
+
+
+def measure(function, repeat, setup=None):
+    """Given a function of no arguments, a number of calls, and an optional setup function
+    to run untimed before each call, return the summary of the call times."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def metadata(**extra):
+    """Return a description of this build: the commit, Python, platform, and the time."""
+    try:
+        commit = subprocess.run(
+            ["git", "-C", repository, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **extra,
+    }
+
+
+def compare(results, baseline, keys=("p50", "p99"), threshold=0.2, path=""):
+    """Given nested result and baseline dicts, the keys to compare, and a threshold,
+    return a list of the values that are more than the threshold worse than the baseline.
+    Every key is a cost: lower is better."""
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if isinstance(value, dict) and isinstance(old, dict):
+            regressions += compare(value, old, keys, threshold, f"{path}{name}/")
+        elif name in keys and isinstance(value, (int, float)) and isinstance(old, (int, float)):
+            if old > 0 and value > old * (1 + threshold):
+                regressions.append(
+                    {
+                        "path": f"{path}{name}",
+                        "baseline": old,
+                        "current": value,
+                        "ratio": round(value / old, 2),
+                    }
+                )
+    return regressions
+
+
+def load_baseline(path):
+    """Given the path to a stored result, return its results, or exit if it cannot be read."""
+    try:
+        with open(path) as baseline:
+            return json.load(baseline)["results"]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Cannot read baseline {path}: {e}", file=sys.stderr)
+        sys.exit(2)
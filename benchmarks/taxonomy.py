@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+# Benchmark the taxonomy build and tree transforms in ncbitaxon2tsv
+# on a real taxdmp.zip (by default the full NCBI dump in cache/taxdmp.zip).
+# Prints one JSON object with seconds per step, node counts, and peak RSS.
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "iedbtk"))
+import ncbitaxon2tsv  # noqa: E402
+
+
+def timed(results, name, function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    results["seconds"][name] = round(time.perf_counter() - start, 3)
+    return value
+
+
+def benchmark(taxdmp_path, weights_path=None, sample=50000, subtree=10239):
+    results = {"taxdmp": taxdmp_path, "seconds": {}, "nodes": {}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with zipfile.ZipFile(taxdmp_path) as taxdmp:
+            taxonomy = timed(results, "build_taxonomy", ncbitaxon2tsv.build_taxonomy, taxdmp)
+        taxonomy_path = os.path.join(tmpdir, "taxonomy.bin")
+        timed(results, "save_taxonomy", ncbitaxon2tsv.save_taxonomy, taxonomy, taxonomy_path)
+        taxonomy = timed(results, "load_taxonomy", ncbitaxon2tsv.load_taxonomy, taxonomy_path)
+        parents = taxonomy["parents"]
+        results["nodes"]["taxonomy"] = sum(1 for parent in parents if parent)
+
+        if weights_path:
+            weights = ncbitaxon2tsv.read_weights(weights_path)
+        else:
+            random.seed(0)
+            tax_ids = [tax_id for tax_id, parent in enumerate(parents) if parent]
+            weights = {tax_id: 1 for tax_id in random.sample(tax_ids, min(sample, len(tax_ids)))}
+
+        tree = timed(results, "build_tree", ncbitaxon2tsv.build_tree, taxonomy, weights)
+        results["nodes"]["active"] = len(tree["ids"])
+        pruned = timed(results, "prune_poles", ncbitaxon2tsv.prune_poles, tree)
+        results["nodes"]["pruned"] = len(pruned["ids"])
+        collapsed = timed(results, "collapse_poles", ncbitaxon2tsv.collapse_poles, tree)
+        results["nodes"]["collapsed"] = len(collapsed["ids"])
+        if ncbitaxon2tsv.find_node(tree, subtree) >= 0:
+            extracted = timed(
+                results, "extract_subtree", ncbitaxon2tsv.extract_subtree, tree, subtree
+            )
+            results["nodes"]["subtree"] = len(extracted["ids"])
+
+        tsv_path = os.path.join(tmpdir, "active.tsv")
+        timed(results, "write_tree_tsv", ncbitaxon2tsv.write_tree, tree, tsv_path)
+        db_path = os.path.join(tmpdir, "trees.db")
+        timed(results, "write_tree_sqlite", ncbitaxon2tsv.write_tree, tree, db_path, "active")
+
+    results["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ncbitaxon2tsv tree code")
+    parser.add_argument(
+        "taxdmp", type=str, nargs="?", default="cache/taxdmp.zip", help="The taxdmp.zip file"
+    )
+    parser.add_argument("--weights", type=str, help="A weights TSV (default: random taxa)")
+    parser.add_argument("--sample", type=int, default=50000, help="The number of random taxa")
+    parser.add_argument("--subtree", type=int, default=10239, help="The tax_id to extract")
+    args = parser.parse_args()
+
+    results = benchmark(args.taxdmp, args.weights, args.sample, args.subtree)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
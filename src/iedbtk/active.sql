@@ -0,0 +1,64 @@
+-- # Define tables
+
+DROP TABLE IF EXISTS weights;
+CREATE TABLE weights (
+  id INT,
+  weight INT
+);
+
+DROP TABLE IF EXISTS active;
+CREATE TABLE active (
+  id TEXT PRIMARY KEY,
+  label TEXT,
+  parent TEXT,
+  weight INT,
+  total INT,
+  lft INT,
+  rgt INT,
+  depth INT
+);
+
+
+-- # Import data
+
+.mode tabs
+.import cache/weights.tsv weights
+
+ATTACH DATABASE 'build/taxdmp.db' AS taxdmp;
+
+
+-- # Fill tables
+
+-- Number the weighted nodes with their preorder position.
+CREATE TEMP TABLE weighted AS
+SELECT intervals.lft, weights.weight
+FROM weights JOIN intervals ON intervals.tax_id = weights.id;
+CREATE INDEX temp.weighted_lft ON weighted(lft);
+
+-- A node is active when its interval contains a weighted node,
+-- and its total is the sum of the weights in its interval:
+-- one range scan on weighted_lft per node, no recursion.
+INSERT INTO active(id, label, parent, weight, total, lft, rgt, depth)
+SELECT "NCBITaxon:" || i.tax_id,
+       names.name_txt,
+       "NCBITaxon:" || nodes.parent_tax_id,
+       coalesce(weights.weight, 0),
+       i.total,
+       i.lft,
+       i.rgt,
+       i.depth
+FROM (
+  SELECT intervals.*,
+         (SELECT SUM(weighted.weight) FROM weighted
+          WHERE weighted.lft BETWEEN intervals.lft AND intervals.rgt) AS total
+  FROM intervals
+) AS i
+LEFT JOIN weights ON weights.id = i.tax_id
+JOIN nodes ON nodes.tax_id = i.tax_id
+JOIN names ON names.tax_id = i.tax_id
+WHERE i.total IS NOT NULL
+  AND names.name_class = "scientific name";
+
+CREATE INDEX active_lft ON active(lft, rgt);
+
+--SELECT * FROM active LIMIT 3;
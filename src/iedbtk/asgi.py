@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+#
+# An ASGI entry point for server.py, run with `src/iedbtk/asgi.py` from the repository root
+# or with any ASGI server, e.g. `uvicorn --app-dir src/iedbtk asgi:app`.
+#
+# The event loop only accepts connections and moves bytes.
+# Every Flask route runs unchanged in a bounded pool of threads,
+# so slow SQLite queries wait their turn in the pool instead of holding a connection's worker,
+# and SQLite releases the GIL while it works, so the threads run queries in parallel.
+# The sqlite_web proxy routes are answered here with an async HTTP client instead,
+# so streaming a large table from sqlite_web does not hold a thread at all.
+
+import argparse
+import asyncio
+import io
+import re
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import httpx
+
+import server
+
+# The threads that run the Flask routes, and so every SQLite query
+threads = 8
+pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="sqlite")
+
+# One async client per sqlite_web upstream, created on the event loop when first needed
+proxy_clients = {}
+proxy_path = re.compile(r"^/([^/]+)\.db/(.*)$", re.DOTALL)
+
+
+async def read_body(receive):
+    """Given an ASGI receive function, return the whole request body."""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def wsgi_environ(scope, body):
+    """Given an ASGI HTTP scope and the request body, return a WSGI environ for the same request."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name in ["CONTENT_TYPE", "CONTENT_LENGTH"]:
+            environ[name] = value
+            continue
+        name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
+
+
+def run_wsgi(environ):
+    """Given a WSGI environ, run the Flask app on it in this thread
+    and return the status code, the headers, and the whole body.
+    The routes that remain on this path return small pages, so the body is not streamed."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = headers
+
+    result = server.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], body
+
+
+async def send_response(send, status, headers, body):
+    """Given an ASGI send function, a status code, a list of string header pairs, and a body,
+    send the whole response."""
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(name.encode("latin1"), value.encode("latin1")) for name, value in headers],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def proxy_client(db):
+    """Given a database name, return the async client for its sqlite_web server."""
+    if db not in proxy_clients:
+        connect, read = server.proxy_timeout
+        proxy_clients[db] = httpx.AsyncClient(
+            base_url=f"http://localhost:{server.ports[db]}",
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+        )
+    return proxy_clients[db]
+
+
+async def proxy(scope, receive, send, db, path):
+    """Proxy one request to a sqlite_web server, like server.proxy(),
+    streaming the upstream body through without holding a thread."""
+    upstream = f"http://localhost:{server.ports[db]}"
+    headers = [
+        (name.decode("latin1"), value.decode("latin1"))
+        for name, value in scope["headers"]
+        if name.decode("latin1").lower() not in server.proxy_request_headers
+    ]
+    # The body passes through as is, so only ask for encodings that the client accepts
+    accept = [value for name, value in scope["headers"] if name.lower() == b"accept-encoding"]
+    headers.append(("Accept-Encoding", b", ".join(accept).decode("latin1") or "identity"))
+    body = await read_body(receive) if scope["method"] == "POST" else None
+    url = scope["raw_path"].decode("latin1") if scope.get("raw_path") else quote(scope["path"])
+    if scope["query_string"]:
+        url += "?" + scope["query_string"].decode("latin1")
+
+    client = proxy_client(db)
+    start = time.perf_counter()
+    try:
+        resp = await client.send(
+            client.build_request(scope["method"], url, content=body, headers=headers),
+            stream=True,
+        )
+    except httpx.TimeoutException:
+        server.count_proxy(db, time.perf_counter() - start, error=True)
+        await send_response(send, 504, [], f"Timed out waiting for {db}.db".encode())
+        return
+    except httpx.TransportError:
+        server.count_proxy(db, time.perf_counter() - start, error=True)
+        await send_response(send, 502, [], f"Could not connect to {db}.db".encode())
+        return
+    server.count_proxy(db, time.perf_counter() - start, error=resp.status_code >= 500)
+
+    try:
+        headers = []
+        for name, value in resp.headers.raw:
+            if name.decode("latin1").lower() in server.proxy_response_headers:
+                continue
+            if name.lower() == b"location":
+                value = value.replace(upstream.encode(), b"")
+            headers.append((name, value))
+        await send({"type": "http.response.start", "status": resp.status_code, "headers": headers})
+        async for chunk in resp.aiter_raw(server.proxy_chunk_size):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        await resp.aclose()
+
+
+async def lifespan(receive, send):
+    """Handle the ASGI lifespan messages, closing the proxy clients on shutdown."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for client in proxy_clients.values():
+                await client.aclose()
+            proxy_clients.clear()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        raise Exception(f"Unsupported ASGI scope type '{scope['type']}'")
+
+    match = proxy_path.match(scope["path"])
+    if match and match.group(1) in server.ports:
+        await proxy(scope, receive, send, match.group(1), match.group(2))
+        return
+
+    body = await read_body(receive)
+    loop = asyncio.get_running_loop()
+    status, headers, content = await loop.run_in_executor(pool, run_wsgi, wsgi_environ(scope, body))
+    await send_response(send, status, headers, content)
+
+
+def main():
+    global pool
+    parser = argparse.ArgumentParser(description="Run the IEDB server on an ASGI server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="The address to listen on")
+    parser.add_argument("--port", type=int, default=5005, help="The port to listen on")
+    parser.add_argument(
+        "--threads", type=int, default=threads, help="The threads for the Flask routes"
+    )
+    args = parser.parse_args()
+
+    import uvicorn
+
+    pool = ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix="sqlite")
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
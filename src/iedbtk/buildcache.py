@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+cache_dir = "cache/build"
+
+# Read inputs in blocks of this many bytes when hashing
+block_size = 1 << 20
+
+
+def digest(paths):
+    """Given a list of input paths, return a hex key for their contents.
+    Inputs that are already in the cache are keyed by name,
+    since their names already contain the key of their own inputs."""
+    h = hashlib.sha256()
+    for path in paths:
+        real_path = os.path.realpath(path)
+        name = os.path.basename(real_path)
+        h.update(name.encode("utf-8") + b"\0")
+        if os.path.dirname(real_path) == os.path.realpath(cache_dir):
+            continue
+        with open(real_path, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                h.update(block)
+        h.update(b"\0")
+    return h.hexdigest()[0:16]
+
+
+def prune(target, keep):
+    """Delete all but the `keep` most recently used cache entries for this target."""
+    name, ext = os.path.splitext(os.path.basename(target))
+    paths = glob.glob(os.path.join(cache_dir, f"{name}-*{ext}"))
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        os.remove(path)
+
+
+def cached(target, inputs, command, base=None, keep=2):
+    """Given a target path, a list of input paths, a shell command,
+    an optional base file to start from, and the number of entries to keep,
+    look for the target in the cache under the digest of the inputs.
+    On a miss, copy the base (if any) to a temporary file,
+    run the command with OUTPUT set to that file, and store the result.
+    Then point the target at the cache entry with a symbolic link."""
+    key = digest(inputs)
+    name, ext = os.path.splitext(os.path.basename(target))
+    path = os.path.join(cache_dir, f"{name}-{key}{ext}")
+    if os.path.exists(path):
+        print(f"Using cached {path} for {target}", file=sys.stderr)
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if base:
+            shutil.copyfile(os.path.realpath(base), tmp_path)
+        env = dict(os.environ, OUTPUT=tmp_path)
+        subprocess.run(command, shell=True, check=True, env=env)
+        os.replace(tmp_path, path)
+
+    # Touch the entry so that Make sees a fresh target and pruning sees a recent use
+    os.utime(path)
+    if os.path.lexists(target):
+        os.remove(target)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    os.symlink(os.path.relpath(path, os.path.dirname(target) or "."), target)
+    prune(target, keep)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build a target only when the digest of its inputs is not in the cache"
+    )
+    parser.add_argument("target", type=str, help="The file to build")
+    parser.add_argument("inputs", type=str, nargs="+", help="The files the target depends on")
+    parser.add_argument("--command", type=str, required=True, help="The shell command to run")
+    parser.add_argument("--base", type=str, help="A file to copy to OUTPUT before running")
+    parser.add_argument("--keep", type=int, default=2, help="The number of cache entries to keep")
+    args = parser.parse_args()
+
+    cached(args.target, args.inputs, args.command, args.base, args.keep)
+
+
+if __name__ == "__main__":
+    main()
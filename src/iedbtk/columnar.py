@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#
+# Write and query a columnar snapshot of the search, tcr, and bcr views.
+#
+# Every column is dictionary encoded:
+# `<table>.<column>.json` is the sorted list of distinct values, with NULL first,
+# and `<table>.<column>.i32` holds one int32 code per row, indexing that list.
+# Since the dictionary is sorted in SQLite order, comparing codes compares values.
+# Writing only needs the standard library; querying needs NumPy, which is optional.
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+snapshot_tables = ["search", "tcr", "bcr"]
+
+# Row keys that no query groups or filters by
+skip_columns = {"search_id"}
+manifest_name = "manifest.json"
+
+
+def write_dictionary(cur, table, column, outdir):
+    """Given a cursor, a table and column name, and an output directory,
+    write the sorted dictionary file for that column,
+    and return a dict from value to code."""
+    values = [None]
+    for (value,) in cur.execute(f'SELECT DISTINCT "{column}" FROM {table} ORDER BY 1'):
+        if value is not None:
+            values.append(value)
+    with open(os.path.join(outdir, f"{table}.{column}.json"), "w") as f:
+        json.dump(values, f)
+    return {value: code for code, value in enumerate(values)}
+
+
+def write_table(cur, table, outdir):
+    """Given a cursor, a table or view name, and an output directory,
+    write the dictionary and codes files for each column,
+    and return the number of rows and a dict from column name to dictionary size."""
+    columns = []
+    for row in cur.execute(f"PRAGMA table_info({table})").fetchall():
+        if row[1] not in skip_columns:
+            columns.append(row[1])
+    dictionaries = [write_dictionary(cur, table, column, outdir) for column in columns]
+
+    # Encode every column from one scan, so the codes files line up row by row
+    files = [open(os.path.join(outdir, f"{table}.{column}.i32"), "wb") for column in columns]
+    rows = 0
+    try:
+        cur.execute(f"SELECT {', '.join(columns)} FROM {table}")
+        while True:
+            batch = cur.fetchmany(100000)
+            if not batch:
+                break
+            rows += len(batch)
+            for f, dictionary, values in zip(files, dictionaries, zip(*batch)):
+                array("i", [dictionary[value] for value in values]).tofile(f)
+    finally:
+        for f in files:
+            f.close()
+    return rows, {column: len(d) for column, d in zip(columns, dictionaries)}
+
+
+def write_snapshot(db_path, outdir, tables=snapshot_tables):
+    """Given a SQLite database path, an output directory, and a list of table names,
+    write a dictionary encoded snapshot of each table and a manifest."""
+    os.makedirs(outdir, exist_ok=True)
+    stat = os.stat(db_path)
+    manifest = {"source": {"mtime": stat.st_mtime, "size": stat.st_size}, "tables": {}}
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        cur = conn.cursor()
+        for table in tables:
+            rows, columns = write_table(cur, table, outdir)
+            manifest["tables"][table] = {"rows": rows, "columns": columns}
+
+    # Write the manifest last, so a partial snapshot is never loaded
+    tmp_path = os.path.join(outdir, manifest_name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(outdir, manifest_name))
+
+
+def load_snapshot(path, db_path=None):
+    """Given a snapshot directory and optionally the database it was written from,
+    return a dict from table name to a dict with "rows", "codes", and "values",
+    or None when NumPy is missing, there is no snapshot, or it is older than the database."""
+    manifest_path = os.path.join(path, manifest_name)
+    if numpy is None or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if db_path:
+        stat = os.stat(db_path)
+        source = manifest["source"]
+        if source["mtime"] != stat.st_mtime or source["size"] != stat.st_size:
+            return None
+
+    snapshot = {}
+    for table, info in manifest["tables"].items():
+        codes = {}
+        values = {}
+        for column in info["columns"]:
+            codes_path = os.path.join(path, f"{table}.{column}.i32")
+            if info["rows"]:
+                codes[column] = numpy.memmap(codes_path, dtype=numpy.int32, mode="r")
+            else:
+                codes[column] = numpy.zeros(0, dtype=numpy.int32)
+            with open(os.path.join(path, f"{table}.{column}.json")) as f:
+                values[column] = json.load(f)
+        snapshot[table] = {"rows": info["rows"], "codes": codes, "values": values}
+    return snapshot
+
+
+def encode(table, column, value):
+    """Given a snapshot table, a column name, and a value,
+    return the code for that value, or -1 if it does not occur."""
+    values = table["values"][column]
+    try:
+        code = bisect_left(values, value, 1)
+    except TypeError:
+        # Columns that mix integers and text are sorted in SQLite order
+        return values.index(value) if value in values else -1
+    if code < len(values) and values[code] == value:
+        return code
+    return -1
+
+
+def code_range(table, column, low, high):
+    """Given a snapshot table, a column name, and low and high values,
+    return the (first, last) codes of the values between them, inclusive."""
+    values = table["values"][column]
+    return bisect_left(values, low, 1), bisect_right(values, high, 1) - 1
+
+
+def aggregate(table, mask, spec, limit=None, offset=0):
+    """Given a snapshot table, a boolean array of the rows to use,
+    a spec dict with "group by", "columns", "counts", "order by",
+    and optionally "first" (see server.snapshot_tabs), and a limit and offset,
+    return a list of row dicts like the matching GROUP BY query would.
+    The columns come from the first row of each group,
+    or from its row with the lowest value of the "first" column.
+    Groups that tie in the order are sorted by their "group by" value."""
+    codes = table["codes"]
+    values = table["values"]
+    rows = numpy.flatnonzero(mask)
+    if "first" in spec:
+        rows = rows[numpy.lexsort((codes[spec["first"]][rows], codes[spec["group by"]][rows]))]
+    groups, first, inverse = numpy.unique(
+        codes[spec["group by"]][rows], return_index=True, return_inverse=True
+    )
+    inverse = inverse.reshape(-1).astype(numpy.int64)
+
+    # count(distinct column) per group: sort (group, code) pairs, drop repeats, count per group
+    counts = {}
+    for alias, column in spec.get("counts", {}).items():
+        column_codes = codes[column][rows]
+        present = column_codes != 0
+        size = len(values[column])
+        pairs = numpy.sort(inverse[present] * size + column_codes[present])
+        distinct = numpy.ones(len(pairs), dtype=bool)
+        distinct[1:] = pairs[1:] != pairs[:-1]
+        pairs = pairs[distinct]
+        counts[alias] = numpy.bincount(pairs // size, minlength=len(groups))
+
+    alias, descending = spec["order by"]
+    if alias in counts:
+        key = counts[alias]
+    else:
+        key = codes[spec["columns"][alias]][rows[first]].astype(numpy.int64)
+    if descending:
+        key = -key
+    order = numpy.lexsort((groups, key))
+    if limit:
+        order = order[offset : offset + limit]
+
+    result = []
+    for group in order.tolist():
+        row = rows[first[group]]
+        record = {}
+        for alias, column in spec["columns"].items():
+            record[alias] = values[column][codes[column][row]]
+        for alias in counts:
+            record[alias] = int(counts[alias][group])
+        result.append(record)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a columnar snapshot of search tables")
+    parser.add_argument("db", type=str, help="The SQLite database, e.g. build/iedb.db")
+    parser.add_argument("output", type=str, help="The output directory, e.g. build/snapshot")
+    parser.add_argument(
+        "tables", type=str, nargs="*", default=snapshot_tables, help="The tables to write"
+    )
+    args = parser.parse_args()
+
+    write_snapshot(args.db, args.output, args.tables)
+    print(f"Wrote {len(args.tables)} tables to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,18 @@
 
 import argparse
 import csv
-import cx_Oracle
 import math
 import os
 import pymysql
 import re
+import sqlite3
 import sys
 
+try:
+    import cx_Oracle
+except ImportError:
+    cx_Oracle = None
+
 
 limit = 10000
 
@@ -25,8 +30,17 @@ def connect(namespace):
 
     if not client:
         raise Exception(f"Missing required value for '{namespace}_CLIENT'")
-    if client not in ["mysql", "sqlplus"]:
+    if client not in ["mysql", "sqlplus", "sqlite"]:
         raise Exception(f"Unsuported client '{client}'")
+    if client == "sqlite":
+        # A local SQLite copy of the tables stands in for the server, e.g. for benchmarks
+        if not database:
+            raise Exception(f"Missing required value for '{namespace}_DATABASE'")
+        conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+        conn.row_factory = lambda cur, row: dict(zip([d[0].lower() for d in cur.description], row))
+        return conn.cursor()
+    if client == "sqlplus" and not cx_Oracle:
+        raise Exception(f"The cx_Oracle module is required for '{client}'")
     if not host:
         raise Exception(f"Missing required value for '{namespace}_HOST'")
     if not user:
@@ -72,7 +86,7 @@ def fetch(cur, query, output=sys.stdout, start=0):
     writer = None
     offset = start
     while True:
-        if isinstance(cur, cx_Oracle.Cursor):
+        if cx_Oracle and isinstance(cur, cx_Oracle.Cursor):
             cur.execute(f"{query} OFFSET {offset} ROWS FETCH NEXT {limit} ROWS ONLY")
             cur.rowfactory = lambda *args: dict(zip([d[0].lower() for d in cur.description], args))
         else:
@@ -111,8 +125,11 @@ def fetch_table(args):
 
     query = f"SELECT {columns} FROM {table} {where}"
 
-    with connect(args.namespace) as cur:
+    cur = connect(args.namespace)
+    try:
         fetch(cur, query, args.output)
+    finally:
+        cur.close()
 
 
 def main():
@@ -2,13 +2,20 @@
 
 import argparse
 import csv
-import io
+import json
+import mmap
 import os
-import uuid
+import sqlite3
+import struct
+import sys
 import zipfile
 
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
 from datetime import date
+from hashlib import blake2b
+from itertools import islice
 
 oio = {
     "SynonymTypeProperty": "synonym_type_property",
@@ -97,18 +104,111 @@ nodes_fields = [
     "comments",  # free-text comments and citations
 ]
 
-def count_epitopes(object_path):
-    epitope_counts = defaultdict(int)
+names_fields = [
+    "tax_id",  # the id of node associated with this name
+    "name_txt",  # name itself
+    "unique_name",  # the unique variant of this name if name not unique
+    "name_class",  # (synonym, common name, ...)
+]
+
+merged_fields = [
+    "old_tax_id",  # id of nodes which has been merged
+    "new_tax_id",  # id of nodes which is result of merging
+]
+
+delnodes_fields = [
+    "tax_id",  # deleted node id
+]
+
+citations_fields = [
+    "cit_id",  # the unique id of citation
+    "cit_key",  # citation key
+    "pubmed_id",  # unique id in PubMed database (0 if not in PubMed)
+    "medline_id",  # unique id in MedLine database (0 if not in MedLine)
+    "url",  # URL associated with citation
+    "text",  # any text (usually article name and authors)
+    "taxid_list",  # list of node ids separated by a single space
+]
+
+dmp_fields = {
+    "nodes": nodes_fields,
+    "names": names_fields,
+    "merged": merged_fields,
+    "delnodes": delnodes_fields,
+    "citations": citations_fields,
+}
+
+# Read the dumps in blocks of this many bytes
+dmp_block_size = 1 << 22
+
+# Count the distinct epitopes for each source organism.
+# The same query works for source.db (the simple_search table) and iedb.db (the search view).
+weights_query = """
+SELECT CAST(replace(source_organism_id, 'NCBITaxon:', '') AS INTEGER) AS tax_id,
+       count(DISTINCT structure_id) AS weight
+FROM {table}
+WHERE source_organism_id != ''
+  AND structure_id != ''
+GROUP BY tax_id
+HAVING tax_id > 0
+ORDER BY tax_id"""
+
+# Count object rows in batches of this many rows
+weights_batch_size = 100000
+
+
+def count_weights(db_path, output):
+    """Given the path to build/source.db or build/iedb.db and an output TSV file,
+    count epitopes per organism with a single GROUP BY
+    and stream the tax_id and weight rows to the output."""
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name = 'search'"
+        )
+        table = "search" if cur.fetchone() else "simple_search"
+        cur.execute(weights_query.format(table=table))
+        writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+        while True:
+            rows = cur.fetchmany(weights_batch_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+
+
+def count_epitopes(object_path, output):
+    """Given the path to an object table TSV and an output TSV file,
+    count the epitope objects per organism, reading the table in batches,
+    and write the tax_id and weight rows to the output."""
+    epitope_counts = Counter()
     with open(object_path) as tsv:
-        rows = csv.DictReader(tsv, delimiter="\t")
-        for row in rows:
-            if not row["epitope_id"]:
-                continue
-            tax_id = row["organism_id"] or row["organism2_id"] # or row["mol1_source_id"] or row["mol2_source_id"]
-            if not tax_id:
-                continue
-            epitope_counts[tax_id] += 1
-    return epitope_counts
+        rows = csv.reader(tsv, delimiter="\t")
+        headers = next(rows)
+        epitope = headers.index("epitope_id")
+        organism = headers.index("organism_id")
+        organism2 = headers.index("organism2_id")
+        while True:
+            batch = list(islice(rows, weights_batch_size))
+            if not batch:
+                break
+            # or row["mol1_source_id"] or row["mol2_source_id"]
+            epitope_counts.update(
+                row[organism] or row[organism2]
+                for row in batch
+                if row[epitope] and (row[organism] or row[organism2])
+            )
+    writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+    writer.writerows(sorted(epitope_counts.items(), key=lambda x: int(x[0])))
+
+
+def read_weights(weights_path):
+    """Given the path to a weights TSV with tax_id and weight columns and no header,
+    return a dictionary from integer tax_id to integer weight."""
+    weights = {}
+    with open(weights_path) as tsv:
+        for tax_id, weight in csv.reader(tsv, delimiter="\t"):
+            weights[int(tax_id)] = int(weight)
+    return weights
 
 
 def escape_literal(text):
@@ -119,43 +219,60 @@ def label_to_id(text):
     return text.replace(" ", "_").replace("-", "_")
 
 
+# Statements are tuples in this column order
+statements_headers = ["zn", "sc", "sb", "pc", "oi", "oc", "ob", "ol", "dc", "lt"]
+
+synonym_types = {name_class: "ncbitaxon:" + label_to_id(name_class) for name_class in predicates}
+
+
+def synonym_bnode(sc, synonym, name_class):
+    """Return a blank node ID that is stable across runs for this synonym."""
+    key = f"{sc}\t{name_class}\t{synonym}".encode("utf-8")
+    return "_:" + blake2b(key, digest_size=8).hexdigest()
+
+
 def convert_synonyms(tax_id, synonyms):
     """Given a tax_id and list of synonyms,
-    return a Turtle string asserting triples and OWL annotations on them."""
+    return a list of statement tuples asserting the synonyms and OWL annotations on them."""
     output = []
+    sc = f"NCBITaxon:{tax_id}"
     for synonym, unique, name_class in synonyms:
-        if name_class not in predicates:
+        pc = predicates.get(name_class)
+        if not pc:
             continue
         synonym = escape_literal(synonym)
-        sc = f"NCBITaxon:{tax_id}"
-        sb = uuid.uuid4()
-        pc = predicates[name_class]
-        oc = "ncbitaxon:" + label_to_id(name_class)
+        sb = synonym_bnode(sc, synonym, name_class)
+        # zn, sc, sb, pc, oi, oc, ob, ol, dc, lt
         output += [
-            {"sc": sc, "pc": pc, "ol": synonym},
-            {"sb": sb, "pc": "rdf:type", "oc": "owl:Axiom"},
-            {"sb": sb, "pc": "owl:annotatedSource", "oc": sc},
-            {"sb": sb, "pc": "owl:annotatedProperty", "oc": pc},
-            {"sb": sb, "pc": "owl:annotatedTarget", "ol": synonym, "dc": "xsd:string"},
-            {"sb": sb, "pc": "oio:hasSynonymType", "oc": oc}]
+            (sc, sc, "", pc, "", "", "", synonym, "", ""),
+            (sc, "", sb, "rdf:type", "", "owl:Axiom", "", "", "", ""),
+            (sc, "", sb, "owl:annotatedSource", "", sc, "", "", "", ""),
+            (sc, "", sb, "owl:annotatedProperty", "", pc, "", "", "", ""),
+            (sc, "", sb, "owl:annotatedTarget", "", "", "", synonym, "xsd:string", ""),
+            (sc, "", sb, "oio:hasSynonymType", "", synonym_types[name_class], "", "", "", ""),
+        ]
     return output
 
 
 def convert_node(node, label, merged, synonyms, citations):
     """Given a node dictionary, a label string, and lists for merged, synonyms, and citations,
-    return a Turtle string representing this tax_id."""
+    return a list of statement tuples representing this tax_id."""
     tax_id = node["tax_id"]
     sc = f"NCBITaxon:{tax_id}"
     label = escape_literal(label)
+    browser_link = f"http://www.ncbi.nlm.nih.gov/Taxonomy/Browser/wwwtax.cgi?id={tax_id}"
+    # zn, sc, sb, pc, oi, oc, ob, ol, dc, lt
     output = [
-        {"sc": sc, "pc": "rdf:type", "oc": "owl:Class"},
-        {"sc": sc, "pc": "rdfs:label", "ol": label, "dc": "xsd:string"},
-        {"sc": sc, "pc": "iedb:browser-link", "oi": f"http://www.ncbi.nlm.nih.gov/Taxonomy/Browser/wwwtax.cgi?id={tax_id}"},
+        (sc, sc, "", "rdf:type", "", "owl:Class", "", "", "", ""),
+        (sc, sc, "", "rdfs:label", "", "", "", label, "xsd:string", ""),
+        (sc, sc, "", "iedb:browser-link", browser_link, "", "", "", "", ""),
     ]
 
     parent_tax_id = node["parent_tax_id"]
     if parent_tax_id and parent_tax_id != "" and parent_tax_id != tax_id:
-        output.append({"sc": sc, "pc": "rdfs:subClassOf", "oc": f"NCBITaxon:{parent_tax_id}"})
+        output.append(
+            (sc, sc, "", "rdfs:subClassOf", "", f"NCBITaxon:{parent_tax_id}", "", "", "", "")
+        )
 
     rank = node["rank"]
     if rank and rank != "" and rank != "no rank":
@@ -164,216 +281,703 @@ def convert_node(node, label, merged, synonyms, citations):
         rank = label_to_id(rank)
         # WARN: This is a special case for backward compatibility
         if rank in ["species_group", "species_subgroup"]:
-            output.append({"sc": sc, "pc": "ncbitaxon:has_rank", "oi": f"http://purl.obolibrary.org/obo/NCBITaxon#_{rank}"})
+            oi = f"http://purl.obolibrary.org/obo/NCBITaxon#_{rank}"
+            output.append((sc, sc, "", "ncbitaxon:has_rank", oi, "", "", "", "", ""))
         else:
-            output.append({"sc": sc, "pc": "ncbitaxon:has_rank", "oc": f"NCBITaxon:{rank}"})
+            oc = f"NCBITaxon:{rank}"
+            output.append((sc, sc, "", "ncbitaxon:has_rank", "", oc, "", "", "", ""))
 
     gc_id = node["genetic_code_id"]
     if gc_id:
-        output.append({"sc": sc, "pc": "oio:hasDbXref", "ol": f"GC_ID:{gc_id}", "dc": "xsd:string"})
+        output.append((sc, sc, "", "oio:hasDbXref", "", "", "", f"GC_ID:{gc_id}", "xsd:string", ""))
 
     for merge in merged:
-        output.append({"sc": sc, "pc": "oio:hasAlternativeId", "ol": f"NCBITaxon:{merge}", "dc": "xsd:string"})
+        ol = f"NCBITaxon:{merge}"
+        output.append((sc, sc, "", "oio:hasAlternativeId", "", "", "", ol, "xsd:string", ""))
 
     for pubmed_id in citations:
-        output.append({"sc": sc, "pc": "oio:hasDbXref", "ol": f"PMID:{pubmed_id}", "dc": "xsd:string"})
+        ol = f"PMID:{pubmed_id}"
+        output.append((sc, sc, "", "oio:hasDbXref", "", "", "", ol, "xsd:string", ""))
 
-    output.append({"sc": sc, "pc": "oio:hasOBONamespace", "ol": "ncbi_taxonomy", "dc": "xsd:string"})
+    output.append(
+        (sc, sc, "", "oio:hasOBONamespace", "", "", "", "ncbi_taxonomy", "xsd:string", "")
+    )
 
     output += convert_synonyms(tax_id, synonyms)
-    for row in output:
-        row["zn"] = sc
-
     return output
 
 
-def split_line(line):
-    """Split a line from a .dmp file"""
-    return [x.strip() for x in line.split("	|")]
+def read_dmp_blocks(dmp, block_size=None):
+    """Given a binary .dmp file object and an optional block size (default dmp_block_size),
+    yield blocks of bytes that each end on a complete line."""
+    block_size = block_size or dmp_block_size
+    rest = b""
+    while True:
+        block = dmp.read(block_size)
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind(b"\t|\n")
+        if end < 0:
+            # No line ends in this block yet, so carry all of it into the next one
+            rest = block
+            continue
+        end += 3
+        rest = block[end:]
+        yield block[:end]
+    if rest.strip():
+        yield rest.rstrip(b"\n") + b"\n"
+
+
+def read_dmp(taxdmp, name, fields=None):
+    """Given an open taxdmp.zip file, the name of a dump (nodes, names, merged, ...),
+    and an optional list of fields to keep,
+    read the dump in large blocks and yield a dictionary
+    from field name to a tuple of string values for each block."""
+    all_fields = dmp_fields[name]
+    fields = fields or all_fields
+    with taxdmp.open(f"{name}.dmp") as dmp:
+        for block in read_dmp_blocks(dmp):
+            text = block.decode("utf-8")
+            if text.endswith("\t|\n"):
+                text = text[:-3]
+            rows = [line.split("\t|\t") for line in text.split("\t|\n")]
+            columns = list(zip(*rows))
+            yield {field: columns[all_fields.index(field)] for field in fields}
+
+
+def dmp2tsv(taxdmp_path, name, output):
+    """Given the path to the taxdmp.zip file, the name of a dump, and a binary output file,
+    write the dump as TSV for SQLite: remove the pipes and escape the quotes."""
+    with zipfile.ZipFile(taxdmp_path) as taxdmp:
+        with taxdmp.open(f"{name}.dmp") as dmp:
+            for block in read_dmp_blocks(dmp):
+                output.write(block.replace(b"\t|", b"").replace(b'"', b'\\"'))
+
+
+def read_nodes(taxdmp):
+    """Given an open taxdmp.zip file,
+    read nodes.dmp into a compact taxonomy:
+    a dictionary of arrays indexed by integer tax_id,
+    with children in CSR layout (offsets into a single children array).
+    Use read_names to add the labels."""
+    tax_ids = array("i")
+    parent_ids = array("i")
+    rank_ids = array("B")
+    gc_ids = array("B")
+    rank_names = ["no rank"]
+    rank_index = {"no rank": 0}
+    fields = ["tax_id", "parent_tax_id", "rank", "genetic_code_id"]
+    for block in read_dmp(taxdmp, "nodes", fields):
+        for rank in set(block["rank"]):
+            if rank not in rank_index:
+                rank_index[rank] = len(rank_names)
+                rank_names.append(rank)
+        tax_ids.extend(map(int, block["tax_id"]))
+        parent_ids.extend(map(int, block["parent_tax_id"]))
+        rank_ids.extend([rank_index[rank] for rank in block["rank"]])
+        gc_ids.extend([int(gc_id) if gc_id else 0 for gc_id in block["genetic_code_id"]])
+
+    size = max(tax_ids) + 1
+    parents = array("i", bytes(4 * size))
+    ranks = array("B", bytes(size))
+    genetic_codes = array("B", bytes(size))
+    offsets = array("i", bytes(4 * (size + 1)))
+    for tax_id, parent, rank, gc_id in zip(tax_ids, parent_ids, rank_ids, gc_ids):
+        parents[tax_id] = parent
+        ranks[tax_id] = rank
+        genetic_codes[tax_id] = gc_id
+        if parent != tax_id and parent < size:
+            offsets[parent + 1] += 1
+    del tax_ids, parent_ids, rank_ids, gc_ids
+
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    children = array("i", bytes(4 * offsets[size]))
+    cursors = offsets[:size]
+    for tax_id in range(size):
+        parent = parents[tax_id]
+        if parent and parent != tax_id and parent < size:
+            children[cursors[parent]] = tax_id
+            cursors[parent] += 1
+    del cursors
+
+    return {
+        "rank_names": rank_names,
+        "parents": parents,
+        "ranks": ranks,
+        "genetic_codes": genetic_codes,
+        "offsets": offsets,
+        "children": children,
+    }
+
+
+def read_names(taxdmp, taxonomy, active):
+    """Given an open taxdmp.zip file, a taxonomy, and active flags by tax_id,
+    read names.dmp once, intern the labels into the taxonomy if it has none yet,
+    and return a dictionary from tax_id to a list of synonyms for the active taxa."""
+    synonyms = defaultdict(list)
+    size = len(taxonomy["parents"])
+    labels = None if "names" in taxonomy else [None] * size
+    for block in read_dmp(taxdmp, "names"):
+        for tax_id, name, unique, name_class in zip(
+            map(int, block["tax_id"]),
+            block["name_txt"],
+            block["unique_name"],
+            block["name_class"],
+        ):
+            # NCBI only fills in the unique name when the scientific name is not unique,
+            # so prefer it as the label and keep the shared name as a synonym.
+            if name_class == "scientific name" and labels is not None:
+                labels[tax_id] = unique or name
+            if not active[tax_id]:
+                continue
+            if name_class != "scientific name":
+                synonyms[tax_id].append([name, unique, name_class])
+            elif unique:
+                synonyms[tax_id].append([name, unique, "scientific name"])
+
+    if labels is not None:
+        name_offsets = array("i", bytes(4 * (size + 1)))
+        chunks = []
+        position = 0
+        for tax_id in range(size):
+            label = labels[tax_id]
+            if label:
+                chunk = label.encode("utf-8")
+                chunks.append(chunk)
+                position += len(chunk)
+            name_offsets[tax_id + 1] = position
+        taxonomy["name_offsets"] = name_offsets
+        taxonomy["names"] = b"".join(chunks)
+
+    return synonyms
+
+
+def read_merged(taxdmp, active):
+    """Given an open taxdmp.zip file and active flags by tax_id,
+    stream merged.dmp and return a dictionary
+    from each active new tax_id to the list of old tax_ids merged into it."""
+    size = len(active)
+    merged = defaultdict(list)
+    for block in read_dmp(taxdmp, "merged"):
+        for old_tax_id, new_tax_id in zip(block["old_tax_id"], map(int, block["new_tax_id"])):
+            if new_tax_id < size and active[new_tax_id]:
+                merged[new_tax_id].append(old_tax_id)
+    return merged
+
+
+def read_citations(taxdmp, active):
+    """Given an open taxdmp.zip file and active flags by tax_id,
+    stream citations.dmp and return a dictionary
+    from each active tax_id to the list of PubMed IDs that cite it."""
+    size = len(active)
+    citations = defaultdict(list)
+    for block in read_dmp(taxdmp, "citations", ["medline_id", "taxid_list"]):
+        for medline_id, taxid_list in zip(block["medline_id"], block["taxid_list"]):
+            # WARN: the pubmed_id is always "0", we treat medline_id as pubmed_id
+            if medline_id == "0" or not taxid_list:
+                continue
+            for tax_id in map(int, taxid_list.split()):
+                if tax_id < size and active[tax_id]:
+                    citations[tax_id].append(medline_id)
+    return citations
+
+
+def build_taxonomy(taxdmp):
+    """Given an open taxdmp.zip file,
+    read nodes.dmp and names.dmp into a compact taxonomy
+    with labels interned in a single UTF-8 buffer."""
+    taxonomy = read_nodes(taxdmp)
+    read_names(taxdmp, taxonomy, bytearray(len(taxonomy["parents"])))
+    return taxonomy
+
+
+taxonomy_magic = b"IEDBTAX1"
+taxonomy_sections = [
+    ("parents", "i"),
+    ("ranks", "B"),
+    ("genetic_codes", "B"),
+    ("offsets", "i"),
+    ("children", "i"),
+    ("name_offsets", "i"),
+    ("names", "B"),
+]
 
 
-def get_ancestors(parents, leaf):
-    ancestors = []
-    node = leaf
-    while node and node in parents:
-        parent = parents[node]
-        if node == parent:
-            break
-        ancestors.append(parent)
-        node = parents[node]
-    ancestors.reverse()
-    return ancestors
+def save_taxonomy(taxonomy, path):
+    """Given a taxonomy and a path,
+    write the taxonomy to a single file that load_taxonomy can memory-map."""
+    layout = {"byteorder": sys.byteorder, "rank_names": taxonomy["rank_names"], "sections": {}}
+    position = 0
+    for name, typecode in taxonomy_sections:
+        length = len(memoryview(taxonomy[name]).cast("B"))
+        layout["sections"][name] = [position, length, typecode]
+        position += length + (-length % 8)
+    header = json.dumps(layout).encode("utf-8")
+    start = len(taxonomy_magic) + 4 + len(header)
+    start += -start % 8
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(taxonomy_magic)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.write(bytes(start - f.tell()))
+        for name, typecode in taxonomy_sections:
+            data = memoryview(taxonomy[name]).cast("B")
+            f.write(data)
+            f.write(bytes(-len(data) % 8))
+    os.replace(tmp_path, path)
+
+
+def load_taxonomy(path):
+    """Given a path written by save_taxonomy,
+    memory-map the file and return a taxonomy whose arrays are views into it."""
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buf)
+    if bytes(view[0 : len(taxonomy_magic)]) != taxonomy_magic:
+        raise Exception(f"Not a taxonomy file: {path}")
+    (header_length,) = struct.unpack("<I", view[len(taxonomy_magic) : len(taxonomy_magic) + 4])
+    header_start = len(taxonomy_magic) + 4
+    layout = json.loads(bytes(view[header_start : header_start + header_length]))
+    if layout["byteorder"] != sys.byteorder:
+        raise Exception(f"Taxonomy file {path} was written with {layout['byteorder']} byte order")
+    start = header_start + header_length
+    start += -start % 8
+
+    taxonomy = {"rank_names": layout["rank_names"]}
+    for name, (position, length, typecode) in layout["sections"].items():
+        section = view[start + position : start + position + length]
+        taxonomy[name] = section.cast(typecode)
+    return taxonomy
+
+
+def get_label(taxonomy, tax_id):
+    offsets = taxonomy["name_offsets"]
+    return str(taxonomy["names"][offsets[tax_id] : offsets[tax_id + 1]], "utf-8")
+
+
+def get_children(taxonomy, tax_id):
+    offsets = taxonomy["offsets"]
+    return taxonomy["children"][offsets[tax_id] : offsets[tax_id + 1]]
+
+
+def index_tree(tree):
+    """Given a tree with an array of parent positions (-1 for a root),
+    add the children of each position in CSR layout and return the tree."""
+    parents = tree["parents"]
+    size = len(parents)
+    offsets = array("i", bytes(4 * (size + 1)))
+    for parent in parents:
+        if parent >= 0:
+            offsets[parent + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    children = array("i", bytes(4 * offsets[size]))
+    cursors = offsets[:size]
+    for position, parent in enumerate(parents):
+        if parent >= 0:
+            children[cursors[parent]] = position
+            cursors[parent] += 1
+    tree["offsets"] = offsets
+    tree["children"] = children
+    return tree
+
+
+def preorder(tree, roots=None):
+    """Given a tree and optional root positions (default: all roots),
+    yield positions in preorder, using a stack instead of recursion."""
+    offsets = tree["offsets"]
+    children = tree["children"]
+    if roots is None:
+        roots = [position for position, parent in enumerate(tree["parents"]) if parent < 0]
+    stack = list(reversed(roots))
+    while stack:
+        position = stack.pop()
+        yield position
+        stack.extend(reversed(children[offsets[position] : offsets[position + 1]]))
+
+
+def number_intervals(taxonomy):
+    """Given a taxonomy, number its nodes in preorder
+    and return arrays of lft, rgt, and depth indexed by tax_id,
+    such that Y is under X exactly when X.lft <= Y.lft <= X.rgt.
+    Absent tax_ids have lft 0."""
+    parents = taxonomy["parents"]
+    size = len(parents)
+    roots = [
+        tax_id
+        for tax_id, parent in enumerate(parents)
+        if parent and (parent == tax_id or parent >= size or not parents[parent])
+    ]
+    order = array("i", preorder(taxonomy, roots))
+    lft = array("i", bytes(4 * size))
+    rgt = array("i", bytes(4 * size))
+    depth = array("i", bytes(4 * size))
+    for number, tax_id in enumerate(order, 1):
+        lft[tax_id] = number
+        rgt[tax_id] = number
+        parent = parents[tax_id]
+        if parent != tax_id and parent < size and lft[parent]:
+            depth[tax_id] = depth[parent] + 1
+
+    # Reversed preorder visits children before their parents
+    for tax_id in reversed(order):
+        parent = parents[tax_id]
+        if parent != tax_id and parent < size and rgt[parent] < rgt[tax_id]:
+            rgt[parent] = rgt[tax_id]
+    return lft, rgt, depth
+
+
+def write_intervals(taxdmp_path, output):
+    """Given the path to the taxdmp.zip file and an output TSV file,
+    write tax_id, lft, rgt, and depth for every node, without a header."""
+    with zipfile.ZipFile(taxdmp_path) as taxdmp:
+        taxonomy = read_nodes(taxdmp)
+    lft, rgt, depth = number_intervals(taxonomy)
+    writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+    rows = ((tax_id, lft[tax_id], rgt[tax_id], depth[tax_id]) for tax_id in range(len(lft)))
+    writer.writerows(row for row in rows if row[1])
+
+
+def find_node(tree, tax_id):
+    """Given a tree and a tax_id, return its position or -1."""
+    ids = tree["ids"]
+    position = bisect_left(ids, tax_id)
+    if position < len(ids) and ids[position] == tax_id:
+        return position
+    return -1
+
+
+def build_tree(taxonomy, weights):
+    """Given a taxonomy and a dictionary from integer tax_id to epitope count,
+    return the active tree of weighted taxa and all their ancestors
+    as a node table: sorted tax_ids with parent positions,
+    epitope_count and epitope_sum arrays, and CSR children."""
+    parents = taxonomy["parents"]
+    size = len(parents)
+    active = bytearray(size)
+    for tax_id in weights:
+        node = tax_id
+        while 0 < node < size and parents[node] and not active[node]:
+            active[node] = 1
+            node = parents[node]
+
+    ids = array("i", [tax_id for tax_id, flag in enumerate(active) if flag])
+    index = array("i", [-1]) * size
+    for position, tax_id in enumerate(ids):
+        index[tax_id] = position
+    counts = array("q", bytes(8 * len(ids)))
+    for tax_id, epitope_count in weights.items():
+        if 0 < tax_id < size and active[tax_id]:
+            counts[index[tax_id]] += epitope_count
+
+    tree = index_tree(
+        {
+            "taxonomy": taxonomy,
+            "active": active,
+            "ids": ids,
+            "parents": array("i", [-1 if parents[x] == x else index[parents[x]] for x in ids]),
+            "epitope_count": counts,
+        }
+    )
 
+    # Roll the counts up: reversed preorder visits children before their parents
+    sums = array("q", counts)
+    tree_parents = tree["parents"]
+    for position in reversed(array("i", preorder(tree))):
+        parent = tree_parents[position]
+        if parent >= 0:
+            sums[parent] += sums[position]
+    tree["epitope_sum"] = sums
+    return tree
+
+
+def filter_tree(tree, keep, roots=None):
+    """Given a tree, a bytearray of the positions to keep, and optional root positions,
+    return a new tree of the kept nodes that are reachable from the roots,
+    each attached to its nearest kept ancestor."""
+    parents = tree["parents"]
+    size = len(parents)
+    order = array("i", preorder(tree, roots))
+    reached = bytearray(size)
+    for position in order:
+        reached[position] = 1
+    selected = array("i", [p for p in range(size) if reached[p] and keep[p]])
+    new_positions = array("i", [-1]) * size
+    for new_position, position in enumerate(selected):
+        new_positions[position] = new_position
+
+    # Preorder visits each parent before its children
+    nearest = array("i", [-1]) * size
+    new_parents = array("i", [-1]) * len(selected)
+    for position in order:
+        parent = parents[position]
+        ancestor = nearest[parent] if parent >= 0 and reached[parent] else -1
+        if keep[position]:
+            new_parents[new_positions[position]] = ancestor
+            nearest[position] = new_positions[position]
+        else:
+            nearest[position] = ancestor
+
+    return index_tree(
+        {
+            "taxonomy": tree["taxonomy"],
+            "ids": array("i", [tree["ids"][p] for p in selected]),
+            "parents": new_parents,
+            "epitope_count": array("q", [tree["epitope_count"][p] for p in selected]),
+            "epitope_sum": array("q", [tree["epitope_sum"][p] for p in selected]),
+        }
+    )
 
-def prune_poles(tree, node):
-    children = tree[node]["children"]
-    if len(children) > 1:
-        child = children.pop()
-        tree[node]["children"] = [child]
-        prune_poles(tree, child)
 
+def extract_subtree(tree, tax_id):
+    """Given a tree and a tax_id, return the subtree rooted at that tax_id."""
+    position = find_node(tree, tax_id)
+    if position < 0:
+        raise Exception(f"NCBITaxon:{tax_id} is not in the tree")
+    return filter_tree(tree, bytearray(b"\x01") * len(tree["ids"]), [position])
+
+
+def prune_poles(tree, tax_id=1):
+    """Given a tree and a root tax_id, walk down from the root:
+    wherever a node has more than one child, keep only the last child.
+    Return the pruned tree."""
+    position = find_node(tree, tax_id)
+    if position < 0:
+        return tree
+    offsets = tree["offsets"]
+    children = tree["children"]
+    keep = bytearray(b"\x01") * len(tree["ids"])
+    while offsets[position + 1] - offsets[position] > 1:
+        pruned = children[offsets[position] : offsets[position + 1] - 1]
+        for dropped in preorder(tree, pruned):
+            keep[dropped] = 0
+        position = children[offsets[position + 1] - 1]
+    return filter_tree(tree, keep, [find_node(tree, tax_id)])
+
+
+def collapse_poles(tree):
+    """Given a tree, drop every non-root node with a single child and no epitopes of its own,
+    attaching its child to the nearest remaining ancestor.
+    Return the collapsed tree."""
+    parents = tree["parents"]
+    offsets = tree["offsets"]
+    counts = tree["epitope_count"]
+    keep = bytearray(
+        0 if parents[p] >= 0 and offsets[p + 1] - offsets[p] == 1 and not counts[p] else 1
+        for p in range(len(parents))
+    )
+    return filter_tree(tree, keep)
+
+
+tree_headers = ["id", "label", "parents", "children", "epitope_count", "epitope_sum"]
+
+# Write trees in batches of this many rows
+tree_batch_size = 10000
+
+
+def tree_rows(tree):
+    """Given a tree, yield a tuple for each node in tax_id order."""
+    taxonomy = tree["taxonomy"]
+    taxonomy_parents = taxonomy["parents"]
+    parents = tree["parents"]
+    offsets = tree["offsets"]
+    children = tree["children"]
+    curies = [f"NCBITaxon:{tax_id}" for tax_id in tree["ids"]]
+    for position, (tax_id, epitope_count, epitope_sum) in enumerate(
+        zip(tree["ids"], tree["epitope_count"], tree["epitope_sum"])
+    ):
+        parent = parents[position]
+        yield (
+            curies[position],
+            get_label(taxonomy, tax_id),
+            curies[parent] if parent >= 0 else f"NCBITaxon:{taxonomy_parents[tax_id]}",
+            " ".join([curies[c] for c in children[offsets[position] : offsets[position + 1]]]),
+            epitope_count,
+            epitope_sum,
+        )
+
+
+def write_tree(tree, path, table="tree"):
+    """Given a tree, an output path, and a table name,
+    stream the tree in batches to a TSV file, or for a .db path to a SQLite table."""
+    rows = tree_rows(tree)
+    if path.endswith(".db"):
+        with sqlite3.connect(path) as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"""CREATE TABLE {table} (
+                  id TEXT PRIMARY KEY,
+                  label TEXT,
+                  parents TEXT,
+                  children TEXT,
+                  epitope_count INT,
+                  epitope_sum INT
+                )""")
+            while True:
+                batch = list(islice(rows, tree_batch_size))
+                if not batch:
+                    break
+                conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?)", batch)
+        return
 
-def write_tree(tree, path):
-    headers = ["id", "label", "parents", "children", "epitope_count", "epitope_sum"]
     with open(path, "w") as tsv:
-        writer = csv.DictWriter(tsv, headers, delimiter="\t", lineterminator="\n", extrasaction='ignore')
-        writer.writeheader()
-        for row in tree.values():
-            newrow = row.copy()
-            newrow["parents"] = " ".join(f"NCBITaxon:{x}" for x in row["parents"])
-            newrow["children"] = " ".join(f"NCBITaxon:{x}" for x in row["children"])
-            writer.writerow(newrow)
-
-
-def convert(taxdmp_path, outdir_path, weights=None):
-    """Given the paths to the taxdmp.zip file and an output Turtle file,
-    and an optional set of tax_id strings to extract,
+        writer = csv.writer(tsv, delimiter="\t", lineterminator="\n")
+        writer.writerow(tree_headers)
+        while True:
+            batch = list(islice(rows, tree_batch_size))
+            if not batch:
+                break
+            writer.writerows(batch)
+
+
+def convert(
+    taxdmp_path,
+    outdir_path,
+    weights=None,
+    taxonomy_path=None,
+    sqlite_path=None,
+    include_merged=False,
+    include_citations=False,
+):
+    """Given the paths to the taxdmp.zip file and an output directory,
+    an optional dictionary from tax_id to epitope counts,
+    an optional path for caching the compact taxonomy,
+    an optional SQLite database to also write the trees to,
+    and flags for including merged tax_ids and citations,
     read from the taxdmp.zip file, collect annotations,
-    convert nodes to Turtle strings,
-    and write to the output file."""
-    scientific_names = defaultdict(list)
-    labels = {}
-    synonyms = defaultdict(list)
-    merged = defaultdict(list)
-    citations = defaultdict(list)
+    write the active and pruned trees,
+    and write the active nodes as statements."""
     with zipfile.ZipFile(taxdmp_path) as taxdmp:
-        parents = {}
-        species = set()
-        with taxdmp.open("nodes.dmp") as dmp:
-            for line in io.TextIOWrapper(dmp):
-                tax_id, parent, rank = split_line(line)[0:3]
-                parents[tax_id] = parent
-                if rank == "species":
-                    species.add(tax_id)
-
-        taxa = set()
-        tree = {}
-        esum = 0
-        for tax_id, epitope_count in weights.items():
-            esum += epitope_count
-            if tax_id not in parents:
-                continue
-            tree[tax_id] = {
-                "tax_id": tax_id,
-                "id": f"NCBITaxon:{tax_id}",
-                "epitope_count": epitope_count,
-                "epitope_sum": epitope_count,
-                "parents": {parents[tax_id]},
-                "children": set(),
-            }
-        for active, epitope_count in weights.items():
-            taxa.add(active)
-            child = active
-            ancestors = get_ancestors(parents, active)
-            ancestors.reverse()
-            for tax_id in ancestors:
-                taxa.add(tax_id)
-                if tax_id not in tree:
-                    tree[tax_id] = {
-                        "tax_id": tax_id,
-                        "id": f"NCBITaxon:{tax_id}",
-                        "epitope_count": 0,
-                        "epitope_sum": 0,
-                        "parents": {parents[tax_id]},
-                        "children": set(),
-                    }
-                tree[tax_id]["epitope_sum"] += epitope_count
-                tree[tax_id]["children"].add(child)
-                child = tax_id
-
-        del parents, species
-
-        with taxdmp.open("names.dmp") as dmp:
-            for line in io.TextIOWrapper(dmp):
-                tax_id, name, unique, name_class, _ = split_line(line)
-                if taxa and tax_id not in taxa:
-                    continue
-                if name_class == "scientific name":
-                    labels[tax_id] = name
-                    scientific_names[name].append([tax_id, unique])
-                else:
-                    synonyms[tax_id].append([name, unique, name_class])
-
-        # use unique name only if there's a conflict
-        for name, values in scientific_names.items():
-            tax_ids = [x[0] for x in values]
-            if len(tax_ids) > 1:
-                uniques = [x[1] for x in values]
-                if len(tax_ids) != len(set(uniques)):
-                    print("WARN: Duplicate unique names", tax_ids, uniques)
-                for tax_id, unique in values:
-                    labels[tax_id] = unique
-                    synonyms[tax_id].append([name, unique, "scientific name"])
-
-        for row in tree.values():
-            row["label"] = labels.get(row["tax_id"])
+        if (
+            taxonomy_path
+            and os.path.exists(taxonomy_path)
+            and os.path.getmtime(taxonomy_path) >= os.path.getmtime(taxdmp_path)
+        ):
+            taxonomy = load_taxonomy(taxonomy_path)
+        else:
+            taxonomy = read_nodes(taxdmp)
+
+        weights = {int(tax_id): count for tax_id, count in (weights or {}).items()}
+        tree = build_tree(taxonomy, weights)
+        active = tree["active"]
+        taxa = tree["ids"]
+        if not taxa:
+            # Without weights, convert every node
+            active = bytearray(1 if parent else 0 for parent in taxonomy["parents"])
+            taxa = [tax_id for tax_id, flag in enumerate(active) if flag]
+
+        # Read names.dmp once for both the labels (if not cached) and the synonyms
+        cached = "names" in taxonomy
+        synonyms = read_names(taxdmp, taxonomy, active)
+        if taxonomy_path and not cached:
+            save_taxonomy(taxonomy, taxonomy_path)
+
+        pruned = prune_poles(tree, 1)
         write_tree(tree, os.path.join(outdir_path, "1_active.tsv"))
+        write_tree(pruned, os.path.join(outdir_path, "2_pruned.tsv"))
+        if sqlite_path:
+            write_tree(tree, sqlite_path, "active_tree")
+            write_tree(pruned, sqlite_path, "pruned_tree")
 
-        prune_poles(tree, "1")
-        write_tree(tree, os.path.join(outdir_path, "2_pruned.tsv"))
-
-        #with taxdmp.open("merged.dmp") as dmp:
-        #    for line in io.TextIOWrapper(dmp):
-        #        old_tax_id, new_tax_id, _ = split_line(line)
-        #        merged[new_tax_id].append(old_tax_id)
-
-        #with taxdmp.open("citations.dmp") as dmp:
-        #    for line in io.TextIOWrapper(dmp):
-        #        (
-        #            cit_id,
-        #            cit_key,
-        #            pubmed_id,
-        #            medline_id,
-        #            url,
-        #            text,
-        #            tax_id_list,
-        #            _,
-        #        ) = split_line(line)
-        #        # WARN: the pubmed_id is always "0", we treat medline_id as pubmed_id
-        #        if medline_id == "0":
-        #            continue
-        #        for tax_id in tax_id_list.split():
-        #            if taxa and tax_id not in taxa:
-        #                continue
-        #            citations[tax_id].append(medline_id)
+        merged = read_merged(taxdmp, active) if include_merged else {}
+        citations = read_citations(taxdmp, active) if include_citations else {}
 
+        rank_names = taxonomy["rank_names"]
         output_path = os.path.join(outdir_path, "statements.tsv")
-        headers = ["zn", "sc", "sb", "pc", "oi", "oc", "ob", "ol", "dc", "lt"]
         with open(output_path, "w") as tsv:
-            writer = csv.DictWriter(tsv, headers, delimiter="\t", lineterminator="\n")
-            writer.writeheader()
-
-            with taxdmp.open("nodes.dmp") as dmp:
-                for line in io.TextIOWrapper(dmp):
-                    node = {}
-                    fields = split_line(line)
-                    for i in range(0, min(len(fields), len(nodes_fields))):
-                        node[nodes_fields[i]] = fields[i]
-                    tax_id = node["tax_id"]
-                    if taxa and tax_id not in taxa:
-                        continue
-                    results = convert_node(
-                        node,
-                        labels[tax_id],
-                        merged[tax_id],
-                        synonyms[tax_id],
-                        citations[tax_id],
-                    )
-                    writer.writerows(results)
+            writer = csv.writer(tsv, delimiter="\t", lineterminator="\n")
+            writer.writerow(statements_headers)
+
+            for tax_id in taxa:
+                node = {
+                    "tax_id": str(tax_id),
+                    "parent_tax_id": str(taxonomy["parents"][tax_id]),
+                    "rank": rank_names[taxonomy["ranks"][tax_id]],
+                    "genetic_code_id": str(taxonomy["genetic_codes"][tax_id]),
+                }
+                results = convert_node(
+                    node,
+                    get_label(taxonomy, tax_id),
+                    merged.get(tax_id, ()),
+                    synonyms[tax_id],
+                    citations.get(tax_id, ()),
+                )
+                writer.writerows(results)
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Convert NCBI Taxonomy taxdmp.zip to Turtle format"
     )
-    parser.add_argument("taxdmp", type=str, help="The taxdmp.zip file to read")
-    parser.add_argument("object", type=str, help="The object table")
-    parser.add_argument("outdir", type=str, help="The output directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparser = subparsers.add_parser("weights", help="Count epitopes per organism")
+    subparser.add_argument(
+        "source", type=str, help="The source.db or iedb.db file, or an object table TSV"
+    )
+    subparser.add_argument(
+        "output",
+        type=argparse.FileType("w"),
+        nargs="?",
+        default=sys.stdout,
+        help="The weights TSV file to write",
+    )
+
+    subparser = subparsers.add_parser("convert", help="Convert the active taxa to trees and TSV")
+    subparser.add_argument("taxdmp", type=str, help="The taxdmp.zip file to read")
+    subparser.add_argument("weights", type=str, help="The weights TSV file")
+    subparser.add_argument("outdir", type=str, help="The output directory")
+    subparser.add_argument("--taxonomy", type=str, help="The compact taxonomy file to reuse")
+    subparser.add_argument("--sqlite", type=str, help="A SQLite database to write the trees to")
+    subparser.add_argument(
+        "--merged", action="store_true", help="Add merged tax_ids as alternative IDs"
+    )
+    subparser.add_argument("--citations", action="store_true", help="Add PubMed citations")
+
+    subparser = subparsers.add_parser("intervals", help="Number the nodes for subtree queries")
+    subparser.add_argument("taxdmp", type=str, help="The taxdmp.zip file to read")
+    subparser.add_argument(
+        "output",
+        type=argparse.FileType("w"),
+        nargs="?",
+        default=sys.stdout,
+        help="The intervals TSV file to write",
+    )
+
+    subparser = subparsers.add_parser("tsv", help="Convert one .dmp file to TSV for SQLite")
+    subparser.add_argument("taxdmp", type=str, help="The taxdmp.zip file to read")
+    subparser.add_argument("name", choices=list(dmp_fields), help="The .dmp file to convert")
+    subparser.add_argument(
+        "output",
+        type=argparse.FileType("wb"),
+        nargs="?",
+        default=sys.stdout.buffer,
+        help="The file to write to",
+    )
     args = parser.parse_args()
 
-    taxa = count_epitopes(args.object)
-    return
-    convert(args.taxdmp, args.outdir, taxa)
+    if args.command == "weights":
+        if args.source.endswith(".db"):
+            count_weights(args.source, args.output)
+        else:
+            count_epitopes(args.source, args.output)
+    elif args.command == "convert":
+        convert(
+            args.taxdmp,
+            args.outdir,
+            read_weights(args.weights),
+            args.taxonomy,
+            args.sqlite,
+            args.merged,
+            args.citations,
+        )
+    elif args.command == "intervals":
+        write_intervals(args.taxdmp, args.output)
+    elif args.command == "tsv":
+        dmp2tsv(args.taxdmp, args.name, args.output)
 
 
 if __name__ == "__main__":
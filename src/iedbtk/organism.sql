@@ -14,27 +14,9 @@ CREATE TABLE statements (
   lt TEXT
 );
 
-DROP TABLE IF EXISTS weights;
-CREATE TABLE weights (
-  id INT,
-  weight INT
-);
-
-DROP TABLE IF EXISTS active;
-CREATE TABLE active (
-  id TEXT PRIMARY KEY,
-  label TEXT,
-  parent TEXT,
-  weight INT,
-  total INT
-);
-
 
 -- # Import data
 
-.mode tabs
-.import cache/weights.tsv weights
-
 ATTACH DATABASE 'build/taxdmp.db' AS taxdmp;
 
 
@@ -49,30 +31,4 @@ SELECT "NCBITaxon:" || nodes.tax_id AS zn,
 FROM nodes JOIN names ON names.tax_id = nodes.tax_id
 WHERE names.name_class = "scientific name";
 
--- Given a table of ids and weights
--- find the ancestors for each id
--- and return a table of ancestor ids and the descendant's weight.
--- Then use GROUP BY to sum over the weights.
-WITH RECURSIVE
-  ancestors(n, weight) AS (
-    SELECT id, weight FROM weights
-    UNION
-    SELECT parent_tax_id, weight FROM nodes, ancestors
-     WHERE tax_id = ancestors.n
-      AND tax_id != parent_tax_id
-  )
-INSERT INTO active(id, label, parent, weight, total)
-SELECT "NCBITaxon:" || n,
-       names.name_txt,
-       "NCBITaxon:" || nodes.parent_tax_id,
-       coalesce(weights.weight, 0),
-       SUM(ancestors.weight)
-FROM ancestors
-LEFT JOIN weights ON weights.id = n
-JOIN nodes ON nodes.tax_id = n
-JOIN names ON names.tax_id = n
-WHERE names.name_class = "scientific name"
-GROUP BY n;
-
 --SELECT * FROM statements LIMIT 3;
---SELECT * FROM active LIMIT 3;
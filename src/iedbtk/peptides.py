@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#
+# Write and search a packed encoding of the distinct epitope linear sequences
+# for mismatch-tolerant (Hamming) and BLOSUM62 similarity search.
+#
+# Each residue is a 5 bit code and twelve residues are packed into each 64 bit word.
+# Sequences are grouped by length:
+# `<length>.u64` holds the packed words, one row of words per sequence,
+# and `<length>.i32` holds the matching sequence_id from the sequence table (see sequence.sql).
+# Only sequences of the same length as the query are compared (no gaps).
+# Writing only needs the standard library; searching needs NumPy, which is optional.
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+alphabet = "ARNDCQEGHILKMFPSTWYVBZX*"
+codes = {residue: code for code, residue in enumerate(alphabet)}
+unknown = codes["X"]
+bits = 5
+per_word = 12
+manifest_name = "manifest.json"
+
+blosum62_table = """
+   A  R  N  D  C  Q  E  G  H  I  L  K  M  F  P  S  T  W  Y  V  B  Z  X  *
+A  4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0 -2 -1  0 -4
+R -1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3 -1  0 -1 -4
+N -2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3  3  0 -1 -4
+D -2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3  4  1 -1 -4
+C  0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1 -3 -3 -2 -4
+Q -1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2  0  3 -1 -4
+E -1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+G  0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3 -1 -2 -1 -4
+H -2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3  0  0 -1 -4
+I -1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3 -3 -3 -1 -4
+L -1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1 -4 -3 -1 -4
+K -1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2  0  1 -1 -4
+M -1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1 -3 -1 -1 -4
+F -2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1 -3 -3 -1 -4
+P -1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2 -2 -1 -2 -4
+S  1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2  0  0  0 -4
+T  0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0 -1 -1  0 -4
+W -3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3 -4 -3 -2 -4
+Y -2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1 -3 -2 -1 -4
+V  0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4 -3 -2 -1 -4
+B -2 -1  3  4 -3  0  1 -1  0 -3 -4  0 -3 -3 -2  0 -1 -4 -3 -3  4  1 -1 -4
+Z -1  0  0  1 -3  3  4 -2  0 -3 -3  1 -1 -3 -1  0 -1 -3 -2 -2  1  4 -1 -4
+X  0 -1 -1 -1 -2 -1 -1 -1 -1 -1 -1 -1 -1 -1 -2  0  0 -2 -1 -1 -1 -1 -1 -4
+* -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4 -4  1
+"""
+
+
+def read_matrix(table):
+    """Given a substitution matrix as text, return a dict from (residue, residue) to score."""
+    lines = table.strip().splitlines()
+    header = lines[0].split()
+    matrix = {}
+    for line in lines[1:]:
+        residue, *scores = line.split()
+        for other, score in zip(header, scores):
+            matrix[(residue, other)] = int(score)
+    return matrix
+
+
+def pack(sequence):
+    """Given a sequence, return a list of 64 bit words packing its residue codes,
+    with residues other than the alphabet as X."""
+    words = []
+    for start in range(0, len(sequence), per_word):
+        word = 0
+        for i, residue in enumerate(sequence[start : start + per_word]):
+            word |= codes.get(residue.upper(), unknown) << (bits * i)
+        words.append(word)
+    return words
+
+
+def write_index(db_path, outdir):
+    """Given a SQLite database path with a sequence table and an output directory,
+    write the packed sequences and IDs for each length, and a manifest."""
+    os.makedirs(outdir, exist_ok=True)
+    stat = os.stat(db_path)
+    manifest = {"source": {"mtime": stat.st_mtime, "size": stat.st_size}, "lengths": {}}
+    groups = {}
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        cur = conn.execute("SELECT sequence_id, linear_sequence FROM sequence ORDER BY sequence_id")
+        for sequence_id, sequence in cur:
+            if not sequence:
+                continue
+            if len(sequence) not in groups:
+                groups[len(sequence)] = (array("Q"), array("i"))
+            words, ids = groups[len(sequence)]
+            words.extend(pack(sequence))
+            ids.append(sequence_id)
+
+    for length, (words, ids) in sorted(groups.items()):
+        with open(os.path.join(outdir, f"{length}.u64"), "wb") as f:
+            words.tofile(f)
+        with open(os.path.join(outdir, f"{length}.i32"), "wb") as f:
+            ids.tofile(f)
+        manifest["lengths"][length] = len(ids)
+
+    # Write the manifest last, so a partial index is never loaded
+    tmp_path = os.path.join(outdir, manifest_name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(outdir, manifest_name))
+
+
+def load_index(path, db_path=None):
+    """Given an index directory and optionally the database it was written from,
+    return a dict from sequence length to a dict with "words" and "ids" arrays,
+    or None when NumPy is missing, there is no index, or it is older than the database."""
+    manifest_path = os.path.join(path, manifest_name)
+    if numpy is None or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if db_path:
+        stat = os.stat(db_path)
+        source = manifest["source"]
+        if source["mtime"] != stat.st_mtime or source["size"] != stat.st_size:
+            return None
+
+    index = {}
+    for length, rows in manifest["lengths"].items():
+        length = int(length)
+        width = -(-length // per_word)
+        words = numpy.memmap(os.path.join(path, f"{length}.u64"), dtype=numpy.uint64, mode="r")
+        ids = numpy.memmap(os.path.join(path, f"{length}.i32"), dtype=numpy.int32, mode="r")
+        index[length] = {"words": words.reshape(rows, width), "ids": ids}
+    return index
+
+
+def popcount(words):
+    """Given an array of unsigned 64 bit integers, return the number of set bits in each."""
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(words)
+    table = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+    return table[words.view(numpy.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def residue_masks(start, end, width):
+    """Given the first and last (exclusive) residue positions and the number of words,
+    return an array with the bits of those residues set in each word."""
+    masks = [0] * width
+    for position in range(start, end):
+        word, offset = divmod(position, per_word)
+        masks[word] |= ((1 << bits) - 1) << (bits * offset)
+    return numpy.array(masks, dtype=numpy.uint64)
+
+
+def mismatches(words, query):
+    """Given packed rows and a packed query row, return the mismatched residues per row."""
+    low = numpy.uint64(int("00001" * per_word, 2))
+    differ = words ^ query
+    # Fold each 5 bit field onto its lowest bit, then count the fields that differ
+    folded = differ.copy()
+    for shift in range(1, bits):
+        folded |= differ >> numpy.uint64(shift)
+    return popcount(folded & low).sum(axis=1)
+
+
+def hamming(index, sequence, distance):
+    """Given a loaded index, a sequence, and a maximum number of substitutions,
+    return a list of (sequence_id, substitutions) pairs for the sequences of the same length
+    within that distance, closest first."""
+    sequence = sequence.strip().upper()
+    group = index.get(len(sequence))
+    if group is None or distance < 0:
+        return []
+    words = group["words"]
+    width = words.shape[1]
+    query = numpy.array(pack(sequence), dtype=numpy.uint64)
+
+    if distance >= len(sequence):
+        # Every sequence of this length is within the distance
+        rows = numpy.arange(len(words))
+    else:
+        # Pigeonhole: with at most `distance` substitutions in `distance + 1` disjoint segments,
+        # at least one segment matches exactly, which is a cheap masked comparison of whole words
+        segments = distance + 1
+        bounds = [len(sequence) * i // segments for i in range(segments + 1)]
+        differ = words ^ query
+        candidates = numpy.zeros(len(words), dtype=bool)
+        for start, end in zip(bounds, bounds[1:]):
+            masks = residue_masks(start, end, width)
+            candidates |= ((differ & masks) == 0).all(axis=1)
+        rows = numpy.flatnonzero(candidates)
+
+    found = mismatches(numpy.asarray(words[rows]), query)
+    keep = found <= distance
+    rows = rows[keep]
+    found = found[keep]
+    order = numpy.lexsort((rows, found))
+    ids = group["ids"][rows[order]]
+    return list(zip(ids.tolist(), found[order].tolist()))
+
+
+def blosum(index, sequence, limit=50, matrix=None):
+    """Given a loaded index, a sequence, a number of results, and optionally a substitution matrix,
+    return a list of (sequence_id, score) pairs for the best scoring sequences of the same length,
+    scored by the ungapped sum of BLOSUM62 scores, best first."""
+    sequence = sequence.strip().upper()
+    group = index.get(len(sequence))
+    if group is None:
+        return []
+    matrix = matrix or blosum62
+    words = group["words"]
+    scores = numpy.zeros(len(words), dtype=numpy.int32)
+    for position, residue in enumerate(sequence):
+        word, offset = divmod(position, per_word)
+        column = (words[:, word] >> numpy.uint64(bits * offset)) & numpy.uint64((1 << bits) - 1)
+        residue = residue if residue in codes else "X"
+        row = numpy.zeros(1 << bits, dtype=numpy.int32)
+        row[: len(alphabet)] = [matrix[(residue, other)] for other in alphabet]
+        scores += row[column.astype(numpy.intp)]
+
+    if limit and limit < len(scores):
+        top = numpy.argpartition(-scores, limit - 1)[:limit]
+    else:
+        top = numpy.arange(len(scores))
+    order = numpy.lexsort((top, -scores[top]))
+    top = top[order]
+    return list(zip(group["ids"][top].tolist(), scores[top].tolist()))
+
+
+def edit_distances(sequence, others):
+    """Given a sequence and a list of other sequences,
+    return a list of the Levenshtein distance from the sequence to each of the others.
+    The dynamic programming table is filled one cell at a time
+    for all the other sequences of each length at once."""
+    distances = [0] * len(others)
+    lengths = {}
+    for i, other in enumerate(others):
+        lengths.setdefault(len(other), []).append(i)
+    query = numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)
+    for length, rows in lengths.items():
+        group = numpy.frombuffer("".join(others[i] for i in rows).encode(), dtype=numpy.uint8)
+        group = group.reshape(len(rows), length)
+        previous = numpy.tile(numpy.arange(length + 1, dtype=numpy.int32), (len(rows), 1))
+        for i, residue in enumerate(query, 1):
+            current = numpy.empty_like(previous)
+            current[:, 0] = i
+            substitute = previous[:, :-1] + (group != residue)
+            delete = previous[:, 1:] + 1
+            best = numpy.minimum(substitute, delete)
+            # Insertions depend on the cell to the left, so they go one column at a time
+            for j in range(1, length + 1):
+                current[:, j] = numpy.minimum(best[:, j - 1], current[:, j - 1] + 1)
+            previous = current
+        for i, distance in zip(rows, previous[:, -1].tolist()):
+            distances[i] = distance
+    return distances
+
+
+blosum62 = read_matrix(blosum62_table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a packed index of epitope sequences")
+    parser.add_argument("db", type=str, help="The SQLite database, e.g. build/iedb.db")
+    parser.add_argument("output", type=str, help="The output directory, e.g. build/peptides")
+    args = parser.parse_args()
+
+    write_index(args.db, args.output)
+    print(f"Wrote packed sequences to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
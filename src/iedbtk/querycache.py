@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# A query result cache in a SQLite file beside iedb.db,
+# shared by every server worker and kept across restarts.
+#
+# Entries are keyed by the build of iedb.db (its modification time and size),
+# a kind ("count" or "query"), and the normalized query with its parameters,
+# so a rebuilt database never sees results from the old one.
+# The `warm` command pre-populates the cache by requesting common search pages.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from urllib.parse import urlencode
+
+
+def build_id(db_path):
+    """Given the path to a SQLite database,
+    return a short hash identifying this build of it, or None if it does not exist."""
+    if not os.path.exists(db_path):
+        return None
+    stat = os.stat(db_path)
+    return hashlib.sha1(f"{stat.st_mtime_ns} {stat.st_size}".encode()).hexdigest()[:16]
+
+
+# One connection per thread and cache path
+local = threading.local()
+
+
+def connect(path):
+    """Given the path to the cache database, return a connection to it,
+    creating the cache table if needed."""
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+             build TEXT,
+             kind TEXT,
+             key TEXT,
+             value TEXT,
+             PRIMARY KEY (build, kind, key)
+           ) WITHOUT ROWID""")
+    return conn
+
+
+def connection(path):
+    """Given the path to the cache database, return this thread's connection to it."""
+    if not hasattr(local, "connections"):
+        local.connections = {}
+    if path not in local.connections:
+        local.connections[path] = connect(path)
+    return local.connections[path]
+
+
+def get(path, build, kind, key):
+    """Given the cache path, a build ID, a kind, and a key,
+    return the cached value, or None if it is missing or the cache cannot be read."""
+    if not build:
+        return None
+    try:
+        with connection(path) as conn:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE build = ? AND kind = ? AND key = ?",
+                (build, kind, json.dumps(key)),
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row:
+        return json.loads(row[0])
+    return None
+
+
+def put(path, build, kind, key, value):
+    """Given the cache path, a build ID, a kind, a key, and a JSON value, store the value.
+    Failures to write are ignored: the cache is only an optimization."""
+    if not build:
+        return
+    try:
+        with connection(path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (build, kind, json.dumps(key), json.dumps(value)),
+            )
+    except sqlite3.Error:
+        pass
+
+
+def prune(path, build):
+    """Given the cache path and the current build ID,
+    delete the entries from other builds and return how many were deleted."""
+    with connect(path) as conn:
+        deleted = conn.execute("DELETE FROM cache WHERE build != ?", (build,)).rowcount
+    with connect(path) as conn:
+        conn.execute("VACUUM")
+    return deleted
+
+
+def warm_urls(cur, top=20):
+    """Given a cursor on iedb.db and a number of organisms,
+    return the search page URLs to request: every tab of the landing page,
+    then the same for the top organisms by number of epitopes."""
+    filters = [{"positive_assays_only": "true"}]
+    cur.execute("SELECT child FROM organism_tree ORDER BY sort LIMIT ?", (top,))
+    for (organism_id,) in cur.fetchall():
+        filters.append({"positive_assays_only": "true", "source_organism": organism_id})
+
+    tabs = [
+        {"tab": "epitope"},
+        {"tab": "antigen"},
+        {"tab": "assay", "tab2": "tcell"},
+        {"tab": "assay", "tab2": "bcell"},
+        {"tab": "assay", "tab2": "elution"},
+        {"tab": "receptor", "tab2": "tcr"},
+        {"tab": "receptor", "tab2": "bcr"},
+        {"tab": "reference"},
+    ]
+    urls = []
+    for args in filters:
+        urls.append("/search/counts.json?" + urlencode(args))
+        for tab in tabs:
+            urls.append("/search/?" + urlencode({**args, **tab}))
+    return urls
+
+
+def warm(db_path, cache_path, top=20):
+    """Given the paths to iedb.db and the cache, and a number of organisms,
+    drop entries from old builds, request the common search pages, and return the URL count."""
+    # The server reads build/ relative to the working directory
+    import server
+
+    build = build_id(db_path)
+    prune(cache_path, build)
+    server.query_cache = cache_path
+    server.build = build
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        urls = warm_urls(conn.cursor(), top)
+    client = server.app.test_client()
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            raise Exception(f"Failed to warm {url}: {response.status_code}")
+    return len(urls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the query result cache for iedb.db")
+    parser.add_argument("command", choices=["warm", "prune"], help="The command to run")
+    parser.add_argument("db", type=str, help="The SQLite database, e.g. build/iedb.db")
+    parser.add_argument("cache", type=str, help="The cache database, e.g. build/cache.db")
+    parser.add_argument("--top", type=int, default=20, help="The number of organisms to warm")
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        count = warm(args.db, args.cache, args.top)
+        print(f"Warmed {count} pages in {args.cache}", file=sys.stderr)
+    else:
+        count = prune(args.cache, build_id(args.db))
+        print(f"Deleted {count} old entries from {args.cache}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
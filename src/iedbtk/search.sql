@@ -1,66 +1,212 @@
 ATTACH DATABASE "file:build/source.db?mode=ro" AS source;
 
 
--- Make a search table
-DROP TABLE IF EXISTS search;
-CREATE TABLE search (
-  search_id INTEGER PRIMARY KEY,
-  structure_id INT,
+-- The search, tcr, and bcr tables share their epitope, antigen, organism, and reference columns.
+-- Each of these is stored once in a dimension table with an integer key,
+-- the per-assay rows keep only the keys,
+-- and the search, tcr, and bcr views look them back up under the old column names.
+-- The views use scalar subqueries rather than joins,
+-- so that an aggregate query only looks up the columns it uses.
+-- Filters should go through the keys, e.g. `structure_id IN (SELECT ... FROM epitope ...)`,
+-- to use the indexes on the dimension tables.
+-- Attributes are taken from the first row for each ID.
+
+-- Make the dimension tables
+DROP VIEW IF EXISTS search;
+DROP VIEW IF EXISTS tcr;
+DROP VIEW IF EXISTS bcr;
+
+DROP TABLE IF EXISTS epitope;
+CREATE TABLE epitope (
+  structure_id INTEGER PRIMARY KEY,
   description TEXT,
-  source_antigen_id TEXT,
+  linear_sequence TEXT,
+  non_peptide_id TEXT
+);
+
+DROP TABLE IF EXISTS antigen;
+CREATE TABLE antigen (
+  antigen_key INTEGER PRIMARY KEY,
+  source_antigen_id TEXT UNIQUE,
   source_antigen_label TEXT,
   source_antigen_source_organism_id TEXT,
-  source_antigen_source_organism_label TEXT,
-  source_organism_id TEXT,
+  source_antigen_source_organism_label TEXT
+);
+
+DROP TABLE IF EXISTS organism;
+CREATE TABLE organism (
+  organism_key INTEGER PRIMARY KEY,
+  source_organism_id TEXT UNIQUE,
   source_organism_label TEXT,
-  linear_sequence TEXT,
-  non_peptide_id TEXT,
+  source_organism_lft INT -- preorder number in organism_interval, set by trees.sql
+);
+
+DROP TABLE IF EXISTS reference;
+CREATE TABLE reference (
+  reference_id INTEGER PRIMARY KEY,
+  pubmed_id INT,
+  reference_author TEXT,
+  reference_title TEXT,
+  reference_date INT
+);
+
+INSERT OR IGNORE INTO epitope
+SELECT structure_id,
+  structure_description,
+  NULLIF(linear_sequence, ''),
+  NULLIF(non_peptidic_obi_id, '')
+FROM source.simple_search;
+
+INSERT OR IGNORE INTO epitope
+SELECT structure_id,
+  structure_description,
+  NULLIF(linear_sequence, ''),
+  NULLIF(non_peptidic_obi_id, '')
+FROM source.tcell_receptor_list;
+
+INSERT OR IGNORE INTO epitope
+SELECT structure_id,
+  structure_description,
+  NULLIF(linear_sequence, ''),
+  NULLIF(non_peptidic_obi_id, '')
+FROM source.bcell_receptor_list;
+
+INSERT OR IGNORE INTO antigen(
+  source_antigen_id,
+  source_antigen_label,
+  source_antigen_source_organism_id,
+  source_antigen_source_organism_label
+)
+SELECT source_antigen_obi_id,
+  NULLIF(source_antigen_name, ''),
+  NULLIF(source_antigen_source_org_id, ''),
+  NULLIF(source_antigen_source_org_name, '')
+FROM source.simple_search
+WHERE source_antigen_obi_id != ''
+UNION ALL
+SELECT source_antigen_obi_id,
+  NULLIF(source_antigen_name, ''),
+  NULLIF(source_antigen_source_org_id, ''),
+  NULLIF(source_antigen_source_org_name, '')
+FROM source.tcell_receptor_list
+WHERE source_antigen_obi_id != ''
+UNION ALL
+SELECT source_antigen_obi_id,
+  NULLIF(source_antigen_name, ''),
+  NULLIF(source_antigen_source_org_id, ''),
+  NULLIF(source_antigen_source_org_name, '')
+FROM source.bcell_receptor_list
+WHERE source_antigen_obi_id != '';
+
+INSERT OR IGNORE INTO organism(source_organism_id, source_organism_label)
+SELECT source_organism_id, NULLIF(source_organism_name, '')
+FROM source.simple_search
+WHERE source_organism_id != ''
+UNION ALL
+SELECT source_organism_id, NULLIF(source_organism_name, '')
+FROM source.tcell_receptor_list
+WHERE source_organism_id != ''
+UNION ALL
+SELECT source_organism_id, NULLIF(source_organism_name, '')
+FROM source.bcell_receptor_list
+WHERE source_organism_id != '';
+
+INSERT OR IGNORE INTO reference
+SELECT reference_id,
+  NULLIF(pubmed_id, ''),
+  NULLIF(reference_author, ''),
+  NULLIF(reference_title, ''),
+  NULLIF(reference_date, '')
+FROM source.simple_search;
+
+INSERT OR IGNORE INTO reference
+SELECT reference_id,
+  NULLIF(pubmed_id, ''),
+  NULLIF(reference_author, ''),
+  NULLIF(reference_title, ''),
+  NULLIF(reference_date, '')
+FROM source.tcell_receptor_list;
+
+INSERT OR IGNORE INTO reference
+SELECT reference_id,
+  NULLIF(pubmed_id, ''),
+  NULLIF(reference_author, ''),
+  NULLIF(reference_title, ''),
+  NULLIF(reference_date, '')
+FROM source.bcell_receptor_list;
+
+CREATE INDEX epitope_linear_sequence ON epitope(linear_sequence);
+CREATE INDEX epitope_non_peptide_id ON epitope(non_peptide_id);
+CREATE INDEX reference_reference_date ON reference(reference_date);
+
+
+
+-- Make a search table
+DROP TABLE IF EXISTS search_fact;
+CREATE TABLE search_fact (
+  search_id INTEGER PRIMARY KEY,
+  structure_id INT,
+  antigen_key INT,
+  organism_key INT,
   tcell_id INT,
   bcell_id INT,
   elution_id INT,
   assay_id INT,
   assay_type_id TEXT,
   assay_positive BOOLEAN,
-  reference_id INT,
-  pubmed_id INT,
-  reference_author TEXT,
-  reference_title TEXT,
-  reference_date INT
+  reference_id INT
 );
 
-INSERT INTO search
+INSERT INTO search_fact
 SELECT simple_search_id AS search_id,
   structure_id,
-  structure_description,
-  NULLIF(source_antigen_obi_id, '') AS source_antigen_id,
-  NULLIF(source_antigen_name, '') AS source_antigen_label,
-  NULLIF(source_antigen_source_org_id, '')AS source_antigen_source_organism_id,
-  NULLIF(source_antigen_source_org_name, '') AS source_antigen_source_organism_label,
-  NULLIF(source_organism_id, ''),
-  NULLIF(source_organism_name, '') AS source_organism_label,
-  NULLIF(linear_sequence, ''),
-  NULLIF(non_peptidic_obi_id, '') AS non_peptide_id,
+  antigen.antigen_key,
+  organism.organism_key,
   NULLIF(tcell_id, ''),
   NULLIF(bcell_id, ''),
   NULLIF(elution_id, ''),
   assay_id,
   as_type_id AS assay_type_id,
   like('Positive%', qualitative_measure) AS assay_positive,
-  reference_id,
-  NULLIF(pubmed_id, ''),
-  NULLIF(reference_author, ''),
-  NULLIF(reference_title, ''),
-  NULLIF(reference_date, '')
-FROM source.simple_search;
-
-CREATE INDEX search_structure_id ON search(structure_id);
-CREATE INDEX search_source_antigen_id ON search(source_antigen_id);
-CREATE INDEX search_assay_id ON search(assay_id);
-CREATE INDEX search_reference_id ON search(reference_id);
-CREATE INDEX search_reference_date ON search(reference_date);
-CREATE INDEX search_linear_sequence ON search(linear_sequence);
-CREATE INDEX search_non_peptide_id ON search(non_peptide_id);
-CREATE INDEX search_ids ON search(structure_id, source_antigen_id, assay_id, reference_id);
+  reference_id
+FROM source.simple_search s
+LEFT JOIN antigen ON antigen.source_antigen_id = s.source_antigen_obi_id
+LEFT JOIN organism ON organism.source_organism_id = s.source_organism_id;
+
+CREATE INDEX search_structure_id ON search_fact(structure_id);
+CREATE INDEX search_antigen_key ON search_fact(antigen_key);
+CREATE INDEX search_organism_key ON search_fact(organism_key);
+CREATE INDEX search_assay_id ON search_fact(assay_id);
+CREATE INDEX search_reference_id ON search_fact(reference_id);
+CREATE INDEX search_ids ON search_fact(structure_id, antigen_key, assay_id, reference_id);
+
+CREATE VIEW search AS
+SELECT f.search_id,
+  f.structure_id,
+  f.antigen_key,
+  f.organism_key,
+  (SELECT description FROM epitope WHERE structure_id = f.structure_id) AS description,
+  (SELECT source_antigen_id FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_id,
+  (SELECT source_antigen_label FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_label,
+  (SELECT source_antigen_source_organism_id FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_source_organism_id,
+  (SELECT source_antigen_source_organism_label FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_source_organism_label,
+  (SELECT source_organism_id FROM organism WHERE organism_key = f.organism_key) AS source_organism_id,
+  (SELECT source_organism_label FROM organism WHERE organism_key = f.organism_key) AS source_organism_label,
+  (SELECT source_organism_lft FROM organism WHERE organism_key = f.organism_key) AS source_organism_lft,
+  (SELECT linear_sequence FROM epitope WHERE structure_id = f.structure_id) AS linear_sequence,
+  (SELECT non_peptide_id FROM epitope WHERE structure_id = f.structure_id) AS non_peptide_id,
+  f.tcell_id,
+  f.bcell_id,
+  f.elution_id,
+  f.assay_id,
+  f.assay_type_id,
+  f.assay_positive,
+  f.reference_id,
+  (SELECT pubmed_id FROM reference WHERE reference_id = f.reference_id) AS pubmed_id,
+  (SELECT reference_author FROM reference WHERE reference_id = f.reference_id) AS reference_author,
+  (SELECT reference_title FROM reference WHERE reference_id = f.reference_id) AS reference_title,
+  (SELECT reference_date FROM reference WHERE reference_id = f.reference_id) AS reference_date
+FROM search_fact f;
 
 
 
@@ -98,6 +244,8 @@ SELECT
 FROM source.tcell_list;
 
 CREATE INDEX tcell_tcell_id ON tcell(tcell_id);
+CREATE INDEX tcell_reference_id ON tcell(reference_id);
+CREATE INDEX tcell_structure_id ON tcell(structure_id);
 
 
 
@@ -132,6 +280,8 @@ SELECT
 FROM source.bcell_list;
 
 CREATE INDEX bcell_bcell_id ON bcell(bcell_id);
+CREATE INDEX bcell_reference_id ON bcell(reference_id);
+CREATE INDEX bcell_structure_id ON bcell(structure_id);
 
 
 
@@ -163,13 +313,15 @@ SELECT
 FROM source.mhc_elution_list;
 
 CREATE INDEX elution_elution_id ON elution(elution_id);
+CREATE INDEX elution_reference_id ON elution(reference_id);
+CREATE INDEX elution_structure_id ON elution(structure_id);
 
 
 
 
 -- Make a tcr table
-DROP TABLE IF EXISTS tcr;
-CREATE TABLE tcr (
+DROP TABLE IF EXISTS tcr_fact;
+CREATE TABLE tcr_fact (
   receptor_id INT,
   receptor_group_id INT,
   receptor_type TEXT,
@@ -177,29 +329,18 @@ CREATE TABLE tcr (
   chain1_cdr3_sequence TXT,
   chain2_cdr3_sequence TXT,
   structure_id INT,
-  description TEXT,
-  source_antigen_id TEXT,
-  source_antigen_label TEXT,
-  source_antigen_source_organism_id TEXT,
-  source_antigen_source_organism_label TEXT,
-  source_organism_id TEXT,
-  source_organism_label TEXT,
-  linear_sequence TEXT,
-  non_peptide_id TEXT,
+  antigen_key INT,
+  organism_key INT,
   tcell_id INT,
   bcell_id INT,
   elution_id INT,
   assay_id INT,
   assay_type_id TEXT,
   assay_positive BOOLEAN,
-  reference_id INT,
-  pubmed_id INT,
-  reference_author TEXT,
-  reference_title TEXT,
-  reference_date INT
+  reference_id INT
 );
 
-INSERT INTO tcr
+INSERT INTO tcr_fact
 SELECT RECEPTOR_ID AS receptor_id,
   RECEPTOR_GROUP_ID AS receptor_group_id,
   RECEPTOR_TYPE AS receptor_type,
@@ -207,44 +348,69 @@ SELECT RECEPTOR_ID AS receptor_id,
   NULLIF(CHAIN1_CDR3_SEQ, '') AS chain1_cdr3_sequence,
   NULLIF(CHAIN2_CDR3_SEQ, '') AS chain2_cdr3_sequence,
   structure_id,
-  structure_description,
-  NULLIF(source_antigen_obi_id, '') AS source_antigen_id,
-  NULLIF(source_antigen_name, '') AS source_antigen_label,
-  NULLIF(source_antigen_source_org_id, '')AS source_antigen_source_organism_id,
-  NULLIF(source_antigen_source_org_name, '') AS source_antigen_source_organism_label,
-  NULLIF(source_organism_id, ''),
-  NULLIF(source_organism_name, '') AS source_organism_label,
-  NULLIF(linear_sequence, ''),
-  NULLIF(non_peptidic_obi_id, '') AS non_peptide_id,
+  antigen.antigen_key,
+  organism.organism_key,
   NULLIF(tcell_id, ''),
   NULLIF(bcell_id, ''),
   NULLIF(elution_id, ''),
   assay_id,
   as_type_id AS assay_type_id,
   like('Positive%', qualitative_measure) AS assay_positive,
-  reference_id,
-  NULLIF(pubmed_id, ''),
-  NULLIF(reference_author, ''),
-  NULLIF(reference_title, ''),
-  NULLIF(reference_date, '')
-FROM source.tcell_receptor_list;
-
-CREATE INDEX tcr_structure_id ON tcr(structure_id);
-CREATE INDEX tcr_source_antigen_id ON tcr(source_antigen_id);
-CREATE INDEX tcr_assay_id ON tcr(assay_id);
-CREATE INDEX tcr_reference_id ON tcr(reference_id);
-CREATE INDEX tcr_linear_sequence ON tcr(linear_sequence);
-CREATE INDEX tcr_non_peptide_id ON tcr(non_peptide_id);
-CREATE INDEX tcr_structure_assay_ids ON tcr(structure_id, assay_id);
-CREATE INDEX tcr_structure_reference_ids ON tcr(structure_id, reference_id);
-CREATE INDEX tcr_ids ON tcr(structure_id, source_antigen_id, assay_id, reference_id);
+  reference_id
+FROM source.tcell_receptor_list s
+LEFT JOIN antigen ON antigen.source_antigen_id = s.source_antigen_obi_id
+LEFT JOIN organism ON organism.source_organism_id = s.source_organism_id;
+
+CREATE INDEX tcr_structure_id ON tcr_fact(structure_id);
+CREATE INDEX tcr_antigen_key ON tcr_fact(antigen_key);
+CREATE INDEX tcr_organism_key ON tcr_fact(organism_key);
+CREATE INDEX tcr_assay_id ON tcr_fact(assay_id);
+CREATE INDEX tcr_reference_id ON tcr_fact(reference_id);
+CREATE INDEX tcr_structure_assay_ids ON tcr_fact(structure_id, assay_id);
+CREATE INDEX tcr_structure_reference_ids ON tcr_fact(structure_id, reference_id);
+CREATE INDEX tcr_ids ON tcr_fact(structure_id, antigen_key, assay_id, reference_id);
+CREATE INDEX tcr_chain1_cdr3_sequence ON tcr_fact(chain1_cdr3_sequence);
+CREATE INDEX tcr_chain2_cdr3_sequence ON tcr_fact(chain2_cdr3_sequence);
+
+CREATE VIEW tcr AS
+SELECT f.receptor_id,
+  f.receptor_group_id,
+  f.receptor_type,
+  f.receptor_species_names,
+  f.chain1_cdr3_sequence,
+  f.chain2_cdr3_sequence,
+  f.structure_id,
+  f.antigen_key,
+  f.organism_key,
+  (SELECT description FROM epitope WHERE structure_id = f.structure_id) AS description,
+  (SELECT source_antigen_id FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_id,
+  (SELECT source_antigen_label FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_label,
+  (SELECT source_antigen_source_organism_id FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_source_organism_id,
+  (SELECT source_antigen_source_organism_label FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_source_organism_label,
+  (SELECT source_organism_id FROM organism WHERE organism_key = f.organism_key) AS source_organism_id,
+  (SELECT source_organism_label FROM organism WHERE organism_key = f.organism_key) AS source_organism_label,
+  (SELECT source_organism_lft FROM organism WHERE organism_key = f.organism_key) AS source_organism_lft,
+  (SELECT linear_sequence FROM epitope WHERE structure_id = f.structure_id) AS linear_sequence,
+  (SELECT non_peptide_id FROM epitope WHERE structure_id = f.structure_id) AS non_peptide_id,
+  f.tcell_id,
+  f.bcell_id,
+  f.elution_id,
+  f.assay_id,
+  f.assay_type_id,
+  f.assay_positive,
+  f.reference_id,
+  (SELECT pubmed_id FROM reference WHERE reference_id = f.reference_id) AS pubmed_id,
+  (SELECT reference_author FROM reference WHERE reference_id = f.reference_id) AS reference_author,
+  (SELECT reference_title FROM reference WHERE reference_id = f.reference_id) AS reference_title,
+  (SELECT reference_date FROM reference WHERE reference_id = f.reference_id) AS reference_date
+FROM tcr_fact f;
 
 
 
 
 -- Make a bcr table
-DROP TABLE IF EXISTS bcr;
-CREATE TABLE bcr (
+DROP TABLE IF EXISTS bcr_fact;
+CREATE TABLE bcr_fact (
   receptor_id INT,
   receptor_group_id INT,
   receptor_type TEXT,
@@ -252,29 +418,18 @@ CREATE TABLE bcr (
   chain1_cdr3_sequence TXT,
   chain2_cdr3_sequence TXT,
   structure_id INT,
-  description TEXT,
-  source_antigen_id TEXT,
-  source_antigen_label TEXT,
-  source_antigen_source_organism_id TEXT,
-  source_antigen_source_organism_label TEXT,
-  source_organism_id TEXT,
-  source_organism_label TEXT,
-  linear_sequence TEXT,
-  non_peptide_id TEXT,
+  antigen_key INT,
+  organism_key INT,
   tcell_id INT,
   bcell_id INT,
   elution_id INT,
   assay_id INT,
   assay_type_id TEXT,
   assay_positive BOOLEAN,
-  reference_id INT,
-  pubmed_id INT,
-  reference_author TEXT,
-  reference_title TEXT,
-  reference_date INT
+  reference_id INT
 );
 
-INSERT INTO bcr
+INSERT INTO bcr_fact
 SELECT RECEPTOR_ID AS receptor_id,
   RECEPTOR_GROUP_ID AS receptor_group_id,
   RECEPTOR_TYPE AS receptor_type,
@@ -282,34 +437,59 @@ SELECT RECEPTOR_ID AS receptor_id,
   NULLIF(CHAIN1_CDR3_SEQ, '') AS chain1_cdr3_sequence,
   NULLIF(CHAIN2_CDR3_SEQ, '') AS chain2_cdr3_sequence,
   structure_id,
-  structure_description,
-  NULLIF(source_antigen_obi_id, '') AS source_antigen_id,
-  NULLIF(source_antigen_name, '') AS source_antigen_label,
-  NULLIF(source_antigen_source_org_id, '')AS source_antigen_source_organism_id,
-  NULLIF(source_antigen_source_org_name, '') AS source_antigen_source_organism_label,
-  NULLIF(source_organism_id, ''),
-  NULLIF(source_organism_name, '') AS source_organism_label,
-  NULLIF(linear_sequence, ''),
-  NULLIF(non_peptidic_obi_id, '') AS non_peptide_id,
+  antigen.antigen_key,
+  organism.organism_key,
   NULLIF(tcell_id, ''),
   NULLIF(bcell_id, ''),
   NULLIF(elution_id, ''),
   assay_id,
   as_type_id AS assay_type_id,
   like('Positive%', qualitative_measure) AS assay_positive,
-  reference_id,
-  NULLIF(pubmed_id, ''),
-  NULLIF(reference_author, ''),
-  NULLIF(reference_title, ''),
-  NULLIF(reference_date, '')
-FROM source.bcell_receptor_list;
-
-CREATE INDEX bcr_structure_id ON bcr(structure_id);
-CREATE INDEX bcr_source_antigen_id ON bcr(source_antigen_id);
-CREATE INDEX bcr_assay_id ON bcr(assay_id);
-CREATE INDEX bcr_reference_id ON bcr(reference_id);
-CREATE INDEX bcr_linear_sequence ON bcr(linear_sequence);
-CREATE INDEX bcr_non_peptide_id ON bcr(non_peptide_id);
-CREATE INDEX bcr_structure_assay_ids ON bcr(structure_id, assay_id);
-CREATE INDEX bcr_structure_reference_ids ON bcr(structure_id, reference_id);
-CREATE INDEX bcr_ids ON bcr(structure_id, source_antigen_id, assay_id, reference_id);
+  reference_id
+FROM source.bcell_receptor_list s
+LEFT JOIN antigen ON antigen.source_antigen_id = s.source_antigen_obi_id
+LEFT JOIN organism ON organism.source_organism_id = s.source_organism_id;
+
+CREATE INDEX bcr_structure_id ON bcr_fact(structure_id);
+CREATE INDEX bcr_antigen_key ON bcr_fact(antigen_key);
+CREATE INDEX bcr_organism_key ON bcr_fact(organism_key);
+CREATE INDEX bcr_assay_id ON bcr_fact(assay_id);
+CREATE INDEX bcr_reference_id ON bcr_fact(reference_id);
+CREATE INDEX bcr_structure_assay_ids ON bcr_fact(structure_id, assay_id);
+CREATE INDEX bcr_structure_reference_ids ON bcr_fact(structure_id, reference_id);
+CREATE INDEX bcr_ids ON bcr_fact(structure_id, antigen_key, assay_id, reference_id);
+CREATE INDEX bcr_chain1_cdr3_sequence ON bcr_fact(chain1_cdr3_sequence);
+CREATE INDEX bcr_chain2_cdr3_sequence ON bcr_fact(chain2_cdr3_sequence);
+
+CREATE VIEW bcr AS
+SELECT f.receptor_id,
+  f.receptor_group_id,
+  f.receptor_type,
+  f.receptor_species_names,
+  f.chain1_cdr3_sequence,
+  f.chain2_cdr3_sequence,
+  f.structure_id,
+  f.antigen_key,
+  f.organism_key,
+  (SELECT description FROM epitope WHERE structure_id = f.structure_id) AS description,
+  (SELECT source_antigen_id FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_id,
+  (SELECT source_antigen_label FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_label,
+  (SELECT source_antigen_source_organism_id FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_source_organism_id,
+  (SELECT source_antigen_source_organism_label FROM antigen WHERE antigen_key = f.antigen_key) AS source_antigen_source_organism_label,
+  (SELECT source_organism_id FROM organism WHERE organism_key = f.organism_key) AS source_organism_id,
+  (SELECT source_organism_label FROM organism WHERE organism_key = f.organism_key) AS source_organism_label,
+  (SELECT source_organism_lft FROM organism WHERE organism_key = f.organism_key) AS source_organism_lft,
+  (SELECT linear_sequence FROM epitope WHERE structure_id = f.structure_id) AS linear_sequence,
+  (SELECT non_peptide_id FROM epitope WHERE structure_id = f.structure_id) AS non_peptide_id,
+  f.tcell_id,
+  f.bcell_id,
+  f.elution_id,
+  f.assay_id,
+  f.assay_type_id,
+  f.assay_positive,
+  f.reference_id,
+  (SELECT pubmed_id FROM reference WHERE reference_id = f.reference_id) AS pubmed_id,
+  (SELECT reference_author FROM reference WHERE reference_id = f.reference_id) AS reference_author,
+  (SELECT reference_title FROM reference WHERE reference_id = f.reference_id) AS reference_title,
+  (SELECT reference_date FROM reference WHERE reference_id = f.reference_id) AS reference_date
+FROM bcr_fact f;
@@ -0,0 +1,81 @@
+-- Index the epitope linear sequences and receptor CDR3 sequences for substring search.
+-- Run on build/iedb.db after search.sql.
+--
+-- Each distinct linear sequence is stored once in the sequence table,
+-- and sequence_kmer lists every sequence that contains each 3-mer.
+-- A motif of three or more residues can only occur in sequences that contain all of its 3-mers,
+-- so the server intersects a few posting lists and then checks the candidates with instr().
+
+DROP TABLE IF EXISTS sequence_kmer;
+DROP TABLE IF EXISTS sequence;
+CREATE TABLE sequence (
+  sequence_id INTEGER PRIMARY KEY,
+  linear_sequence TEXT UNIQUE
+);
+
+INSERT INTO sequence(linear_sequence)
+SELECT DISTINCT linear_sequence
+FROM epitope
+WHERE linear_sequence IS NOT NULL
+ORDER BY linear_sequence;
+
+CREATE TABLE sequence_kmer (
+  kmer TEXT,
+  sequence_id INT,
+  PRIMARY KEY (kmer, sequence_id)
+) WITHOUT ROWID;
+
+WITH RECURSIVE position(i) AS (
+  VALUES (1)
+  UNION ALL
+  SELECT i + 1 FROM position
+  WHERE i < (SELECT max(length(linear_sequence)) FROM sequence)
+)
+INSERT OR IGNORE INTO sequence_kmer
+SELECT substr(linear_sequence, i, 3), sequence_id
+FROM sequence JOIN position ON i <= length(linear_sequence) - 2
+ORDER BY 1, 2;
+
+ANALYZE sequence;
+ANALYZE sequence_kmer;
+
+
+-- Index the receptor CDR3 sequences the same way, for the receptor CDR3 filter.
+-- Each distinct chain 1 or chain 2 CDR3 sequence is stored once in the cdr3 table.
+
+DROP TABLE IF EXISTS cdr3_kmer;
+DROP TABLE IF EXISTS cdr3;
+CREATE TABLE cdr3 (
+  cdr3_id INTEGER PRIMARY KEY,
+  cdr3_sequence TEXT UNIQUE
+);
+
+INSERT INTO cdr3(cdr3_sequence)
+SELECT chain1_cdr3_sequence FROM tcr_fact WHERE chain1_cdr3_sequence IS NOT NULL
+UNION
+SELECT chain2_cdr3_sequence FROM tcr_fact WHERE chain2_cdr3_sequence IS NOT NULL
+UNION
+SELECT chain1_cdr3_sequence FROM bcr_fact WHERE chain1_cdr3_sequence IS NOT NULL
+UNION
+SELECT chain2_cdr3_sequence FROM bcr_fact WHERE chain2_cdr3_sequence IS NOT NULL
+ORDER BY 1;
+
+CREATE TABLE cdr3_kmer (
+  kmer TEXT,
+  cdr3_id INT,
+  PRIMARY KEY (kmer, cdr3_id)
+) WITHOUT ROWID;
+
+WITH RECURSIVE position(i) AS (
+  VALUES (1)
+  UNION ALL
+  SELECT i + 1 FROM position
+  WHERE i < (SELECT max(length(cdr3_sequence)) FROM cdr3)
+)
+INSERT OR IGNORE INTO cdr3_kmer
+SELECT substr(cdr3_sequence, i, 3), cdr3_id
+FROM cdr3 JOIN position ON i <= length(cdr3_sequence) - 2
+ORDER BY 1, 2;
+
+ANALYZE cdr3;
+ANALYZE cdr3_kmer;
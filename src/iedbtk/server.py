@@ -1,14 +1,38 @@
 #!/usr/bin/env python3
+import base64
+import gzip
+import hashlib
+import json
 import math
 import sqlite3
 import subprocess
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
-from flask import Flask, request, redirect, Response, render_template, jsonify
-from requests import get, post
+from datetime import datetime, timezone
+from flask import Flask, request, redirect, Response, render_template, jsonify, make_response
+from flask import g, has_request_context
+from functools import wraps
+import requests
 from urllib.parse import urlencode
+import columnar
+import peptides
+import querycache
 import tsv2rdf
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 #root = "/browse/"
 root = "/"
 data = tsv2rdf.readdir("data2")
@@ -17,12 +41,350 @@ app = Flask(__name__, instance_relative_config=True)
 
 limit = 25
 
+# Answer the aggregation tabs from a columnar snapshot of iedb.db
+# when build/snapshot is current and NumPy is installed (see columnar.py)
+snapshot = columnar.load_snapshot("build/snapshot", "build/iedb.db")
+
+# Search for similar epitope sequences in a packed index of them,
+# when build/peptides is current and NumPy is installed (see peptides.py)
+peptide_index = peptides.load_index("build/peptides", "build/iedb.db")
+
+# Share counts and query results across workers and restarts in a cache beside iedb.db,
+# keyed by its build (see querycache.py)
+query_cache = "build/cache.db"
+build = querycache.build_id("build/iedb.db")
+pr_build = querycache.build_id("build/pr.db")
+
+
 def dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
         d[col[0]] = row[idx]
     return d
 
+
+# HTTP caching: pages depend only on their path, query string, and the database build,
+# so they get an ETag from those and conditional GETs are answered with 304 Not Modified
+def matching_etag(etag):
+    """Given an ETag, return the ETag in the If-None-Match header that matches it
+    with or without an encoding suffix, exactly as it was sent, or None."""
+    for tag in request.if_none_match.as_set(include_weak=True):
+        if tag.split("-")[0] == etag:
+            return tag
+    return None
+
+
+def http_cache(max_age=0, db="iedb"):
+    """Given a max age in seconds (0 to revalidate every time)
+    and the database that the responses depend on ("iedb" or "pr"),
+    return a decorator that adds ETag and Cache-Control headers to a view's responses."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = pr_build if db == "pr" else build
+            if not version:
+                return view(*args, **kwargs)
+            key = [version, request.path, sorted(request.args.items(multi=True))]
+            etag = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+            match = matching_etag(etag)
+            if match:
+                # The ETag of a 304 must be the one the client has, with its encoding suffix
+                response = Response(status=304)
+                response.set_etag(match, request.if_none_match.is_weak(match))
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            response.headers["Cache-Control"] = \
+                f"public, max-age={max_age}" if max_age else "no-cache"
+            response.vary.add("Accept-Encoding")
+            return response
+        return wrapper
+    return decorator
+
+
+# Compress large HTML and JSON responses
+compress_types = ["text/html", "application/json"]
+compress_min_size = 1024
+
+
+@app.after_request
+def compress(response):
+    accept = request.headers.get("Accept-Encoding", "")
+    if response.status_code != 200 \
+            or response.direct_passthrough \
+            or response.is_streamed \
+            or "Content-Encoding" in response.headers \
+            or response.mimetype not in compress_types:
+        return response
+    data = response.get_data()
+    if len(data) < compress_min_size:
+        return response
+    if brotli and "br" in accept:
+        encoding = "br"
+        data = brotli.compress(data, quality=5)
+    elif "gzip" in accept:
+        encoding = "gzip"
+        data = gzip.compress(data, compresslevel=6)
+    else:
+        return response
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    # Each encoding is a different representation, so give it a different ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+# Profiling: per request timings of SQL, caches, and rendering in a Server-Timing header,
+# a log of slow statements with their query plans, and totals for /metrics
+slow_query_seconds = 0.5
+slow_query_log = "build/slow-queries.log"
+request_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+metrics_lock = threading.Lock()
+metrics = {
+    "requests": {},  # (endpoint, status) to count
+    "request_seconds": {},  # endpoint to a count per bucket, then the count and the sum
+    "sql": {},  # statement hash to its SQL, count, and seconds
+    "cache": {},  # (kind, result) to count
+    "steps": {},  # "snapshot", "render", or "template" to count and seconds
+}
+
+
+def statement_hash(sql):
+    return hashlib.sha1(sql.encode()).hexdigest()[:12]
+
+
+def profile():
+    """Return the profile of the current request, or None outside of a request."""
+    if has_request_context() and "profile" in g:
+        return g.profile
+    return None
+
+
+def count_cache(kind, result):
+    """Given a cache kind ("query" or "count") and a result ("memory", "disk", or "miss"),
+    count the lookup."""
+    with metrics_lock:
+        metrics["cache"][(kind, result)] = metrics["cache"].get((kind, result), 0) + 1
+    current = profile()
+    if current is not None:
+        name = f"{kind}_{result}"
+        current["cache"][name] = current["cache"].get(name, 0) + 1
+
+
+@contextmanager
+def timed(step):
+    """Time the body of a with statement as a step of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with metrics_lock:
+            count, total = metrics["steps"].get(step, (0, 0.0))
+            metrics["steps"][step] = (count + 1, total + seconds)
+        current = profile()
+        if current is not None:
+            current[step] = current.get(step, 0.0) + seconds
+
+
+def log_slow_query(cur, sql, parameters, seconds):
+    """Given a cursor, a statement with its parameters, and its seconds,
+    append the statement and its query plan to the slow query log."""
+    try:
+        plan = [row["detail"] if isinstance(row, dict) else row[3]
+                for row in sqlite3.Cursor(cur.connection).execute(
+                    f"EXPLAIN QUERY PLAN {sql}", parameters)]
+    except sqlite3.Error as e:
+        plan = [f"Failed to explain: {e}"]
+    entry = {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "path": request.full_path if has_request_context() else None,
+        "statement": statement_hash(sql),
+        "seconds": round(seconds, 4),
+        "sql": sql,
+        "parameters": parameters,
+        "plan": plan,
+    }
+    app.logger.warning(f"Slow query {entry['statement']} took {entry['seconds']}s")
+    # The log is only for diagnosis, so failing to write it must not fail the query
+    try:
+        with metrics_lock:
+            with open(slow_query_log, "a") as log:
+                log.write(json.dumps(entry, default=str) + "\n")
+    except OSError as e:
+        app.logger.warning(f"Failed to write {slow_query_log}: {e}")
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that times each statement, from execute() through its fetches."""
+    def execute(self, sql, parameters=()):
+        self.statement = sql
+        self.parameters = parameters
+        self.seconds = 0.0
+        self.logged = False
+        with metrics_lock:
+            stats = metrics["sql"].setdefault(
+                statement_hash(sql), {"sql": sql, "count": 0, "seconds": 0.0})
+            stats["count"] += 1
+        current = profile()
+        if current is not None:
+            current["sql_count"] += 1
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.add_time(start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self.add_time(start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self.add_time(start)
+
+    def add_time(self, start):
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        with metrics_lock:
+            metrics["sql"][statement_hash(self.statement)]["seconds"] += seconds
+        current = profile()
+        if current is not None:
+            current["sql"] += seconds
+        if self.seconds > slow_query_seconds and not self.logged:
+            self.logged = True
+            log_slow_query(self, self.statement, self.parameters, self.seconds)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+
+def connect(path):
+    """Given a SQLite URI, return a connection whose cursors are timed."""
+    return sqlite3.connect(path, uri=True, factory=TimedConnection)
+
+
+@app.before_request
+def start_profile():
+    g.profile = {"start": time.perf_counter(), "sql": 0.0, "sql_count": 0, "cache": {}}
+
+
+@app.after_request
+def finish_profile(response):
+    current = profile()
+    if current is None:
+        return response
+    seconds = time.perf_counter() - current["start"]
+    endpoint = request.endpoint or "none"
+    with metrics_lock:
+        key = (endpoint, response.status_code)
+        metrics["requests"][key] = metrics["requests"].get(key, 0) + 1
+        buckets = metrics["request_seconds"].setdefault(
+            endpoint, [0] * len(request_buckets) + [0, 0.0])
+        for i, bound in enumerate(request_buckets):
+            if seconds <= bound:
+                buckets[i] += 1
+        buckets[-2] += 1
+        buckets[-1] += seconds
+
+    timings = [f'sql;dur={current["sql"] * 1000:.1f};desc="{current["sql_count"]} statements"']
+    for step in ["snapshot", "render", "template"]:
+        if step in current:
+            timings.append(f"{step};dur={current[step] * 1000:.1f}")
+    for name, count in sorted(current["cache"].items()):
+        timings.append(f'{name};desc="{count}"')
+    timings.append(f"total;dur={seconds * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(timings)
+    return response
+
+
+def render_page(html):
+    """Given a page in the hiccup style, render it in the base template."""
+    with timed("render"):
+        content = tsv2rdf.render(html)
+    with timed("template"):
+        return render_template("base.jinja2", html=content)
+
+
+def escape_label(value):
+    """Given a label value, return it escaped for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_metric(name, kind, description, samples):
+    """Given a metric name, kind, description, and a list of (suffix, labels, value) samples,
+    return the lines of the Prometheus text format for it."""
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    for suffix, labels, value in samples:
+        labels = ",".join(f'{label}="{escape_label(text)}"' for label, text in labels.items())
+        lines.append(f"{name}{suffix}{{{labels}}} {value}")
+    return lines
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    lines = []
+    with metrics_lock:
+        lines += prometheus_metric(
+            "iedbtk_requests_total", "counter", "Requests by endpoint and status.",
+            [("", {"endpoint": endpoint, "status": status}, count)
+             for (endpoint, status), count in sorted(metrics["requests"].items())])
+        samples = []
+        for endpoint, buckets in sorted(metrics["request_seconds"].items()):
+            for bound, count in zip(request_buckets, buckets):
+                samples.append(("_bucket", {"endpoint": endpoint, "le": bound}, count))
+            samples.append(("_bucket", {"endpoint": endpoint, "le": "+Inf"}, buckets[-2]))
+            samples.append(("_count", {"endpoint": endpoint}, buckets[-2]))
+            samples.append(("_sum", {"endpoint": endpoint}, round(buckets[-1], 6)))
+        lines += prometheus_metric(
+            "iedbtk_request_seconds", "histogram", "Request duration in seconds.", samples)
+        lines += prometheus_metric(
+            "iedbtk_sql_statements_total", "counter",
+            "SQL statements executed, by statement hash.",
+            [("", {"statement": key}, stats["count"])
+             for key, stats in sorted(metrics["sql"].items())])
+        lines += prometheus_metric(
+            "iedbtk_sql_seconds_total", "counter",
+            "Seconds in SQL execute and fetch, by statement hash.",
+            [("", {"statement": key}, round(stats["seconds"], 6))
+             for key, stats in sorted(metrics["sql"].items())])
+        lines += prometheus_metric(
+            "iedbtk_cache_lookups_total", "counter", "Count and query cache lookups, by result.",
+            [("", {"kind": kind, "result": result}, count)
+             for (kind, result), count in sorted(metrics["cache"].items())])
+        lines += prometheus_metric(
+            "iedbtk_step_seconds_total", "counter",
+            "Seconds in snapshot queries, and rendering HTML and templates.",
+            [("", {"step": step}, round(total, 6))
+             for step, (count, total) in sorted(metrics["steps"].items())])
+    with flight_lock:
+        lines += prometheus_metric(
+            "iedbtk_single_flight_total", "counter",
+            "Computations run, or shared with a concurrent request.",
+            [("", {"result": result}, count) for result, count in sorted(flight_stats.items())])
+    with proxy_lock:
+        lines += prometheus_metric(
+            "iedbtk_proxy_requests_total", "counter", "Requests proxied to sqlite_web.",
+            [("", {"db": db}, stats["requests"]) for db, stats in sorted(proxy_stats.items())])
+        lines += prometheus_metric(
+            "iedbtk_proxy_errors_total", "counter", "Proxied requests that failed.",
+            [("", {"db": db}, stats["errors"]) for db, stats in sorted(proxy_stats.items())])
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/favicon.ico')
 def favicon():
     return ""
@@ -43,7 +405,7 @@ def index():
               ["ul",
                ["li", ["a", {"href": "/iedb.db/"}, "iedbtk (iedb.db)"]],
                ["li", ["a", {"href": "/source.db/"}, "web01-dev (source.db)"]]]]]]
-    return render_template("base.jinja2", html=tsv2rdf.render(html))
+    return render_page(html)
 
 links = {
     "reference_id": "http://iedb.org/reference/",
@@ -70,9 +432,19 @@ def make_page(args, page, string):
              string]]
 
 
-def make_paged_table(rows, count, args):
+def make_select(name, options, selected):
+    """Given a form field name, a list of (value, label) pairs, and the selected value,
+    return a select element."""
+    select = ["select", {"id": name, "class": "form-control", "name": name}]
+    for value, label in options:
+        select.append(["option", {"value": value, "selected": value == selected}, label])
+    return select
+
+
+def make_paged_table(rows, count, args, count_name=None):
+    """When the count is None, count_name is its key in /search/counts.json,
+    and the page fills in the number of pages when the counts arrive."""
     page = int(args.get("page", "1"))
-    last = math.ceil(count/limit)
     args["page"] = page
     html = ["div"]
     nav = ["ul", {"class": "pagination justify-content-center", "style": "margin-top: 1em"}]
@@ -81,10 +453,21 @@ def make_paged_table(rows, count, args):
     nav.append(make_page(args, max(1, page - 1), "prev"))
 
     js = f"javascript:jump({page})"
-    nav.append(["li", {"class": "page-item"}, ["a", {"class": "page-link", "href": js}, f"page {page} of {last}"]])
-
-    nav.append(make_page(args, min(last, page + 1), "next"))
-    nav.append(make_page(args, last, "last"))
+    if count is None:
+        pages = {"data-count-pages": count_name, "data-limit": limit}
+        nav.append(["li", {"class": "page-item"},
+                    ["a", {"class": "page-link", "href": js},
+                     f"page {page} of ", ["span", pages, "?"]]])
+        nav.append(make_page(args, page + 1 if len(rows) == limit else page, "next"))
+        last = make_page(args, page, "last")
+        last[2][1].update(pages)
+        nav.append(last)
+    else:
+        last = math.ceil(count / limit)
+        nav.append(["li", {"class": "page-item"},
+                    ["a", {"class": "page-link", "href": js}, f"page {page} of {last}"]])
+        nav.append(make_page(args, min(last, page + 1), "next"))
+        nav.append(make_page(args, last, "last"))
 
     html.append(nav)
     html.append(make_table(rows))
@@ -119,7 +502,157 @@ def make_table(rows):
 
 counts = {}
 
-def my_count(cur, args):
+# Search modes for the sequence filter; see sequence.sql for the 3-mer index
+sequence_modes = [("exact", "Exact"), ("substring", "Contains"), ("overlap", "Overlaps")]
+if peptide_index is not None:
+    sequence_modes.append(("similar", "Similar"))
+kmer_length = 3
+overlap_length = 5
+max_distance = 5
+
+
+def parse_distance(value, default=1):
+    """Given a distance from the request args or None,
+    return it as an integer from 0 to max_distance, or the default when it is not a number."""
+    try:
+        distance = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(distance, 0), max_distance)
+
+
+def motif_query(motif, params, name, table="sequence", column="linear_sequence"):
+    """Given a motif, the params dict, a parameter name,
+    and an indexed table and its sequence column (see sequence.sql),
+    add parameters and return a query for the IDs of the sequences that contain the motif."""
+    params[name] = motif
+    if len(motif) < kmer_length:
+        return f"SELECT {table}_id FROM {table} WHERE instr({column}, :{name}) > 0"
+    # Intersect the posting lists of 3-mers that cover the motif, then check the candidates
+    starts = list(range(0, len(motif) - kmer_length, kmer_length)) + [len(motif) - kmer_length]
+    postings = []
+    for i, start in enumerate(starts):
+        params[f"{name}_{i}"] = motif[start:start + kmer_length]
+        postings.append(f"SELECT {table}_id FROM {table}_kmer WHERE kmer = :{name}_{i}")
+    return f"""SELECT {table}_id FROM {table}
+WHERE {table}_id IN ({" INTERSECT ".join(postings)})
+  AND instr({column}, :{name}) > 0"""
+
+
+def sequence_query(args, params):
+    """Given request args with a sequence and the params dict,
+    add parameters and return a query for the linear sequences that match,
+    or None for an exact match."""
+    mode = args.get("sequence_mode", "exact")
+    sequence = args["sequence"].strip().upper()
+    if mode == "substring":
+        ids = motif_query(sequence, params, "sequence")
+    elif mode == "overlap":
+        # Share a run of at least overlap_length residues with the sequence
+        length = min(overlap_length, len(sequence))
+        windows = sorted(set(sequence[i:i + length] for i in range(len(sequence) - length + 1)))
+        ids = "\nUNION\n".join(motif_query(window, params, f"sequence{i}")
+                               for i, window in enumerate(windows))
+    elif mode == "similar" and peptide_index is not None:
+        # Same length, with at most sequence_distance substitutions
+        distance = parse_distance(args.get("sequence_distance"))
+        matches = peptides.hamming(peptide_index, sequence, distance)
+        params["similar"] = json.dumps([sequence_id for sequence_id, _ in matches])
+        ids = "SELECT value FROM json_each(:similar)"
+    else:
+        return None
+    return f"SELECT linear_sequence FROM sequence WHERE sequence_id IN ({ids})"
+
+
+# Search modes for the receptor CDR3 filter, which matches either chain
+cdr3_modes = [("exact", "Exact"), ("substring", "Contains"), ("distance", "Edit distance")]
+
+
+def edit_distance(a, b, limit):
+    """Given two strings and a limit,
+    return their Levenshtein distance, or limit + 1 if it is more than the limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def cdr3_query(cur, args, params):
+    """Given a cursor, request args with a CDR3 sequence, and the params dict,
+    add parameters and return a query for the CDR3 sequences that match,
+    or None for an exact match."""
+    mode = args.get("cdr3_mode", "exact")
+    cdr3 = args["cdr3"].strip().upper()
+    if mode == "substring":
+        ids = motif_query(cdr3, params, "cdr3", "cdr3", "cdr3_sequence")
+        return f"SELECT cdr3_sequence FROM cdr3 WHERE cdr3_id IN ({ids})"
+    elif mode == "distance":
+        distance = parse_distance(args.get("cdr3_distance"))
+        # q-gram lemma: within `distance` edits, at most 3 * distance of the 3-mers differ,
+        # so count shared 3-mers to find candidates, then check each one
+        kmers = sorted(set(cdr3[i:i + kmer_length] for i in range(len(cdr3) - kmer_length + 1)))
+        shared = len(cdr3) - kmer_length + 1 - kmer_length * distance
+        shared -= len(cdr3) - kmer_length + 1 - len(kmers)
+        lengths = (len(cdr3) - distance, len(cdr3) + distance)
+        if shared > 0:
+            values = ", ".join(["?"] * len(kmers))
+            cur.execute(f"""SELECT cdr3_sequence FROM cdr3
+WHERE cdr3_id IN (
+  SELECT cdr3_id FROM cdr3_kmer WHERE kmer IN ({values})
+  GROUP BY cdr3_id HAVING count(*) >= ?)
+AND length(cdr3_sequence) BETWEEN ? AND ?""", kmers + [shared, *lengths])
+        else:
+            cur.execute("SELECT cdr3_sequence FROM cdr3 "
+                        "WHERE length(cdr3_sequence) BETWEEN ? AND ?", lengths)
+        candidates = [row["cdr3_sequence"] for row in cur.fetchall()]
+        if peptides.numpy is not None and candidates:
+            distances = peptides.edit_distances(cdr3, candidates)
+        else:
+            distances = [edit_distance(cdr3, candidate, distance) for candidate in candidates]
+        params["cdr3"] = json.dumps([c for c, d in zip(candidates, distances) if d <= distance])
+        return "SELECT value AS cdr3_sequence FROM json_each(:cdr3)"
+    return None
+
+
+def cdr3_wheres(cur, args, params):
+    """Given a cursor, request args, and the params dict,
+    add parameters and return a list of WHERE conditions on the receptor tables
+    for the CDR3 filter."""
+    if not args.get("cdr3"):
+        return []
+    sequences = cdr3_query(cur, args, params)
+    if sequences:
+        return [f"(chain1_cdr3_sequence IN ({sequences}) OR chain2_cdr3_sequence IN ({sequences}))"]
+    params["cdr3"] = args["cdr3"].strip().upper()
+    return ["(chain1_cdr3_sequence = :cdr3 OR chain2_cdr3_sequence = :cdr3)"]
+
+
+# The request args that my_count depends on
+count_args = [
+    "positive_assays_only",
+    "sequence", "sequence_mode", "sequence_distance",
+    "cdr3", "cdr3_mode", "cdr3_distance",
+    "nonpeptide", "nonpeptide_old", "source_organism",
+]
+
+
+def count_key(args):
+    """Given request args, return the my_count args that are set, in a fixed order,
+    as a key for the caches."""
+    return tuple((name, args[name]) for name in count_args if args.get(name))
+
+
+def my_count(cur, args, compute=True):
+    """Given a cursor and request args, return a dict from tab to its title,
+    the search query, and the counts.
+    When the counts are not cached and compute is False, leave them out."""
     result = {
         "search": {"title": "Search"},
         "epitope": {"title": "Epitopes"},
@@ -129,90 +662,485 @@ def my_count(cur, args):
         "reference": {"title": "References"},
     }
 
+    # Check the caches first: resolving a similar sequence or CDR3 filter is the slowest step
+    key = count_key(args)
+    if key in counts:
+        count_cache("count", "memory")
+        return deepcopy(counts[key])
+    cached = querycache.get(query_cache, build, "count", key)
+    if cached:
+        count_cache("count", "disk")
+        counts[key] = cached
+        return deepcopy(cached)
+    count_cache("count", "miss")
+
     withs = []
     froms = ["search AS s"]
     joins = []
     wheres = []
+    params = {}
     if "positive_assays_only" in args and args["positive_assays_only"].lower() == "true":
         wheres.append("assay_positive IS TRUE")
     if "sequence" in args and args["sequence"]:
-        wheres.append(f"linear_sequence = '{args['sequence']}'")
+        sequences = sequence_query(args, params)
+        if sequences:
+            wheres.append("structure_id IN (SELECT structure_id FROM epitope "
+                          f"WHERE linear_sequence IN ({sequences}))")
+        else:
+            wheres.append("structure_id IN (SELECT structure_id FROM epitope "
+                          "WHERE linear_sequence = :sequence)")
+            params["sequence"] = args["sequence"]
     if "nonpeptide" in args and "nonpeptide_old" in args:
-        print("WARNING: Both nonptptide and nonpeptide_old are present!")
+        app.logger.warning("Both nonpeptide and nonpeptide_old are present")
     if "nonpeptide" in args and args["nonpeptide"]:
         ids = args["nonpeptide"].split()
-        values = ", ".join([f"('{i}')" for i in ids])
+        values = ", ".join([f"(:nonpeptide{i})" for i in range(len(ids))])
+        params.update({f"nonpeptide{i}": ids[i] for i in range(len(ids))})
         withs.append(f"""
 WITH RECURSIVE nonpeptides(n) AS (
   VALUES {values}
   UNION
   SELECT child FROM nonpeptide_tree, nonpeptides
   WHERE parent = n)""")
-        joins.append("JOIN nonpeptides n ON n.n = s.non_peptide_id")
+        wheres.append("structure_id IN "
+                      "(SELECT structure_id FROM epitope JOIN nonpeptides ON n = non_peptide_id)")
     elif "nonpeptide_old" in args and args["nonpeptide_old"]:
         ids = args["nonpeptide_old"].split()
-        values = ", ".join([f"('{i}')" for i in ids])
+        values = ", ".join([f"(:nonpeptide{i})" for i in range(len(ids))])
+        params.update({f"nonpeptide{i}": ids[i] for i in range(len(ids))})
         withs.append(f"""
 WITH RECURSIVE nonpeptides(n) AS (
   VALUES {values}
   UNION
   SELECT child FROM nonpeptide_old_tree, nonpeptides
   WHERE parent = n)""")
-        joins.append("JOIN nonpeptides n ON n.n = s.non_peptide_id")
+        wheres.append("structure_id IN "
+                      "(SELECT structure_id FROM epitope JOIN nonpeptides ON n = non_peptide_id)")
+    if "source_organism" in args and args["source_organism"]:
+        # Each organism covers a range of preorder numbers, so no recursion is needed
+        ranges = []
+        for i, organism_id in enumerate(args["source_organism"].split()):
+            cur.execute("SELECT lft, rgt FROM organism_interval WHERE id = ?", (organism_id,))
+            row = cur.fetchone()
+            if row:
+                ranges.append(f"source_organism_lft BETWEEN :organism_lft{i} AND :organism_rgt{i}")
+                params[f"organism_lft{i}"] = row["lft"]
+                params[f"organism_rgt{i}"] = row["rgt"]
+        if ranges:
+            wheres.append("organism_key IN "
+                          f"(SELECT organism_key FROM organism WHERE {' OR '.join(ranges)})")
+        else:
+            wheres.append("FALSE")
+
+    # The CDR3 filter only applies to the receptor tables
+    receptor_wheres = cdr3_wheres(cur, args, params)
+    result["receptor"]["where"] = receptor_wheres
 
     search_dict = {
-      "with": withs,
-      "select": [
-          "count(distinct structure_id) AS epitope_count",
-          "count(distinct source_antigen_label) AS antigen_count",
-          "count(distinct tcell_id) AS tcell_count",
-          "count(distinct bcell_id) AS bcell_count",
-          "count(distinct elution_id) AS elution_count",
-          "count(distinct reference_id) AS reference_count",
-      ],
-      "from": froms,
-      "join": joins,
-      "where": wheres
+        "with": withs,
+        "select": [
+            "count(distinct structure_id) AS epitope_count",
+            "count(distinct source_antigen_label) AS antigen_count",
+            "count(distinct tcell_id) AS tcell_count",
+            "count(distinct bcell_id) AS bcell_count",
+            "count(distinct elution_id) AS elution_count",
+            "count(distinct reference_id) AS reference_count",
+        ],
+        "from": froms,
+        "join": joins,
+        "where": wheres,
+        "params": params,
     }
     result["search"].update(search_dict)
 
     tcr_dict = deepcopy(search_dict)
     tcr_dict["select"] = ["count(distinct receptor_group_id) AS receptor_count"]
     tcr_dict["from"] = ["tcr AS s"]
+    tcr_dict["where"] += receptor_wheres
     bcr_dict = deepcopy(tcr_dict)
     bcr_dict["from"] = ["bcr AS s"]
 
-    # Cache the counts
     search_string = build_query(search_dict)
     tcr_string = build_query(tcr_dict)
     bcr_string = build_query(bcr_dict)
-    query_strings = "\n".join([search_string, tcr_string, bcr_string])
-    #print(query_strings)
-    if query_strings in counts:
-        return deepcopy(counts[query_strings])
-
-    cur.execute(search_string)
-    row = cur.fetchone()
-    result["epitope"]["count"] = row["epitope_count"]
-    result["antigen"]["count"] = row["antigen_count"]
-    result["assay"]["count"] = row["tcell_count"] + row["bcell_count"] + row["elution_count"]
-    result["assay"]["tcell_count"] = row["tcell_count"]
-    result["assay"]["bcell_count"] = row["bcell_count"]
-    result["assay"]["elution_count"] = row["elution_count"]
-    result["reference"]["count"] = row["reference_count"]
-
-    cur.execute(tcr_string)
-    row = cur.fetchone()
-    result["receptor"]["tcr_count"] = row["receptor_count"]
-
-    cur.execute(bcr_string)
-    row = cur.fetchone()
-    result["receptor"]["bcr_count"] = row["receptor_count"]
-
-    result["receptor"]["count"] = result["receptor"]["tcr_count"] + result["receptor"]["bcr_count"]
-
-    counts[query_strings] = deepcopy(result)
-    return result
+    if not compute:
+        return result
+
+    # Concurrent requests with the same filters wait for one computation
+    def run_counts():
+        if key in counts:
+            return deepcopy(counts[key])
+        cur.execute(search_string, params)
+        row = cur.fetchone()
+        result["epitope"]["count"] = row["epitope_count"]
+        result["antigen"]["count"] = row["antigen_count"]
+        result["assay"]["count"] = row["tcell_count"] + row["bcell_count"] + row["elution_count"]
+        result["assay"]["tcell_count"] = row["tcell_count"]
+        result["assay"]["bcell_count"] = row["bcell_count"]
+        result["assay"]["elution_count"] = row["elution_count"]
+        result["reference"]["count"] = row["reference_count"]
+
+        cur.execute(tcr_string, params)
+        row = cur.fetchone()
+        result["receptor"]["tcr_count"] = row["receptor_count"]
+
+        cur.execute(bcr_string, params)
+        row = cur.fetchone()
+        result["receptor"]["bcr_count"] = row["receptor_count"]
+
+        receptor = result["receptor"]
+        receptor["count"] = receptor["tcr_count"] + receptor["bcr_count"]
+
+        counts[key] = deepcopy(result)
+        querycache.put(query_cache, build, "count", key, result)
+        return result
+    return single_flight(("count", key), run_counts)
+
+
+# Single flight: concurrent callers with the same key share one computation
+flight_lock = threading.Lock()
+flights = {}
+flight_stats = {"computed": 0, "coalesced": 0}
+
+
+def single_flight(key, function):
+    """Given a key and a function of no arguments, call the function and return its result,
+    or if another thread is already calling a function for that key,
+    wait for it and return a copy of its result."""
+    with flight_lock:
+        flight = flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = {"done": threading.Event()}
+            flights[key] = flight
+            flight_stats["computed"] += 1
+        else:
+            flight_stats["coalesced"] += 1
+
+    if not leader:
+        flight["done"].wait()
+        if "error" in flight:
+            raise flight["error"]
+        return deepcopy(flight["result"])
+
+    try:
+        flight["result"] = function()
+        return flight["result"]
+    except Exception as e:
+        flight["error"] = e
+        raise
+    finally:
+        with flight_lock:
+            del flights[key]
+        flight["done"].set()
+
+
+# Compute counts off the request thread, one computation per distinct set of filters
+count_pool = ThreadPoolExecutor(max_workers=4)
+count_lock = threading.Lock()
+count_futures = {}
+
+
+def compute_counts(args):
+    with connect(sqlite) as conn:
+        conn.row_factory = dict_factory
+        result = my_count(conn.cursor(), args)
+    return {
+        tab: {key: value for key, value in values.items() if key.endswith("count")}
+        for tab, values in result.items()
+        if tab != "search"
+    }
+
+
+def submit_counts(args):
+    """Given request args, return a future for their counts,
+    shared by all requests with the same filters while it runs."""
+    key = count_key(args)
+    with count_lock:
+        future = count_futures.get(key)
+        if future is not None:
+            return future
+        future = count_pool.submit(compute_counts, dict(key))
+        count_futures[key] = future
+
+    # A future that is already done calls this right away, so it must not hold count_lock
+    def forget(f):
+        with count_lock:
+            if count_futures.get(key) is f:
+                del count_futures[key]
+    future.add_done_callback(forget)
+    return future
+
+
+def count_title(title, result, tab, name="count"):
+    """Given a tab title, a my_count result, a tab, and a count name,
+    return the title with the count, or with a placeholder for it."""
+    if name in result[tab]:
+        return f"{title} ({result[tab][name]})"
+    return ["span", title, ["span", {"data-count": f"{tab}.{name}"}]]
+
+
+# The GROUP BY queries of the aggregation tabs, for the snapshot query engine
+snapshot_tabs = {
+    "epitope": {
+        "table": "search",
+        "group by": "structure_id",
+        "columns": {
+            "structure_id": "structure_id",
+            "description": "description",
+            "source_antigen_label": "source_antigen_label",
+            "source_organism_label": "source_organism_label",
+        },
+        "counts": {"references": "reference_id", "assays": "assay_id"},
+        "order by": ("references", True),
+    },
+    "antigen": {
+        "table": "search",
+        "not null": ["source_antigen_id"],
+        "group by": "source_antigen_id",
+        "columns": {
+            "source_antigen_label": "source_antigen_label",
+            "source_antigen_source_organism_label": "source_antigen_source_organism_label",
+        },
+        "counts": {"epitopes": "structure_id", "assays": "assay_id", "references": "reference_id"},
+        "order by": ("references", True),
+    },
+    "reference": {
+        "table": "search",
+        "group by": "reference_id",
+        "columns": {
+            "reference_id": "reference_id",
+            "pubmed_id": "pubmed_id",
+            "reference_author": "reference_author",
+            "reference_title": "reference_title",
+            "reference_date": "reference_date",
+        },
+        "order by": ("reference_date", True),
+    },
+}
+for table in ["tcr", "bcr"]:
+    snapshot_tabs[table] = {
+        "table": table,
+        "group by": "receptor_group_id",
+        "columns": {
+            "receptor_id": "receptor_group_id",
+            "receptor_species_names": "receptor_species_names",
+            "receptor_type": "receptor_type",
+            "chain1_cdr3_sequence": "chain1_cdr3_sequence",
+            "chain2_cdr3_sequence": "chain2_cdr3_sequence",
+        },
+        "first": "receptor_id",
+        "order by": ("receptor_id", False),
+    }
+
+
+def snapshot_mask(cur, table, args):
+    """Given a cursor, a snapshot table, and the request args,
+    return a boolean array of the rows that the my_count filters keep."""
+    codes = table["codes"]
+    mask = numpy.ones(table["rows"], dtype=bool)
+    if "positive_assays_only" in args and args["positive_assays_only"].lower() == "true":
+        mask &= codes["assay_positive"] == columnar.encode(table, "assay_positive", 1)
+    if "sequence" in args and args["sequence"]:
+        params = {}
+        sequences = sequence_query(args, params)
+        if sequences:
+            cur.execute(sequences, params)
+            keep = [columnar.encode(table, "linear_sequence", row["linear_sequence"])
+                    for row in cur.fetchall()]
+            mask &= numpy.isin(codes["linear_sequence"], keep)
+        else:
+            code = columnar.encode(table, "linear_sequence", args["sequence"])
+            mask &= codes["linear_sequence"] == code
+    for field in ["nonpeptide", "nonpeptide_old"]:
+        if field in args and args[field]:
+            ids = args[field].split()
+            values = ", ".join(["(?)"] * len(ids))
+            cur.execute(f"""
+WITH RECURSIVE nonpeptides(n) AS (
+  VALUES {values}
+  UNION
+  SELECT child FROM {field}_tree, nonpeptides
+  WHERE parent = n)
+SELECT n FROM nonpeptides""", ids)
+            keep = [columnar.encode(table, "non_peptide_id", row["n"]) for row in cur.fetchall()]
+            mask &= numpy.isin(codes["non_peptide_id"], keep)
+            break
+    if "cdr3" in args and args["cdr3"] and "chain1_cdr3_sequence" in codes:
+        params = {}
+        sequences = cdr3_query(cur, args, params)
+        if sequences:
+            cur.execute(sequences, params)
+            found = [row["cdr3_sequence"] for row in cur.fetchall()]
+        else:
+            found = [args["cdr3"].strip().upper()]
+        keep = numpy.zeros(table["rows"], dtype=bool)
+        for column in ["chain1_cdr3_sequence", "chain2_cdr3_sequence"]:
+            keep |= numpy.isin(codes[column],
+                               [columnar.encode(table, column, value) for value in found])
+        mask &= keep
+    if "source_organism" in args and args["source_organism"]:
+        keep = numpy.zeros(table["rows"], dtype=bool)
+        for organism_id in args["source_organism"].split():
+            cur.execute("SELECT lft, rgt FROM organism_interval WHERE id = ?", (organism_id,))
+            row = cur.fetchone()
+            if row:
+                column = codes["source_organism_lft"]
+                first, last = columnar.code_range(table, "source_organism_lft",
+                                                  row["lft"], row["rgt"])
+                keep |= (column >= first) & (column <= last)
+        mask &= keep
+    return mask
+
+
+def query_snapshot(cur, name, args, offset, page_size=limit):
+    """Given a cursor, a snapshot_tabs name, the request args, a row offset, and a page size,
+    return a page of rows for that tab from the snapshot."""
+    key = ("snapshot", name, count_key(args), offset, page_size)
+    cached = cache(key)
+    if cached:
+        count_cache("query", "memory")
+        return cached
+
+    def compute():
+        cached = cache(key)
+        if cached:
+            count_cache("query", "memory")
+            return cached
+        cached = querycache.get(query_cache, build, "query", key)
+        if cached:
+            count_cache("query", "disk")
+            return cache(key, cached)
+        count_cache("query", "miss")
+        spec = snapshot_tabs[name]
+        table = snapshot[spec["table"]]
+        mask = snapshot_mask(cur, table, args)
+        for column in spec.get("not null", []):
+            mask &= table["codes"][column] != 0
+        rows = columnar.aggregate(table, mask, spec, page_size, offset)
+        cache(key, rows)
+        querycache.put(query_cache, build, "query", key, rows)
+        return rows
+    return single_flight(key, compute)
+
+
+# The sub-tabs of the assay and receptor tabs
+subtabs = {
+    "assay": [
+        ("tcell", "T Cell Assays"),
+        ("bcell", "B Cell Assays"),
+        ("elution", "MHC Ligand Assays"),
+    ],
+    "receptor": [("tcr", "T Cell Receptors"), ("bcr", "B Cell Receptors")],
+}
+
+
+def tab_count_name(tab, tab2):
+    """Given a tab and sub-tab, return the key of its count in /search/counts.json."""
+    if tab in subtabs:
+        return f"{tab}.{tab2}_count"
+    return f"{tab}.count"
+
+
+def tab_query(result, tab, tab2, offset, page_size=limit, after=None):
+    """Given a my_count result, a tab and sub-tab, a row offset, a page size,
+    and for the assay tabs the last ID of the previous page or None,
+    return the query dict for that page of the tab."""
+    q = result["search"]
+    q["limit"] = page_size
+    q["offset"] = offset
+    if tab == "epitope":
+        q["select"] = [
+            "structure_id",
+            "description",
+            "source_antigen_label",
+            "source_organism_label",
+            "count(distinct reference_id) AS \"references\"",
+            "count(distinct assay_id) AS assays",
+        ]
+        q["group by"] = ["structure_id"]
+        q["order by"] = ["\"references\" DESC", "structure_id"]
+
+    elif tab == "antigen":
+        q["select"] = [
+            "source_antigen_label",
+            "source_antigen_source_organism_label",
+            "count(distinct structure_id) AS epitopes",
+            "count(distinct assay_id) AS assays",
+            "count(distinct reference_id) AS \"references\"",
+        ]
+        q["where"].append("antigen_key IS NOT NULL")
+        q["group by"] = ["antigen_key"]
+        q["order by"] = ["\"references\" DESC", "source_antigen_id"]
+
+    elif tab == "assay":
+        table = tab2
+        # Page through the matching assay IDs, then join the page to the assay table
+        ids = deepcopy(q)
+        ids["select"] = [f"DISTINCT {table}_id"]
+        ids["where"].append(f"{table}_id IS NOT NULL")
+        ids["order by"] = [f"{table}_id"]
+        if after is not None:
+            # Seek past the previous page in the index instead of skipping the offset
+            ids["where"].append(f"{table}_id > :after")
+            ids["params"]["after"] = after
+            del ids["offset"]
+        q = {
+            "select": [f"{table}.*"],
+            "from": [f"({build_query(ids)}) AS page"],
+            "join": [f"JOIN {table} USING ({table}_id)"],
+            "order by": [f"{table}_id"],
+            "params": ids["params"],
+        }
+
+    elif tab == "receptor":
+        table = tab2
+        q["select"] = [
+            "DISTINCT receptor_group_id AS receptor_id",
+            "receptor_species_names",
+            "receptor_type",
+            "chain1_cdr3_sequence",
+            "chain2_cdr3_sequence",
+        ]
+        q["from"] = [f"{table} AS s"]
+        q["where"] += result["receptor"]["where"]
+        q["group by"] = ["receptor_group_id"]
+        # With one min(), SQLite takes the other columns from the receptor with the lowest ID
+        q["order by"] = ["receptor_group_id ASC", "min(receptor_id)"]
+
+    elif tab == "reference":
+        # Find the matching references first, then look up their details once each
+        ids = deepcopy(q)
+        ids["select"] = ["reference_id"]
+        del ids["limit"]
+        del ids["offset"]
+        q = {
+            "select": [
+                "reference_id",
+                "pubmed_id",
+                "reference_author",
+                "reference_title",
+                "reference_date"
+            ],
+            "from": ["reference"],
+            "where": [f"reference_id IN ({build_query(ids)})"],
+            "order by": ["reference_date DESC", "reference_id"],
+            "limit": page_size,
+            "offset": offset,
+            "params": ids["params"],
+        }
+
+    return q
+
+
+def tab_rows(cur, args, q, tab, tab2, offset, page_size=limit):
+    """Given a cursor, request args, a tab_query, a tab and sub-tab, a row offset, and a page size,
+    return the rows for that page of the tab, from the snapshot when it has them."""
+    snapshot_tab = tab2 if tab == "receptor" else tab
+    if snapshot and snapshot_tab in snapshot_tabs:
+        with timed("snapshot"):
+            return query_snapshot(cur, snapshot_tab, args, offset, page_size)
+    return query(cur, q)
 
 
 def href(args, **kwargs):
@@ -221,6 +1149,7 @@ def href(args, **kwargs):
     d.update(kwargs)
     return "?" + urlencode(d)
 
+
 def build_query(q):
     result = ""
     if "with" in q and q["with"]:
@@ -249,27 +1178,50 @@ def build_query(q):
 cache_limit = 1000
 cache_list = []
 cache_dict = {}
+cache_lock = threading.Lock()
+
+
 def cache(key, value=None):
-    if value:
-        if len(cache_list) > cache_limit:
-            del cache_dict[cache_list.pop(0)]
-        cache_list.append(key)
-        cache_dict[key] = value
-        return value
-    elif key in cache_dict:
-        cache_list.append(cache_list.pop(cache_list.index(key)))
-        return deepcopy(cache_dict[key])
-    else:
-        return None
+    with cache_lock:
+        if value:
+            if key in cache_dict:
+                cache_list.remove(key)
+            elif len(cache_list) > cache_limit:
+                del cache_dict[cache_list.pop(0)]
+            cache_list.append(key)
+            cache_dict[key] = value
+            return value
+        elif key in cache_dict:
+            cache_list.append(cache_list.pop(cache_list.index(key)))
+            return deepcopy(cache_dict[key])
+        else:
+            return None
+
 
 def query(cur, q):
     qs = build_query(q)
-    cached = cache(qs)
+    params = q.get("params", {})
+    key = (qs, tuple(sorted(params.items())))
+    cached = cache(key)
     if cached:
+        count_cache("query", "memory")
         return cached
-    rows = cur.execute(qs).fetchall()
-    cache(qs, rows)
-    return rows
+
+    def compute():
+        cached = cache(key)
+        if cached:
+            count_cache("query", "memory")
+            return cached
+        cached = querycache.get(query_cache, build, "query", key)
+        if cached:
+            count_cache("query", "disk")
+            return cache(key, cached)
+        count_cache("query", "miss")
+        rows = cur.execute(qs, params).fetchall()
+        cache(key, rows)
+        querycache.put(query_cache, build, "query", key, rows)
+        return rows
+    return single_flight(("query", key), compute)
 
 
 def build_tree(tree, field, root, args, content):
@@ -286,6 +1238,33 @@ def build_tree(tree, field, root, args, content):
         return deepcopy(content)
 
 
+finder_roots = {
+    "nonpeptide": "IEDB:non-peptidic-material",
+    "nonpeptide_old": "IEDB:non-peptidic-material",
+    "organism": "NCBITaxon:1",
+}
+
+
+def finder_rows(cur, table, selected_id):
+    """Given a cursor, a finder table, and a term ID,
+    return the rows for the term and its ancestors (the term first),
+    and the rows for its children."""
+    cur.execute(f"""WITH RECURSIVE ancestors(p, c, s) AS (
+        VALUES (?, NULL, 0)
+        UNION
+        SELECT parent, child, sort FROM {table}_tree, ancestors WHERE child = p
+      )
+      SELECT DISTINCT p AS parent, c AS child, s AS sort, label
+      FROM ancestors JOIN {table}_label ON p = id""", (selected_id,))
+    ancestor_rows = cur.fetchall()
+    cur.execute(f"""SELECT DISTINCT child, label
+            FROM {table}_tree
+            JOIN {table}_label ON child = id
+            WHERE parent = ?
+            ORDER BY sort, label""", (selected_id,))
+    return ancestor_rows, cur.fetchall()
+
+
 def make_tree(cur, args, field, table, selected_id, selected_label):
     heading = f"{table} finder"
     cls = "col"
@@ -308,31 +1287,19 @@ def make_tree(cur, args, field, table, selected_id, selected_label):
             {"class": cls},
             ["p", {"class": "text-center"}, heading]]
 
-    if "nonpeptide" in args:
-        del args["nonpeptide"]
-    if "nonpeptide_old" in args:
-        del args["nonpeptide_old"]
+    if field.startswith("nonpeptide"):
+        if "nonpeptide" in args:
+            del args["nonpeptide"]
+        if "nonpeptide_old" in args:
+            del args["nonpeptide_old"]
     args[field] = selected_id
-    cur.execute(f"""WITH RECURSIVE ancestors(p, c, s) AS (
-        VALUES ('{selected_id}', NULL, 0)
-        UNION
-        SELECT parent, child, sort FROM {table}_tree, ancestors WHERE child = p
-      )
-      SELECT DISTINCT p AS parent, c AS child, s AS sort, label
-      FROM ancestors JOIN {table}_label ON p = id""")
-    ancestor_rows = cur.fetchall()
+    ancestor_rows, child_rows = finder_rows(cur, table, selected_id)
     if not ancestor_rows:
         html.append("Term not in finder")
         return html
-    print(ancestor_rows)
 
-    cur.execute(f"""SELECT DISTINCT child, label
-            FROM {table}_tree
-            JOIN {table}_label ON child = id
-            WHERE parent = '{selected_id}'
-            ORDER BY sort, label""")
     children = ["ul", {"class": "children"}]
-    for row in cur:
+    for row in child_rows:
         args[field] = row["child"]
         children.append(["li", ["a", {"href": href(args)}, row["label"]]])
 
@@ -345,7 +1312,7 @@ def make_tree(cur, args, field, table, selected_id, selected_label):
             tree[parent] = {"label": row["label"], "children": {row["child"]}}
         else:
             tree[parent]["children"].add(row["child"])
-    root = "IEDB:non-peptidic-material"
+    root = finder_roots.get(table, "IEDB:non-peptidic-material")
     if table.startswith("molecule"):
         root = "BFO:0000040"
     content = ["ul", {}, ["li", {"class": "current"}, ["a", {"href": href(args)}, ["strong", current["label"]]]]]
@@ -366,23 +1333,25 @@ def make_tree(cur, args, field, table, selected_id, selected_label):
 
 
 @app.route('/finder/<name>')
+@http_cache()
 def finder(name):
-    with sqlite3.connect(sqlite, uri=True) as conn:
+    with connect(sqlite) as conn:
         conn.row_factory = dict_factory
         cur = conn.cursor()
-        node_id = request.args.get("id", "IEDB:non-peptidic-material")
+        node_id = request.args.get("id", finder_roots.get(name, "IEDB:non-peptidic-material"))
         node_label = ""
         cur.execute(f"""SELECT * FROM {name}_label WHERE id = ?""", (node_id,))
         row = cur.fetchone()
         if row:
             node_label = row["label"]
         html = make_tree(cur, request.args.copy(), "id", name, node_id, node_label)
-        return render_template("base.jinja2", html=tsv2rdf.render(html))
+        return render_page(html)
 
 
 @app.route('/search/')
+@http_cache()
 def search():
-    with sqlite3.connect(sqlite, uri=True) as conn:
+    with connect(sqlite) as conn:
         conn.row_factory = dict_factory
         cur = conn.cursor()
         html = ["div"]
@@ -394,11 +1363,10 @@ def search():
         args["page"] = 1
         if "tab2" in args:
             del args["tab2"]
-        result = my_count(cur, request.args)
-        count = result[tab].get("count", 0)
-        q = result["search"]
-        q["limit"] = limit
-        q["offset"] = offset = (page - 1) * limit
+        tab2 = request.args.get("tab2", subtabs[tab][0][0] if tab in subtabs else None)
+        offset = (page - 1) * limit
+        # Render now, and let the page fetch any counts that are not cached yet
+        result = my_count(cur, request.args, compute=False)
 
         for table, values in result.items():
             cls = "nav-link"
@@ -406,8 +1374,8 @@ def search():
                 cls += " active"
             args["tab"] = table
             title = values["title"]
-            if "count" in values:
-                title += f" ({values['count']})"
+            if table != "search":
+                title = count_title(title, result, table)
             nav.append(
                ["li",
                 {"class": "nav-item"}, 
@@ -427,9 +1395,10 @@ def search():
 
             selected_nonpeptide_label = ""
             if selected_nonpeptide_id:
-                cur.execute(f"""SELECT * FROM nonpeptide_label WHERE id = '{nonpeptide}'
+                cur.execute("""SELECT * FROM nonpeptide_label WHERE id = :nonpeptide
                   UNION
-                  SELECT * FROM nonpeptide_old_label WHERE id = '{nonpeptide}'""")
+                  SELECT * FROM nonpeptide_old_label WHERE id = :nonpeptide""",
+                            {"nonpeptide": nonpeptide})
                 row = cur.fetchone()
                 if row:
                     selected_nonpeptide_id = row["id"]
@@ -440,6 +1409,22 @@ def search():
             tree = make_tree(cur, request.args.copy(), "nonpeptide", "nonpeptide", node_id, node_label)
             tree2 = make_tree(cur, request.args.copy(), "nonpeptide_old", "nonpeptide_old", node_id, node_label)
 
+            selected_organism_id = args.get("source_organism", "")
+            selected_organism_label = ""
+            if selected_organism_id:
+                cur.execute("SELECT * FROM organism_label WHERE id = ?", (selected_organism_id,))
+                row = cur.fetchone()
+                if row:
+                    selected_organism_label = row["label"]
+            organism_id = selected_organism_id or "NCBITaxon:1"
+            organism_label = selected_organism_label or "root"
+            tree3 = make_tree(cur, request.args.copy(), "source_organism", "organism",
+                              organism_id, organism_label)
+
+            sequence_mode = make_select("sequence_mode", sequence_modes,
+                                        request.args.get("sequence_mode", "exact"))
+            cdr3_mode = make_select("cdr3_mode", cdr3_modes, request.args.get("cdr3_mode", "exact"))
+
             form = ["form",
                     {"id": "search-form", "class": "col"},
                     ["p",
@@ -458,14 +1443,57 @@ def search():
                      {"class": "form-group row"},
                      ["label", {"for": "sequence", "class": "col-sm-3 col-form-label"}, "Epitope linear sequence"],
                      ["div",
-                      {"class": "col-sm-9"},
+                      {"class": "col-sm-3"},
+                      sequence_mode],
+                     ["div",
+                      {"class": "col-sm-4"},
                       ["input",
                        {"id": "sequence",
                         "class": "form-control",
                         "name": "sequence",
                         "type": "text",
                         "placeholder": "SIINFEKL",
-                        "value": request.args.get("sequence", "")}]]],
+                        "value": request.args.get("sequence", "")}]],
+                     ["div",
+                      {"class": "col-sm-2"},
+                      ["input",
+                       {"id": "sequence_distance",
+                        "class": "form-control",
+                        "name": "sequence_distance",
+                        "type": "number",
+                        "min": "0",
+                        "max": str(max_distance),
+                        "placeholder": "1",
+                        "title": "Substitutions for similar sequences",
+                        "value": request.args.get("sequence_distance", "")}]]],
+                    ["div",
+                     {"class": "form-group row"},
+                     ["label", {"for": "cdr3", "class": "col-sm-3 col-form-label"},
+                      "Receptor CDR3 sequence"],
+                     ["div",
+                      {"class": "col-sm-3"},
+                      cdr3_mode],
+                     ["div",
+                      {"class": "col-sm-4"},
+                      ["input",
+                       {"id": "cdr3",
+                        "class": "form-control",
+                        "name": "cdr3",
+                        "type": "text",
+                        "placeholder": "CASSLGQAYEQYF",
+                        "value": request.args.get("cdr3", "")}]],
+                     ["div",
+                      {"class": "col-sm-2"},
+                      ["input",
+                       {"id": "cdr3_distance",
+                        "class": "form-control",
+                        "name": "cdr3_distance",
+                        "type": "number",
+                        "min": "0",
+                        "max": str(max_distance),
+                        "placeholder": "1",
+                        "title": "Maximum edit distance",
+                        "value": request.args.get("cdr3_distance", "")}]]],
                     ["div",
                      {"class": "form-group row"},
                      ["label", {"for": "nonpeptide-typeahead", "class": "col-sm-3 col-form-label"}, "Non-Peptidic Epitope"],
@@ -480,125 +1508,246 @@ def search():
                        {"id": "nonpeptide_all-typeahead",
                         "class": "typeahead form-control",
                         "type": "text",
-                        "value": selected_nonpeptide_label}]]]]
+                        "value": selected_nonpeptide_label}]]],
+                    ["div",
+                     {"class": "form-group row"},
+                     ["label", {"for": "organism-typeahead", "class": "col-sm-3 col-form-label"},
+                      "Source Organism"],
+                     ["div",
+                      {"class": "col-sm-9"},
+                      ["input",
+                       {"id": "organism-hidden",
+                        "name": "source_organism",
+                        "type": "hidden",
+                        "value": selected_organism_id}],
+                      ["input",
+                       {"id": "organism-typeahead",
+                        "class": "typeahead form-control",
+                        "type": "text",
+                        "data-field": "source_organism",
+                        "value": selected_organism_label}]]]]
 
             html.append(["div",
                          {"class": "row"},
                          form,
                          tree,
-                         tree2])
-
-        elif tab == "epitope":
-            q["select"] = [
-                "structure_id",
-                "description",
-                "source_antigen_label",
-                "source_organism_label",
-                "count(distinct reference_id) AS \"references\"",
-                "count(distinct assay_id) AS assays",
-            ]
-            q["group by"] = ["structure_id"]
-            q["order by"] = ["\"references\" DESC"]
-
-        elif tab == "antigen":
-            q["select"] = [
-                "source_antigen_label",
-                "source_antigen_source_organism_label",
-                "count(distinct structure_id) AS epitopes",
-                "count(distinct assay_id) AS assays",
-                "count(distinct reference_id) AS \"references\"",
-            ]
-            q["where"].append("source_antigen_id IS NOT NULL")
-            q["group by"] = ["source_antigen_id"]
-            q["order by"] = ["\"references\" DESC"]
-
-        elif tab == "assay":
-            nav = ["ul", {"class": "nav nav-tabs justify-content-center", "style": "margin-bottom: 1em"}]
-            tab2 = request.args.get("tab2", "tcell")
-            for table, title in [("tcell", "T Cell Assays"), ("bcell", "B Cell Assays"), ("elution", "MHC Ligand Assays")]:
-                cls = "nav-link"
-                if tab2 == table:
-                    cls += " active"
-                args["tab2"] = table
-                args["page"] = 1
-                count = result["assay"][f"{table}_count"]
-                title += f" ({count})"
-                nav.append(
-                   ["li",
-                    {"class": "nav-item"}, 
-                    ["a",
-                     {"class": cls, "href": "?" + urlencode(args)},
-                     title]])
-            html.append(nav)
+                         tree2,
+                         tree3])
 
-            table = tab2
-            count = result["assay"][f"{table}_count"]
-            q["select"] = [f"DISTINCT {table}_id"]
-            q["where"].append(f"{table}_id IS NOT NULL")
-            rows = query(cur, q)
-            ids = [str(row[f"{table}_id"]) for row in rows]
-            ids = ", ".join(ids)
-            q = {
-              "select": ["*"],
-              "from": [table],
-              "where": [f"{table}_id IN ({ids})"]
-            }
-
-        elif tab == "receptor":
+        elif tab in subtabs:
             nav = ["ul", {"class": "nav nav-tabs justify-content-center", "style": "margin-bottom: 1em"}]
-            tab2 = request.args.get("tab2", "tcr")
-            for table, title in [("tcr", "T Cell Receptors"), ("bcr", "B Cell Receptors")]:
+            for table, title in subtabs[tab]:
                 cls = "nav-link"
                 if tab2 == table:
                     cls += " active"
                 args["tab2"] = table
                 args["page"] = 1
-                count = result["receptor"][f"{table}_count"]
-                title += f" ({count})"
-                nav.append(
-                   ["li",
-                    {"class": "nav-item"},
-                    ["a",
-                     {"class": cls, "href": "?" + urlencode(args)},
-                     title]])
+                title = count_title(title, result, tab, f"{table}_count")
+                nav.append(["li",
+                            {"class": "nav-item"},
+                            ["a",
+                             {"class": cls, "href": "?" + urlencode(args)},
+                             title]])
             html.append(nav)
 
-            table = tab2
-            count = result["receptor"][f"{table}_count"]
-            q["select"] = [
-                "DISTINCT receptor_group_id AS receptor_id",
-                "receptor_species_names",
-                "receptor_type",
-                "chain1_cdr3_sequence",
-                "chain2_cdr3_sequence",
-            ]
-            q["from"] = [f"{table} AS s"]
-            q["group by"] = ["receptor_group_id"]
-            q["order by"] = ["receptor_group_id ASC"]
-
-        elif tab == "reference":
-            q["select"] = [
-                "DISTINCT reference_id",
-                "pubmed_id",
-                "reference_author",
-                "reference_title",
-                "reference_date"
-            ]
-            q["order by"] = ["reference_date DESC"]
-
         if tab != "search":
-            rows = query(cur, q)
-            html.append(make_paged_table(rows, count, dict(request.args)))
+            q = tab_query(result, tab, tab2, offset)
+            rows = tab_rows(cur, request.args, q, tab, tab2, offset)
+            count_name = tab_count_name(tab, tab2)
+            count = result[tab].get(count_name.split(".")[1])
+            html.append(make_paged_table(rows, count, dict(request.args), count_name))
+
+        return render_page(html)
+
+
+@app.route('/search/counts.json')
+@http_cache()
+def search_counts():
+    return jsonify(submit_counts(request.args).result())
+
+
+@app.route('/search/stats.json')
+def search_stats():
+    with flight_lock:
+        return jsonify({**flight_stats, "in_flight": len(flights)})
+
+
+similar_max_limit = 1000
+
+
+@app.route('/sequence/similar.json')
+@http_cache()
+def similar_sequences():
+    """Return the epitope sequences of the same length as the given sequence,
+    either within a number of substitutions (scoring=hamming)
+    or the best ungapped BLOSUM62 scores (scoring=blosum62)."""
+    if peptide_index is None:
+        return jsonify({"error": "No current sequence index; run `make peptides`"}), 503
+    sequence = request.args.get("sequence", "")
+    scoring = request.args.get("scoring", "hamming")
+    try:
+        result_limit = int(request.args.get("limit", "50"))
+        distance = int(request.args.get("distance", "1"))
+    except ValueError:
+        return jsonify({"error": "The limit and distance must be integers"}), 400
+    if result_limit < 1:
+        return jsonify({"error": "The limit must be positive"}), 400
+    if not 0 <= distance <= max_distance:
+        return jsonify({"error": f"The distance must be from 0 to {max_distance}"}), 400
+    result_limit = min(result_limit, similar_max_limit)
+    if scoring == "blosum62":
+        name = "score"
+        matches = peptides.blosum(peptide_index, sequence, result_limit)
+    elif scoring == "hamming":
+        name = "substitutions"
+        matches = peptides.hamming(peptide_index, sequence, distance)
+        matches = matches[:result_limit]
+    else:
+        return jsonify({"error": f"Unknown scoring '{scoring}'"}), 400
+
+    with connect(sqlite) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT sequence_id, linear_sequence FROM sequence "
+            "WHERE sequence_id IN (SELECT value FROM json_each(?))",
+            (json.dumps([sequence_id for sequence_id, _ in matches]),))
+        sequences = dict(cur.fetchall())
+    return jsonify([
+        {"linear_sequence": sequences[sequence_id], name: value}
+        for sequence_id, value in matches
+    ])
+
+
+# JSON API: the same queries as the search pages, without rendering any HTML
+api_tabs = ["epitope", "antigen", "assay", "receptor", "reference"]
+api_max_page_size = 1000
+json_types = {bool: "boolean", int: "integer", float: "real", str: "text"}
+
+
+def encode_cursor(offset, after=None):
+    """Given a row offset and the last ID of the page or None,
+    return an opaque cursor for the next page, tied to this build of iedb.db.
+    The assay tabs seek to the ID after the last one, so deep pages cost the same as the first.
+    The other tabs are sorted on aggregates of every matching row, or on reference details,
+    so they still skip the offset: the snapshot and the query cache keep that cheap."""
+    data = {"offset": offset, "build": build}
+    if after is not None:
+        data["after"] = after
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Given a cursor or None, return its row offset and the last ID of the previous page or None,
+    or raise a ValueError if it is malformed or from another build."""
+    if not cursor:
+        return 0, None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        offset = int(data["offset"])
+        after = int(data["after"]) if "after" in data else None
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Malformed cursor")
+    if data.get("build") != build or offset < 0:
+        raise ValueError("The cursor is from another build of the data; start again")
+    return offset, after
+
+
+def column_types(rows):
+    """Given a list of row dicts, return a list of column names and their JSON types,
+    taking each type from the first non-null value."""
+    types = {}
+    for row in rows:
+        for name, value in row.items():
+            if types.get(name, "null") == "null":
+                types[name] = json_types.get(type(value), "null")
+    return [{"name": name, "type": kind} for name, kind in types.items()]
+
+
+@app.route('/api/search')
+@http_cache()
+def api_search():
+    """Return a page of rows for a search tab, with the same filters as /search/.
+    The count is included when it is cached, otherwise it is null (see /api/counts).
+    Pass next_cursor back as cursor to get the next page."""
+    tab = request.args.get("tab", "epitope")
+    if tab not in api_tabs:
+        return jsonify({"error": f"Unknown tab '{tab}'"}), 400
+    tab2 = request.args.get("tab2", subtabs[tab][0][0] if tab in subtabs else None)
+    if tab in subtabs and tab2 not in [table for table, _ in subtabs[tab]]:
+        return jsonify({"error": f"Unknown tab2 '{tab2}'"}), 400
+    try:
+        offset, after = decode_cursor(request.args.get("cursor"))
+        page_size = min(int(request.args.get("limit", limit)), api_max_page_size)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page_size < 1:
+        return jsonify({"error": "The limit must be positive"}), 400
+
+    with connect(sqlite) as conn:
+        conn.row_factory = dict_factory
+        cur = conn.cursor()
+        result = my_count(cur, request.args, compute=False)
+        q = tab_query(result, tab, tab2, offset, page_size, after)
+        rows = tab_rows(cur, request.args, q, tab, tab2, offset, page_size)
+
+    count = result[tab].get(tab_count_name(tab, tab2).split(".")[1])
+    next_cursor = None
+    if len(rows) == page_size and (count is None or offset + page_size < count):
+        last = rows[-1][f"{tab2}_id"] if tab == "assay" else None
+        next_cursor = encode_cursor(offset + page_size, last)
+    return jsonify({
+        "tab": tab,
+        "tab2": tab2,
+        "count": count,
+        "columns": column_types(rows),
+        "rows": rows,
+        "next_cursor": next_cursor,
+    })
+
+
+@app.route('/api/counts')
+@http_cache()
+def api_counts():
+    """Return the counts for every search tab, computing them if they are not cached."""
+    return jsonify(submit_counts(request.args).result())
+
+
+@app.route('/api/finder/<name>')
+@http_cache()
+def api_finder(name):
+    """Return a finder term with its label, the edges to its ancestors, and its children."""
+    if name not in finder_roots:
+        return jsonify({"error": f"Unknown finder '{name}'"}), 404
+    node_id = request.args.get("id", finder_roots[name])
+    with connect(sqlite) as conn:
+        conn.row_factory = dict_factory
+        ancestor_rows, child_rows = finder_rows(conn.cursor(), name, node_id)
+    if not ancestor_rows:
+        return jsonify({"error": f"Term '{node_id}' is not in the {name} finder"}), 404
+    return jsonify({
+        "id": node_id,
+        "label": ancestor_rows[0]["label"],
+        "ancestors": [
+            {"id": row["parent"], "label": row["label"], "child": row["child"]}
+            for row in ancestor_rows[1:]
+        ],
+        "children": [{"id": row["child"], "label": row["label"]} for row in child_rows],
+    })
+
 
-        return render_template("base.jinja2", html=tsv2rdf.render(html))
+# The tables with a {table}_name view or table for the typeaheads
+name_tables = ["nonpeptide", "nonpeptide_old", "nonpeptide_all", "organism"]
 
 
 @app.route('/names.json')
+@http_cache(max_age=86400)
 def names():
-    with sqlite3.connect(sqlite, uri=True) as conn:
+    table = request.args.get("table", "nonpeptide")
+    if table not in name_tables:
+        return jsonify({"error": f"Unknown table '{table}'"}), 400
+    with connect(sqlite) as conn:
         conn.row_factory = dict_factory
         cur = conn.cursor()
-        table = request.args.get("table", "nonpeptide")
         text = request.args.get("text")
         if text:
             cur.execute(f"""
@@ -616,20 +1765,89 @@ LIMIT 100""")
         return jsonify(cur.fetchall())
 
 
-# Proxy to sqlite-web
+# Proxy to the sqlite-web servers started by run.sh
 ports = {"source": 8080, "iedb": 8081}
-@app.route('/<db>.db/', defaults={"path": ""})
-@app.route('/<db>.db/<path:path>', methods=["GET", "POST"])
+proxy_timeout = (3.05, 60)
+proxy_chunk_size = 64 * 1024
+# Hop-by-hop headers, and headers that the proxy sets itself
+proxy_request_headers = ["host", "connection", "keep-alive", "transfer-encoding", "content-length",
+                         "accept-encoding"]
+proxy_response_headers = ["connection", "keep-alive", "transfer-encoding", "content-length"]
+
+
+def make_session():
+    """Return a requests session that keeps a pool of connections open to one upstream."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16)
+    session.mount("http://", adapter)
+    return session
+
+
+proxy_sessions = {db: make_session() for db in ports}
+proxy_lock = threading.Lock()
+proxy_stats = {db: {"requests": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0} for db in ports}
+
+
+def count_proxy(db, seconds, error=False):
+    """Given a database name, the seconds until the upstream response headers, and an error flag,
+    update the proxy statistics."""
+    with proxy_lock:
+        stats = proxy_stats[db]
+        stats["requests"] += 1
+        stats["errors"] += int(error)
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+
+@app.route('/<db>.db/', defaults={"path": ""}, methods=["GET", "HEAD", "POST"])
+@app.route('/<db>.db/<path:path>', methods=["GET", "HEAD", "POST"])
 def proxy(db, path):
-    print(db, path)
-    excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-    if request.method=='GET':
-        resp = get(f'http://localhost:{ports[db]}/{db}.db/{path}')
-    elif request.method=='POST':
-        resp = get(f'http://localhost:{ports[db]}/{db}.db/{path}', request.form)
-    headers = [(name, value) for (name, value) in resp.raw.headers.items() if name.lower() not in excluded_headers]
-    response = Response(resp.content, resp.status_code, headers)
-    return response
+    if db not in ports:
+        return Response("Not found", 404)
+    upstream = f"http://localhost:{ports[db]}"
+    headers = {name: value for name, value in request.headers.items()
+               if name.lower() not in proxy_request_headers}
+    # The body passes through as is, so only ask for encodings that the client accepts
+    headers["Accept-Encoding"] = request.headers.get("Accept-Encoding", "identity")
+    start = time.perf_counter()
+    try:
+        resp = proxy_sessions[db].request(
+            request.method,
+            f"{upstream}/{db}.db/{path}",
+            params=request.query_string,
+            data=request.get_data() if request.method == "POST" else None,
+            headers=headers,
+            stream=True,
+            allow_redirects=False,
+            timeout=proxy_timeout)
+    except requests.exceptions.Timeout:
+        count_proxy(db, time.perf_counter() - start, error=True)
+        return Response(f"Timed out waiting for {db}.db", 504)
+    except requests.exceptions.ConnectionError:
+        count_proxy(db, time.perf_counter() - start, error=True)
+        return Response(f"Could not connect to {db}.db", 502)
+    count_proxy(db, time.perf_counter() - start, error=resp.status_code >= 500)
+
+    headers = []
+    for name, value in resp.raw.headers.items():
+        if name.lower() in proxy_response_headers:
+            continue
+        if name.lower() == "location":
+            value = value.replace(upstream, "")
+        headers.append((name, value))
+
+    def generate():
+        try:
+            yield from resp.raw.stream(proxy_chunk_size, decode_content=False)
+        finally:
+            resp.close()
+    return Response(generate(), resp.status_code, headers)
+
+
+@app.route('/proxy/stats.json')
+def proxy_statistics():
+    with proxy_lock:
+        return jsonify(proxy_stats)
 
 
 @app.route('/<tree>')
@@ -638,9 +1856,10 @@ def tree(tree):
 
 
 @app.route('/<tree>/<term_id>')
+@http_cache(max_age=86400, db="pr")
 def term(tree, term_id):
     pr = "file:build/pr.db?mode=ro"
-    with sqlite3.connect(pr, uri=True) as conn:
+    with connect(pr) as conn:
         conn.row_factory = dict_factory
         cur = conn.cursor()
         return tsv2rdf.terms2rdfa(cur, tree, [term_id])
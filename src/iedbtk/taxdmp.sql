@@ -50,8 +50,22 @@ CREATE TABLE delnodes (
   tax_id int  -- deleted node id
 );
 
+-- Preorder numbering of the nodes from `ncbitaxon2tsv.py intervals`:
+-- Y is under X exactly when X.lft <= Y.lft AND Y.lft <= X.rgt,
+-- so subtree queries are range scans on intervals_lft:
+--   SELECT y.tax_id FROM intervals x JOIN intervals y ON y.lft BETWEEN x.lft AND x.rgt
+--   WHERE x.tax_id = 10239;
+DROP TABLE IF EXISTS intervals;
+CREATE TABLE intervals (
+  tax_id INTEGER PRIMARY KEY,  -- node id
+  lft int,                     -- preorder number of this node
+  rgt int,                     -- largest preorder number in this subtree
+  depth int                    -- number of ancestors
+);
+
 DROP INDEX IF EXISTS nodes_tax_id;
 DROP INDEX IF EXISTS names_tax_id;
+DROP INDEX IF EXISTS intervals_lft;
 
 .mode tabs
 .import build/taxdmp/nodes.tsv nodes
@@ -59,9 +73,11 @@ DROP INDEX IF EXISTS names_tax_id;
 .import build/taxdmp/merged.tsv merged
 .import build/taxdmp/delnodes.tsv delnodes
 .import build/taxdmp/citations.tsv citations
+.import build/taxdmp/intervals.tsv intervals
 
 CREATE INDEX nodes_tax_id ON nodes(tax_id);
 CREATE INDEX names_tax_id ON names(tax_id);
+CREATE INDEX intervals_lft ON intervals(lft, rgt);
 
 -- Check work
 --.tables
@@ -110,3 +110,80 @@ CREATE VIEW nonpeptide_all_name AS
 SELECT * FROM nonpeptide_name
 UNION ALL
 SELECT * FROM nonpeptide_old_name;
+
+-- The organism finder comes from the active tree in build/trees.db:
+-- only taxa with epitopes below them, sorted by their total weight.
+ATTACH DATABASE "file:build/trees.db?mode=ro" AS trees;
+ATTACH DATABASE "file:build/taxdmp.db?mode=ro" AS taxdmp;
+
+DROP TABLE IF EXISTS organism_tree;
+CREATE TABLE organism_tree (
+  parent TEXT,
+  child TEXT,
+  sort INT
+);
+
+DROP TABLE IF EXISTS organism_label;
+CREATE TABLE organism_label (
+  id TEXT,
+  label TEXT
+);
+
+DROP TABLE IF EXISTS organism_name;
+CREATE TABLE organism_name (
+  id TEXT,
+  kind TEXT,
+  name TEXT
+);
+
+-- Preorder intervals: Y is under X exactly when X.lft <= Y.lft AND Y.lft <= X.rgt
+DROP TABLE IF EXISTS organism_interval;
+CREATE TABLE organism_interval (
+  id TEXT PRIMARY KEY,
+  lft INT,
+  rgt INT,
+  depth INT
+);
+
+-- The root is its own parent in taxdmp, which the finder would follow forever
+INSERT INTO organism_tree
+SELECT parent, id, -total
+FROM trees.active
+WHERE id != parent;
+
+INSERT INTO organism_label
+SELECT id, label
+FROM trees.active;
+
+INSERT INTO organism_name
+SELECT id, 'label', label
+FROM organism_label;
+
+INSERT INTO organism_name
+SELECT a.id, 'synonym', a.label || " (" || n.name_txt || ")"
+FROM trees.active a
+JOIN taxdmp.names n ON n.tax_id = CAST(replace(a.id, 'NCBITaxon:', '') AS INTEGER)
+WHERE n.name_class IN (
+  'common name',
+  'genbank common name',
+  'equivalent name',
+  'synonym'
+) AND n.name_txt != a.label;
+
+INSERT INTO organism_interval
+SELECT id, lft, rgt, depth
+FROM trees.active;
+
+CREATE INDEX organism_tree_parent ON organism_tree(parent);
+CREATE INDEX organism_tree_child ON organism_tree(child);
+CREATE INDEX organism_label_id ON organism_label(id);
+
+-- Number each source organism, so that a subtree filter on the search views
+-- is one range scan on organism_source_organism_lft.
+DROP INDEX IF EXISTS organism_source_organism_lft;
+
+UPDATE organism SET source_organism_lft = (
+  SELECT lft FROM organism_interval WHERE id = organism.source_organism_id
+);
+
+CREATE INDEX organism_source_organism_lft ON organism(source_organism_lft);
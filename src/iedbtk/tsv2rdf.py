@@ -35,7 +35,7 @@ def render(element, depth=0):
         if tag == "a" and "href" not in attrs and "resource" in attrs:
             attrs["href"] = curie2href(attrs["resource"])
         for key, value in attrs.items():
-            if key in ["checked"]:
+            if key in ["checked", "selected"]:
                 if value:
                     output += f" {key}"
             else:
@@ -252,7 +252,6 @@ def term2rdfa(cur, prefixes, treename, stanza, term_id):
             }
         tree[parent]["children"].append(child)
         tree[child]["parents"].append(parent)
-    print("TREE ", len(tree.keys()))
     data = {"labels": {}}
     data[treename] = tree
 
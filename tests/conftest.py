@@ -0,0 +1,146 @@
+import gzip
+import json
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+tests = os.path.dirname(os.path.abspath(__file__))
+# The modules in src/iedbtk are scripts that import each other by name
+sys.path.insert(0, os.path.join(tests, "..", "src", "iedbtk"))
+sys.path.insert(1, os.path.join(tests, "..", "benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """Import the server in an empty working directory:
+    without build/, it runs without the snapshot, the peptide index, or the shared cache."""
+    directory = tmp_path_factory.mktemp("server")
+    os.makedirs(directory / "data2")
+    (directory / "data2" / "prefixes.tsv").write_text(
+        "rdfs\thttp://www.w3.org/2000/01/rdf-schema#\n"
+    )
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import server
+    finally:
+        os.chdir(cwd)
+    return server
+
+
+@pytest.fixture(scope="session")
+def built(tmp_path_factory):
+    """Generate small synthetic inputs with benchmarks/fixtures.py,
+    build iedb.db, the snapshot, and the peptide index with the Makefile,
+    and return the directory."""
+    if not shutil.which("make") or not shutil.which("sqlite3"):
+        pytest.skip("Building iedb.db needs make and the sqlite3 command")
+    import fixtures
+
+    directory = str(tmp_path_factory.mktemp("built"))
+    fixtures.generate(directory, rows=2000, taxa=1000)
+    fixtures.build(directory)
+    return directory
+
+
+@pytest.fixture
+def iedb(server, built, monkeypatch, tmp_path):
+    """Point the server at the small build, with the snapshot, the peptide index,
+    and an empty shared cache, and return the path to iedb.db."""
+    import columnar
+    import peptides
+    import querycache
+
+    path = os.path.join(built, "build", "iedb.db")
+    monkeypatch.setattr(server, "sqlite", f"file:{path}?mode=ro")
+    monkeypatch.setattr(
+        server, "snapshot", columnar.load_snapshot(os.path.join(built, "build", "snapshot"), path)
+    )
+    monkeypatch.setattr(
+        server, "peptide_index", peptides.load_index(os.path.join(built, "build", "peptides"), path)
+    )
+    monkeypatch.setattr(server, "build", querycache.build_id(path))
+    monkeypatch.setattr(server, "query_cache", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(server, "counts", {})
+    monkeypatch.setattr(server, "cache_list", [])
+    monkeypatch.setattr(server, "cache_dict", {})
+    return path
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """A stand-in for sqlite_web that records each request and answers with it as JSON:
+    /iedb.db/redirect redirects with an absolute Location, /iedb.db/slow waits a second,
+    and the body is gzipped when the request accepts gzip."""
+
+    def do_GET(self):
+        self.respond()
+
+    def do_HEAD(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        length = int(self.headers.get("Content-Length", 0))
+        seen = {
+            "method": self.command,
+            "path": self.path,
+            "headers": {name.lower(): value for name, value in self.headers.items()},
+            "body": self.rfile.read(length).decode(),
+        }
+        self.server.seen.append(seen)
+        if self.path.startswith("/iedb.db/slow"):
+            time.sleep(1)
+        body = json.dumps(seen).encode()
+        try:
+            if self.path.startswith("/iedb.db/redirect"):
+                self.send_response(302)
+                self.send_header("Location", f"http://localhost:{self.server.port}/iedb.db/target")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+        except OSError:
+            # The proxy stopped waiting
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(server, monkeypatch):
+    """Run a stand-in for the iedb.db sqlite_web server on a free port,
+    point the server's proxy at it, and return it, with the requests it has seen."""
+    httpd = ThreadingHTTPServer(("localhost", 0), Upstream)
+    httpd.daemon_threads = True
+    httpd.port = httpd.server_address[1]
+    httpd.seen = []
+    monkeypatch.setitem(server.ports, "iedb", httpd.port)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def closed_port():
+    """Return a local port that nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
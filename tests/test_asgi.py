@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def asgi(server, monkeypatch):
+    """Return the ASGI module, with no proxy clients left over from other tests."""
+    import asgi
+
+    monkeypatch.setattr(asgi, "proxy_clients", {})
+    return asgi
+
+
+def fetch(asgi, method, url, accept_encoding=None, **kwargs):
+    """Given the ASGI module, a method, a URL, the Accept-Encoding to send or None for none,
+    and any other arguments for httpx, send the request through the ASGI app
+    on a new event loop and return the response."""
+
+    async def send():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            del client.headers["Accept-Encoding"]
+            if accept_encoding:
+                client.headers["Accept-Encoding"] = accept_encoding
+            try:
+                response = await client.request(method, url, **kwargs)
+                await response.aread()
+                return response
+            finally:
+                # The proxy clients belong to this event loop
+                for proxy_client in asgi.proxy_clients.values():
+                    await proxy_client.aclose()
+                asgi.proxy_clients.clear()
+
+    return asyncio.run(send())
+
+
+def test_route(asgi, monkeypatch):
+    # Flask routes run in the pool, not on the event loop
+    monkeypatch.setitem(
+        asgi.server.app.view_functions, "search_stats", lambda: threading.current_thread().name
+    )
+    response = fetch(asgi, "GET", "/search/stats.json")
+    assert response.status_code == 200
+    assert response.text.startswith("sqlite")
+
+
+def test_route_request(asgi):
+    response = fetch(asgi, "GET", "/api/search?tab=other")
+    assert response.status_code == 400
+    assert response.json() == {"error": "Unknown tab 'other'"}
+    assert fetch(asgi, "GET", "/api/search?cursor=bad").json() == {"error": "Malformed cursor"}
+
+
+def test_proxy(asgi, upstream):
+    response = fetch(asgi, "GET", "/iedb.db/search/query?sql=SELECT+1", headers={"X-Test": "yes"})
+    assert response.status_code == 200
+    seen = response.json()
+    assert seen["method"] == "GET"
+    assert seen["path"] == "/iedb.db/search/query?sql=SELECT+1"
+    assert seen["headers"]["x-test"] == "yes"
+    assert seen["headers"]["host"] == f"localhost:{upstream.port}"
+    assert seen["headers"]["accept-encoding"] == "identity"
+    assert "Content-Encoding" not in response.headers
+
+    response = fetch(asgi, "POST", "/iedb.db/search/query", data={"sql": "SELECT 2"})
+    seen = response.json()
+    assert seen["method"] == "POST"
+    assert seen["body"] == "sql=SELECT+2"
+
+
+def test_proxy_gzip(asgi, upstream):
+    response = fetch(asgi, "GET", "/iedb.db/", accept_encoding="gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.json()["headers"]["accept-encoding"] == "gzip"
+
+
+def test_proxy_location(asgi, upstream):
+    response = fetch(asgi, "GET", "/iedb.db/redirect")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/iedb.db/target"
+
+
+def test_proxy_timeout(asgi, upstream, monkeypatch):
+    monkeypatch.setattr(asgi.server, "proxy_timeout", (3.05, 0.2))
+    errors = asgi.server.proxy_stats["iedb"]["errors"]
+    response = fetch(asgi, "GET", "/iedb.db/slow")
+    assert response.status_code == 504
+    assert response.text == "Timed out waiting for iedb.db"
+    assert asgi.server.proxy_stats["iedb"]["errors"] == errors + 1
+
+
+def test_proxy_connection_error(asgi, closed_port, monkeypatch):
+    monkeypatch.setitem(asgi.server.ports, "iedb", closed_port)
+    errors = asgi.server.proxy_stats["iedb"]["errors"]
+    response = fetch(asgi, "GET", "/iedb.db/")
+    assert response.status_code == 502
+    assert response.text == "Could not connect to iedb.db"
+    assert asgi.server.proxy_stats["iedb"]["errors"] == errors + 1
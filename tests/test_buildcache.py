@@ -0,0 +1,105 @@
+import os
+import subprocess
+
+import pytest
+
+import buildcache
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def entries():
+    return sorted(os.listdir(buildcache.cache_dir))
+
+
+def test_digest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("a.txt", "one")
+    write("b.txt", "one")
+    key = buildcache.digest(["a.txt"])
+    assert len(key) == 16
+    assert buildcache.digest(["a.txt"]) == key
+    # The name is part of the key, as is the order
+    assert buildcache.digest(["b.txt"]) != key
+    assert buildcache.digest(["a.txt", "b.txt"]) != buildcache.digest(["b.txt", "a.txt"])
+    write("a.txt", "two")
+    assert buildcache.digest(["a.txt"]) != key
+
+
+def test_digest_cached_input(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(buildcache.cache_dir)
+    path = os.path.join(buildcache.cache_dir, "organism-0123456789abcdef.db")
+    write(path, "one")
+    key = buildcache.digest([path])
+    # A cache entry is keyed by its name alone
+    write(path, "two")
+    assert buildcache.digest([path]) == key
+
+
+def test_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("input.txt", "one")
+    command = 'cat input.txt > "$OUTPUT" && echo run >> runs.txt'
+
+    buildcache.cached("build/output.txt", ["input.txt"], command)
+    assert os.path.islink("build/output.txt")
+    assert read("build/output.txt") == "one"
+    assert read("runs.txt") == "run\n"
+
+    # A hit links the entry again without running the command
+    os.remove("build/output.txt")
+    buildcache.cached("build/output.txt", ["input.txt"], command)
+    assert read("build/output.txt") == "one"
+    assert read("runs.txt") == "run\n"
+
+    write("input.txt", "two")
+    buildcache.cached("build/output.txt", ["input.txt"], command)
+    assert read("build/output.txt") == "two"
+    assert read("runs.txt") == "run\nrun\n"
+    assert len(entries()) == 2
+
+
+def test_cached_base(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("base.txt", "base\n")
+    write("input.txt", "input\n")
+    buildcache.cached("output.txt", ["input.txt"], 'cat input.txt >> "$OUTPUT"', base="base.txt")
+    assert read("output.txt") == "base\ninput\n"
+    # The base is copied, not changed
+    assert read("base.txt") == "base\n"
+
+
+def test_cached_failure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("input.txt", "one")
+    with pytest.raises(subprocess.CalledProcessError):
+        buildcache.cached("output.txt", ["input.txt"], 'echo partial > "$OUTPUT"; exit 1')
+    assert not os.path.lexists("output.txt")
+    assert [name for name in entries() if not name.endswith(".tmp")] == []
+
+
+def test_prune(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for i, text in enumerate(["one", "two", "three", "four"]):
+        write("input.txt", text)
+        buildcache.cached("output.txt", ["input.txt"], 'cat input.txt > "$OUTPUT"', keep=2)
+        # Make each entry older than the next
+        for name in entries():
+            path = os.path.join(buildcache.cache_dir, name)
+            os.utime(path, (os.path.getmtime(path) - 10, os.path.getmtime(path) - 10))
+    assert len(entries()) == 2
+    assert read("output.txt") == "four"
+    # The most recently used entry survives, even when it is not the newest
+    write("input.txt", "three")
+    buildcache.cached("output.txt", ["input.txt"], 'cat input.txt > "$OUTPUT"', keep=1)
+    assert entries() == [os.path.basename(os.path.realpath("output.txt"))]
+    assert read("output.txt") == "three"
@@ -0,0 +1,180 @@
+import os
+import random
+import sqlite3
+
+import pytest
+
+import columnar
+
+# Each structure has one label, several references and assays, and the counts tie often
+labels = {1: "one", 2: "two", 3: "three", 4: "four", 5: "five", 6: "six"}
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    """Write a small search table and its snapshot, and return the database path and snapshot."""
+    if columnar.numpy is None:
+        pytest.skip("NumPy is not installed")
+    directory = tmp_path_factory.mktemp("columnar")
+    path = str(directory / "iedb.db")
+    rng = random.Random(0)
+    rows = []
+    for search_id in range(1, 301):
+        structure_id = rng.choice([None, *labels])
+        rows.append(
+            (
+                search_id,
+                structure_id,
+                labels.get(structure_id),
+                rng.choice([None, 10, 11, 12, 13]),
+                rng.randint(100, 120),
+                rng.choice([None, "2001", "2010", "2020"]),
+                rng.choice([0, 1]),
+                rng.choice([7, "7a", None]),
+            )
+        )
+    with sqlite3.connect(path) as conn:
+        conn.execute("""CREATE TABLE search (
+              search_id INTEGER PRIMARY KEY,
+              structure_id INT,
+              label TEXT,
+              reference_id INT,
+              assay_id INT,
+              reference_date TEXT,
+              assay_positive BOOLEAN,
+              mixed
+            )""")
+        conn.executemany("INSERT INTO search VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.close()
+    columnar.write_snapshot(path, str(directory / "snapshot"), ["search"])
+    return path, columnar.load_snapshot(str(directory / "snapshot"), path)
+
+
+def test_snapshot(database):
+    path, snapshot = database
+    table = snapshot["search"]
+    assert table["rows"] == 300
+    assert "search_id" not in table["codes"]
+    with sqlite3.connect(path) as conn:
+        for column in ["structure_id", "label", "reference_date", "mixed"]:
+            # The dictionary is in SQLite order with NULL first
+            values = table["values"][column]
+            assert values[0] is None
+            sqlite_order = conn.execute(
+                f"SELECT DISTINCT {column} FROM search WHERE {column} IS NOT NULL ORDER BY 1"
+            )
+            assert values[1:] == [row[0] for row in sqlite_order]
+            # Decoding the codes gives back the column
+            decoded = [values[code] for code in table["codes"][column].tolist()]
+            stored = conn.execute(f"SELECT {column} FROM search ORDER BY search_id")
+            assert decoded == [row[0] for row in stored]
+    conn.close()
+
+
+def test_load_snapshot_stale(database, tmp_path):
+    path, _ = database
+    directory = os.path.join(os.path.dirname(path), "snapshot")
+    assert columnar.load_snapshot(str(tmp_path / "missing"), path) is None
+    stat = os.stat(path)
+    try:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert columnar.load_snapshot(directory, path) is None
+    finally:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert columnar.load_snapshot(directory, path) is not None
+
+
+def test_encode(database):
+    _, snapshot = database
+    table = snapshot["search"]
+    values = table["values"]["label"]
+    assert columnar.encode(table, "label", "four") == values.index("four")
+    assert columnar.encode(table, "label", "seven") == -1
+    assert columnar.encode(table, "structure_id", 3) == table["values"]["structure_id"].index(3)
+    assert columnar.encode(table, "structure_id", 99) == -1
+    # Integers sort before text in a mixed column
+    mixed = table["values"]["mixed"]
+    assert mixed == [None, 7, "7a"]
+    assert columnar.encode(table, "mixed", "7a") == 2
+    assert columnar.encode(table, "mixed", "8") == -1
+
+
+def test_code_range(database):
+    _, snapshot = database
+    table = snapshot["search"]
+    values = table["values"]["assay_id"]
+    first, last = columnar.code_range(table, "assay_id", 105, 110)
+    assert values[first : last + 1] == list(range(105, 111))
+    first, last = columnar.code_range(table, "assay_id", 104.5, 105.5)
+    assert values[first : last + 1] == [105]
+    # An empty range has last < first
+    first, last = columnar.code_range(table, "assay_id", 200, 300)
+    assert last < first
+
+
+def sql_rows(path, query, params=()):
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        conn.row_factory = sqlite3.Row
+        rows = [dict(row) for row in conn.execute(query, params)]
+    conn.close()
+    return rows
+
+
+epitope_spec = {
+    "group by": "structure_id",
+    "columns": {"structure_id": "structure_id", "label": "label"},
+    "counts": {"references": "reference_id", "assays": "assay_id"},
+    "order by": ("references", True),
+}
+epitope_query = """SELECT structure_id, label,
+  count(DISTINCT reference_id) AS "references",
+  count(DISTINCT assay_id) AS assays
+FROM search
+WHERE {where}
+GROUP BY structure_id
+ORDER BY "references" DESC, structure_id
+LIMIT ? OFFSET ?"""
+
+first_spec = {
+    "group by": "reference_id",
+    "columns": {
+        "reference_id": "reference_id",
+        "reference_date": "reference_date",
+        "assay_id": "assay_id",
+    },
+    "first": "assay_id",
+    "order by": ("reference_date", True),
+}
+# With one min(), SQLite takes the other columns from the row with the lowest assay_id
+first_query = """SELECT reference_id, reference_date, assay_id
+FROM search
+WHERE {where}
+GROUP BY reference_id
+ORDER BY reference_date DESC, reference_id, min(assay_id)
+LIMIT ? OFFSET ?"""
+
+
+@pytest.mark.parametrize("spec,query", [(epitope_spec, epitope_query), (first_spec, first_query)])
+@pytest.mark.parametrize("where", ["TRUE", "assay_positive", "assay_id < 105", "FALSE"])
+@pytest.mark.parametrize("limit,offset", [(100, 0), (2, 0), (2, 1), (3, 4)])
+def test_aggregate(database, spec, query, where, limit, offset):
+    path, snapshot = database
+    table = snapshot["search"]
+    keep = {
+        row["search_id"] for row in sql_rows(path, f"SELECT search_id FROM search WHERE {where}")
+    }
+    mask = columnar.numpy.array([search_id in keep for search_id in range(1, 301)])
+    expected = sql_rows(path, query.format(where=where), (limit, offset))
+    assert columnar.aggregate(table, mask, spec, limit, offset) == expected
+
+
+def test_aggregate_ties(database):
+    path, snapshot = database
+    table = snapshot["search"]
+    mask = columnar.numpy.ones(table["rows"], dtype=bool)
+    rows = columnar.aggregate(table, mask, epitope_spec)
+    # Ties are broken by structure_id, so pages never overlap
+    keys = [(-row["references"], row["structure_id"] or 0) for row in rows]
+    assert keys == sorted(keys)
+    pages = [columnar.aggregate(table, mask, epitope_spec, 2, offset) for offset in [0, 2, 4, 6]]
+    assert [row for page in pages for row in page] == rows
@@ -0,0 +1,386 @@
+import csv
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+import ncbitaxon2tsv
+
+# 1
+# ├── 2
+# │   ├── 3
+# │   │   └── 9
+# │   └── 4
+# └── 5
+#     └── 6
+#         ├── 7
+#         └── 8
+parents = {1: 1, 2: 1, 3: 2, 4: 2, 5: 1, 6: 5, 7: 6, 8: 6, 9: 3}
+weights = {9: 2, 4: 1, 7: 5}
+# Old tax_id, new tax_id
+merged = [("90", "9"), ("91", "9"), ("80", "8"), ("70", "7")]
+# cit_id, cit_key, pubmed_id, medline_id, url, text, taxid_list
+citations = [
+    ("1", "One", "0", "111", "", "", "9 7"),
+    ("2", "Two", "0", "0", "", "", "9"),
+    ("3", "Three", "0", "333", "", "", "8 12"),
+    ("4", "Four", "0", "444", "", "", ""),
+    ("5", "Five", "0", "555", "", "", "7"),
+]
+ranks = {2: "superkingdom", 3: "genus", 4: "species", 9: "species", 5: "superkingdom"}
+
+
+def dmp(rows):
+    return "".join("\t|\t".join(row) + "\t|\n" for row in rows)
+
+
+@pytest.fixture
+def taxdmp(tmp_path):
+    """Write a small taxdmp.zip and return it open."""
+    path = tmp_path / "taxdmp.zip"
+    nodes = []
+    for tax_id, parent in parents.items():
+        row = dict.fromkeys(ncbitaxon2tsv.nodes_fields, "")
+        row.update(tax_id=str(tax_id), parent_tax_id=str(parent), rank=ranks.get(tax_id, "no rank"))
+        nodes.append(row.values())
+    names = [(str(tax_id), f"Taxon {tax_id}", "", "scientific name") for tax_id in parents]
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("nodes.dmp", dmp(nodes))
+        z.writestr("names.dmp", dmp(names))
+        z.writestr("merged.dmp", dmp(merged))
+        z.writestr("citations.dmp", dmp(citations))
+    with zipfile.ZipFile(path) as z:
+        yield z
+
+
+def edges(tree):
+    """Given a tree, return a dictionary from tax_id to parent tax_id (None for a root)."""
+    ids = tree["ids"]
+    return {
+        ids[p]: ids[parent] if parent >= 0 else None for p, parent in enumerate(tree["parents"])
+    }
+
+
+def test_build_tree(taxdmp):
+    tree = ncbitaxon2tsv.build_tree(ncbitaxon2tsv.read_nodes(taxdmp), weights)
+    # 8 has no epitopes and no active descendants
+    assert edges(tree) == {1: None, 2: 1, 3: 2, 4: 2, 5: 1, 6: 5, 7: 6, 9: 3}
+    sums = dict(zip(tree["ids"], tree["epitope_sum"]))
+    assert sums == {1: 8, 2: 3, 3: 2, 4: 1, 5: 5, 6: 5, 7: 5, 9: 2}
+    counts = dict(zip(tree["ids"], tree["epitope_count"]))
+    assert counts[9] == 2 and counts[3] == 0
+
+
+def test_extract_subtree(taxdmp):
+    tree = ncbitaxon2tsv.build_tree(ncbitaxon2tsv.read_nodes(taxdmp), weights)
+    assert edges(ncbitaxon2tsv.extract_subtree(tree, 2)) == {2: None, 3: 2, 4: 2, 9: 3}
+    with pytest.raises(Exception):
+        ncbitaxon2tsv.extract_subtree(tree, 8)
+
+
+def test_prune_poles(taxdmp):
+    tree = ncbitaxon2tsv.build_tree(ncbitaxon2tsv.read_nodes(taxdmp), weights)
+    # The root has two children: keep the last, then stop at 5, which has one
+    pruned = ncbitaxon2tsv.prune_poles(tree, 1)
+    assert edges(pruned) == {1: None, 5: 1, 6: 5, 7: 6}
+    assert list(pruned["epitope_sum"]) == [8, 5, 5, 5]
+    # An absent root leaves the tree as it is
+    assert ncbitaxon2tsv.prune_poles(tree, 8) is tree
+
+
+def test_collapse_poles(taxdmp):
+    tree = ncbitaxon2tsv.build_tree(ncbitaxon2tsv.read_nodes(taxdmp), weights)
+    # 3, 5, and 6 each have one child and no epitopes of their own
+    collapsed = ncbitaxon2tsv.collapse_poles(tree)
+    assert edges(collapsed) == {1: None, 2: 1, 4: 2, 7: 1, 9: 2}
+    offsets = collapsed["offsets"]
+    children = {
+        tax_id: [collapsed["ids"][c] for c in collapsed["children"][offsets[p] : offsets[p + 1]]]
+        for p, tax_id in enumerate(collapsed["ids"])
+    }
+    assert children == {1: [2, 7], 2: [4, 9], 4: [], 7: [], 9: []}
+
+
+def ancestors(tax_id):
+    """Given a tax_id, return it and its ancestors from the parents above."""
+    result = [tax_id]
+    while parents[tax_id] != tax_id:
+        tax_id = parents[tax_id]
+        result.append(tax_id)
+    return result
+
+
+def test_number_intervals(taxdmp):
+    lft, rgt, depth = ncbitaxon2tsv.number_intervals(ncbitaxon2tsv.read_nodes(taxdmp))
+    assert sorted(lft[tax_id] for tax_id in parents) == list(range(1, len(parents) + 1))
+    for x in parents:
+        assert depth[x] == len(ancestors(x)) - 1
+        for y in parents:
+            assert (lft[x] <= lft[y] <= rgt[x]) == (x in ancestors(y)), (x, y)
+    # tax_id 0 is not a node
+    assert lft[0] == 0
+
+
+def test_write_intervals(tmp_path, taxdmp):
+    path = tmp_path / "intervals.tsv"
+    with open(path, "w") as output:
+        ncbitaxon2tsv.write_intervals(taxdmp.filename, output)
+    rows = [line.split("\t") for line in path.read_text().splitlines()]
+    assert [int(row[0]) for row in rows] == sorted(parents)
+    assert rows[0] == ["1", "1", str(len(parents)), "0"]
+
+
+search_rows = [
+    ("NCBITaxon:9", "101"),
+    ("NCBITaxon:9", "101"),
+    ("NCBITaxon:9", "102"),
+    ("NCBITaxon:4", "103"),
+    ("NCBITaxon:4", ""),
+    ("", "104"),
+]
+
+
+def test_count_weights_source(tmp_path):
+    path = str(tmp_path / "source.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE simple_search (source_organism_id TEXT, structure_id TEXT)")
+        conn.executemany("INSERT INTO simple_search VALUES (?, ?)", search_rows)
+    output = io.StringIO()
+    ncbitaxon2tsv.count_weights(path, output)
+    assert output.getvalue() == "4\t1\n9\t2\n"
+
+
+def test_count_weights_iedb(tmp_path):
+    # In iedb.db, search is a view over the integer-keyed search_fact table
+    path = str(tmp_path / "iedb.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE organism (organism_key INTEGER PRIMARY KEY, source_organism_id)")
+        conn.execute("CREATE TABLE search_fact (structure_id INT, organism_key INT)")
+        conn.executemany(
+            "INSERT INTO organism VALUES (?, ?)", [(1, "NCBITaxon:9"), (2, "NCBITaxon:4")]
+        )
+        keys = {"NCBITaxon:9": 1, "NCBITaxon:4": 2, "": None}
+        conn.executemany(
+            "INSERT INTO search_fact VALUES (?, ?)",
+            [(structure_id, keys[organism_id]) for organism_id, structure_id in search_rows],
+        )
+        conn.execute("""CREATE VIEW search AS
+            SELECT f.structure_id,
+              (SELECT source_organism_id FROM organism WHERE organism_key = f.organism_key)
+                AS source_organism_id
+            FROM search_fact f""")
+    output = io.StringIO()
+    ncbitaxon2tsv.count_weights(path, output)
+    assert output.getvalue() == "4\t1\n9\t2\n"
+
+
+def test_save_taxonomy(tmp_path, taxdmp):
+    taxonomy = ncbitaxon2tsv.build_taxonomy(taxdmp)
+    path = str(tmp_path / "taxonomy.bin")
+    ncbitaxon2tsv.save_taxonomy(taxonomy, path)
+    loaded = ncbitaxon2tsv.load_taxonomy(path)
+    assert loaded["rank_names"] == taxonomy["rank_names"]
+    for name, _ in ncbitaxon2tsv.taxonomy_sections:
+        assert loaded[name].tolist() == list(taxonomy[name]), name
+    for tax_id, parent in parents.items():
+        assert loaded["parents"][tax_id] == parent
+        assert ncbitaxon2tsv.get_label(loaded, tax_id) == f"Taxon {tax_id}"
+        assert loaded["rank_names"][loaded["ranks"][tax_id]] == ranks.get(tax_id, "no rank")
+        assert list(ncbitaxon2tsv.get_children(loaded, tax_id)) == sorted(
+            child for child, p in parents.items() if p == tax_id and child != tax_id
+        )
+
+
+def test_load_taxonomy_invalid(tmp_path):
+    path = tmp_path / "taxonomy.bin"
+    path.write_bytes(b"not a taxonomy")
+    with pytest.raises(Exception, match="Not a taxonomy file"):
+        ncbitaxon2tsv.load_taxonomy(str(path))
+
+
+dmp_lines = [
+    ("1", "root", "", "scientific name"),
+    ("22", 'A "long" name that does not fit in one block', "", "scientific name"),
+    ("333", "Taxon 333", "Taxon 333 <genus>", "synonym"),
+]
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 5, 8, 13, 64, 1 << 22])
+def test_read_dmp_blocks(block_size):
+    data = dmp(dmp_lines).encode()
+    blocks = list(ncbitaxon2tsv.read_dmp_blocks(io.BytesIO(data), block_size))
+    assert b"".join(blocks) == data
+    assert all(block.endswith(b"\t|\n") for block in blocks)
+
+
+def test_read_dmp_blocks_unterminated():
+    # The last line has no newline
+    data = dmp(dmp_lines).encode()[:-1]
+    blocks = list(ncbitaxon2tsv.read_dmp_blocks(io.BytesIO(data), 8))
+    assert b"".join(blocks) == data + b"\n"
+    assert list(ncbitaxon2tsv.read_dmp_blocks(io.BytesIO(b""), 8)) == []
+
+
+@pytest.fixture
+def names_zip(tmp_path):
+    path = tmp_path / "taxdmp.zip"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("names.dmp", dmp(dmp_lines))
+    return path
+
+
+@pytest.mark.parametrize("block_size", [8, 1 << 22])
+def test_read_dmp(monkeypatch, names_zip, block_size):
+    monkeypatch.setattr(ncbitaxon2tsv, "dmp_block_size", block_size)
+    with zipfile.ZipFile(names_zip) as taxdmp:
+        blocks = list(ncbitaxon2tsv.read_dmp(taxdmp, "names"))
+        rows = [row for block in blocks for row in zip(*block.values())]
+        assert rows == dmp_lines
+        assert list(blocks[0]) == ncbitaxon2tsv.names_fields
+        fields = ["name_class", "tax_id"]
+        blocks = list(ncbitaxon2tsv.read_dmp(taxdmp, "names", fields))
+    assert [tax_id for block in blocks for tax_id in block["tax_id"]] == ["1", "22", "333"]
+    assert all(list(block) == fields for block in blocks)
+
+
+@pytest.mark.parametrize("block_size", [8, 1 << 22])
+def test_dmp2tsv(monkeypatch, names_zip, block_size):
+    monkeypatch.setattr(ncbitaxon2tsv, "dmp_block_size", block_size)
+    output = io.BytesIO()
+    ncbitaxon2tsv.dmp2tsv(str(names_zip), "names", output)
+    assert output.getvalue().decode().splitlines() == [
+        "1\troot\t\tscientific name",
+        '22\tA \\"long\\" name that does not fit in one block\t\tscientific name',
+        "333\tTaxon 333\tTaxon 333 <genus>\tsynonym",
+    ]
+
+
+def test_synonym_bnode():
+    bnode = ncbitaxon2tsv.synonym_bnode("NCBITaxon:9", "Taxon nine", "synonym")
+    # The same in every run and process: a digest of the subject, class, and synonym
+    assert bnode == "_:5d4a21dd70f76af0"
+    command = [
+        sys.executable,
+        "-c",
+        "import ncbitaxon2tsv; print(ncbitaxon2tsv.synonym_bnode('NCBITaxon:9', 'Taxon nine', "
+        "'synonym'))",
+    ]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), PYTHONHASHSEED="1")
+    assert subprocess.check_output(command, env=env, text=True).strip() == bnode
+    # Different for each subject, synonym, and name class
+    others = [
+        ("NCBITaxon:4", "Taxon nine", "synonym"),
+        ("NCBITaxon:9", "Taxon 9", "synonym"),
+        ("NCBITaxon:9", "Taxon nine", "common name"),
+    ]
+    bnodes = {bnode} | {ncbitaxon2tsv.synonym_bnode(*other) for other in others}
+    assert len(bnodes) == len(others) + 1
+
+
+def test_convert_synonyms():
+    synonyms = [
+        ["Taxon nine", "", "synonym"],
+        ['The "ninth"', "", "common name"],
+        ["Ignored", "", "authority"],
+    ]
+    rows = ncbitaxon2tsv.convert_synonyms("9", synonyms)
+    assert all(len(row) == len(ncbitaxon2tsv.statements_headers) for row in rows)
+    assert len(rows) == 12
+    sc = "NCBITaxon:9"
+    sb = ncbitaxon2tsv.synonym_bnode(sc, "Taxon nine", "synonym")
+    assert rows[:6] == [
+        (sc, sc, "", "oio:hasRelatedSynonym", "", "", "", "Taxon nine", "", ""),
+        (sc, "", sb, "rdf:type", "", "owl:Axiom", "", "", "", ""),
+        (sc, "", sb, "owl:annotatedSource", "", sc, "", "", "", ""),
+        (sc, "", sb, "owl:annotatedProperty", "", "oio:hasRelatedSynonym", "", "", "", ""),
+        (sc, "", sb, "owl:annotatedTarget", "", "", "", "Taxon nine", "xsd:string", ""),
+        (sc, "", sb, "oio:hasSynonymType", "", "ncbitaxon:synonym", "", "", "", ""),
+    ]
+    # The second synonym is escaped and gets its own blank node
+    assert rows[6] == (sc, sc, "", "oio:hasExactSynonym", "", "", "", 'The \\"ninth\\"', "", "")
+    assert {row[2] for row in rows[7:]} == {
+        ncbitaxon2tsv.synonym_bnode(sc, 'The \\"ninth\\"', "common name")
+    }
+    assert rows[11][5] == "ncbitaxon:common_name"
+    # The rows are the same on every call
+    assert ncbitaxon2tsv.convert_synonyms("9", synonyms) == rows
+
+
+def test_convert_node():
+    node = {"tax_id": "9", "parent_tax_id": "3", "rank": "species", "genetic_code_id": "11"}
+    rows = ncbitaxon2tsv.convert_node(node, "Taxon 9", ["99"], [], ["12345"])
+    sc = "NCBITaxon:9"
+    assert all(isinstance(row, tuple) for row in rows)
+    assert [row[3] for row in rows] == [
+        "rdf:type",
+        "rdfs:label",
+        "iedb:browser-link",
+        "rdfs:subClassOf",
+        "ncbitaxon:has_rank",
+        "oio:hasDbXref",
+        "oio:hasAlternativeId",
+        "oio:hasDbXref",
+        "oio:hasOBONamespace",
+    ]
+    assert rows[3] == (sc, sc, "", "rdfs:subClassOf", "", "NCBITaxon:3", "", "", "", "")
+    assert rows[4] == (sc, sc, "", "ncbitaxon:has_rank", "", "NCBITaxon:species", "", "", "", "")
+    assert rows[5][7] == "GC_ID:11"
+    assert rows[6][7] == "NCBITaxon:99"
+    assert rows[7][7] == "PMID:12345"
+
+
+def active_flags(*tax_ids):
+    active = bytearray(max(parents) + 1)
+    for tax_id in tax_ids:
+        active[tax_id] = 1
+    return active
+
+
+def test_read_merged(taxdmp):
+    assert ncbitaxon2tsv.read_merged(taxdmp, active_flags(7, 9)) == {9: ["90", "91"], 7: ["70"]}
+    assert ncbitaxon2tsv.read_merged(taxdmp, active_flags()) == {}
+
+
+def test_read_citations(taxdmp):
+    # Citations without a MEDLINE ID or taxa are skipped, and so are unknown tax_ids
+    citations = ncbitaxon2tsv.read_citations(taxdmp, active_flags(7, 8, 9))
+    assert citations == {9: ["111"], 7: ["111", "555"], 8: ["333"]}
+    assert ncbitaxon2tsv.read_citations(taxdmp, active_flags(1)) == {}
+
+
+def convert_statements(tmp_path, taxdmp, **flags):
+    """Convert the taxdmp.zip with the weights and flags, and return the statement rows."""
+    outdir = tmp_path / "output"
+    outdir.mkdir()
+    ncbitaxon2tsv.convert(taxdmp.filename, str(outdir), weights, **flags)
+    with open(outdir / "statements.tsv") as f:
+        return list(csv.reader(f, delimiter="\t"))[1:]
+
+
+def test_convert_merged_citations(tmp_path, taxdmp):
+    rows = convert_statements(tmp_path, taxdmp, include_merged=True, include_citations=True)
+    alternatives = sorted((row[1], row[7]) for row in rows if row[3] == "oio:hasAlternativeId")
+    assert alternatives == [
+        ("NCBITaxon:7", "NCBITaxon:70"),
+        ("NCBITaxon:9", "NCBITaxon:90"),
+        ("NCBITaxon:9", "NCBITaxon:91"),
+    ]
+    xrefs = sorted((row[1], row[7]) for row in rows if row[7].startswith("PMID:"))
+    assert xrefs == [
+        ("NCBITaxon:7", "PMID:111"),
+        ("NCBITaxon:7", "PMID:555"),
+        ("NCBITaxon:9", "PMID:111"),
+    ]
+
+
+def test_convert_without_flags(tmp_path, taxdmp):
+    rows = convert_statements(tmp_path, taxdmp)
+    assert not [row for row in rows if row[3] == "oio:hasAlternativeId"]
+    assert not [row for row in rows if row[7].startswith("PMID:")]
+    # Every active taxon still gets its other statements
+    labels = sorted(row[7] for row in rows if row[3] == "rdfs:label")
+    assert labels == [f"Taxon {tax_id}" for tax_id in [1, 2, 3, 4, 5, 6, 7, 9]]
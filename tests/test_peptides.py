@@ -0,0 +1,98 @@
+import random
+import sqlite3
+
+import pytest
+
+import peptides
+
+residues = "ACDEFGHIKLMNPQRSTVWY"
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    """Return the sequences and a loaded index of them,
+    with lengths that fill part of a word, one word, and more than one word."""
+    if peptides.numpy is None:
+        pytest.skip("NumPy is not installed")
+    directory = tmp_path_factory.mktemp("peptides")
+    rng = random.Random(0)
+    sequences = {}
+    for length in [3, 9, 12, 14]:
+        base = "".join(rng.choice(residues) for _ in range(length))
+        for _ in range(200):
+            # Mutate a few residues of the base sequence, so some are close to each other
+            sequence = list(base)
+            for _ in range(rng.randint(0, length)):
+                sequence[rng.randrange(length)] = rng.choice(residues)
+            sequences["".join(sequence)] = None
+    sequences = list(sequences)
+    db_path = str(directory / "iedb.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE sequence (sequence_id INTEGER PRIMARY KEY, linear_sequence TEXT)"
+        )
+        conn.executemany(
+            "INSERT INTO sequence(linear_sequence) VALUES (?)", [(s,) for s in sequences + [None]]
+        )
+    conn.close()
+    peptides.write_index(db_path, str(directory / "index"))
+    return sequences, peptides.load_index(str(directory / "index"), db_path)
+
+
+def test_pack():
+    assert peptides.pack("AR") == [0 | 1 << 5]
+    assert len(peptides.pack("A" * 12)) == 1
+    assert len(peptides.pack("A" * 13)) == 2
+    assert peptides.pack("aJ") == peptides.pack("AX")
+
+
+@pytest.mark.parametrize("length", [3, 9, 12, 14])
+@pytest.mark.parametrize("distance", [0, 1, 2, 3, 4, 13, 14, 20])
+def test_hamming(index, length, distance):
+    sequences, loaded = index
+    query = next(s for s in sequences if len(s) == length)
+    expected = []
+    for sequence_id, sequence in enumerate(sequences, 1):
+        if len(sequence) == length:
+            found = sum(a != b for a, b in zip(query, sequence))
+            if found <= distance:
+                expected.append((sequence_id, found))
+    expected.sort(key=lambda pair: (pair[1], pair[0]))
+    assert peptides.hamming(loaded, query, distance) == expected
+
+
+def test_hamming_every_row(index):
+    # Once the distance reaches the length, every sequence of that length matches,
+    # including those that share no residue with the query
+    sequences, loaded = index
+    matches = peptides.hamming(loaded, "W" * 14, 14)
+    assert len(matches) == sum(len(s) == 14 for s in sequences)
+
+
+def test_hamming_empty(index):
+    _, loaded = index
+    assert peptides.hamming(loaded, "A" * 7, 2) == []
+    assert peptides.hamming(loaded, "AAA", -1) == []
+
+
+@pytest.mark.parametrize("length", [3, 9, 14])
+def test_blosum(index, length):
+    sequences, loaded = index
+    query = next(s for s in reversed(sequences) if len(s) == length)
+    scores = [
+        (sequence_id, sum(peptides.blosum62[(a, b)] for a, b in zip(query, sequence)))
+        for sequence_id, sequence in enumerate(sequences, 1)
+        if len(sequence) == length
+    ]
+    scores.sort(key=lambda pair: (-pair[1], pair[0]))
+    matches = peptides.blosum(loaded, query, 10)
+    assert [score for _, score in matches] == [score for _, score in scores[:10]]
+    # Ties may be cut at the limit, but the best score is the query itself
+    assert matches[0] == scores[0]
+    assert peptides.blosum(loaded, query, 0) == scores
+
+
+def test_edit_distances():
+    others = ["CASSLGQAYEQYF", "CASSLGQAYEQY", "CASRLGQAYEQYF", "CSSLGQAYEQYFA", "", "XYZ"]
+    expected = [0, 1, 1, 2, 13, 12]
+    assert peptides.edit_distances("CASSLGQAYEQYF", others) == expected
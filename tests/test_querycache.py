@@ -0,0 +1,94 @@
+import os
+import sqlite3
+
+import pytest
+
+import querycache
+
+
+def test_build_id(tmp_path):
+    path = str(tmp_path / "iedb.db")
+    assert querycache.build_id(path) is None
+    with open(path, "w") as f:
+        f.write("one")
+    build = querycache.build_id(path)
+    assert len(build) == 16
+    assert querycache.build_id(path) == build
+    with open(path, "w") as f:
+        f.write("rebuilt")
+    assert querycache.build_id(path) != build
+
+
+def test_get_put(tmp_path):
+    path = str(tmp_path / "cache.db")
+    rows = [{"structure_id": 1, "description": "SIINFEKL"}]
+    key = ("SELECT * FROM search WHERE id = :id", (("id", 1),))
+    assert querycache.get(path, "a", "query", key) is None
+    querycache.put(path, "a", "query", key, rows)
+    assert querycache.get(path, "a", "query", key) == rows
+    # Keys are normalized to JSON, so a list finds the same entry as a tuple
+    assert querycache.get(path, "a", "query", [key[0], [["id", 1]]]) == rows
+
+    # Other builds and kinds do not see the entry
+    assert querycache.get(path, "b", "query", key) is None
+    assert querycache.get(path, "a", "count", key) is None
+
+    querycache.put(path, "a", "query", key, [])
+    assert querycache.get(path, "a", "query", key) == []
+
+
+def test_get_put_without_build(tmp_path):
+    path = str(tmp_path / "cache.db")
+    querycache.put(path, None, "count", "key", {"epitope": {"count": 1}})
+    assert querycache.get(path, None, "count", "key") is None
+    assert not os.path.exists(path)
+
+
+def test_get_put_unreadable(tmp_path):
+    # A directory is not a database, and the cache is only an optimization
+    path = str(tmp_path)
+    querycache.put(path, "a", "count", "key", 1)
+    assert querycache.get(path, "a", "count", "key") is None
+
+
+def test_prune(tmp_path):
+    path = str(tmp_path / "cache.db")
+    for build in ["old", "older", "new"]:
+        for kind in ["count", "query"]:
+            querycache.put(path, build, kind, "key", build)
+    assert querycache.prune(path, "new") == 4
+    assert querycache.prune(path, "new") == 0
+    for kind in ["count", "query"]:
+        assert querycache.get(path, "new", kind, "key") == "new"
+        assert querycache.get(path, "old", kind, "key") is None
+
+
+@pytest.fixture
+def organisms():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE organism_tree (parent TEXT, child TEXT, sort INT)")
+    conn.executemany(
+        "INSERT INTO organism_tree VALUES (?, ?, ?)",
+        [("NCBITaxon:1", f"NCBITaxon:{i}", 10 - i) for i in range(2, 7)],
+    )
+    return conn.cursor()
+
+
+def test_warm_urls(organisms):
+    urls = querycache.warm_urls(organisms, top=2)
+    # Counts and eight tabs for the landing page and each organism
+    assert len(urls) == 3 * 9
+    assert urls[0] == "/search/counts.json?positive_assays_only=true"
+    assert urls[1] == "/search/?positive_assays_only=true&tab=epitope"
+    assert urls[8] == "/search/?positive_assays_only=true&tab=reference"
+    assert urls[9] == "/search/counts.json?positive_assays_only=true&source_organism=NCBITaxon%3A6"
+    assert urls[18].endswith("source_organism=NCBITaxon%3A5")
+    assert urls[12] == (
+        "/search/?positive_assays_only=true&source_organism=NCBITaxon%3A6&tab=assay&tab2=tcell"
+    )
+    assert len(set(urls)) == len(urls)
+
+
+def test_warm_urls_top(organisms):
+    assert len(querycache.warm_urls(organisms, top=0)) == 9
+    assert len(querycache.warm_urls(organisms, top=20)) == 6 * 9
@@ -0,0 +1,624 @@
+import base64
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "iedbtk")
+
+
+def wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        if time.monotonic() > deadline:
+            raise Exception("Timed out")
+        time.sleep(0.001)
+
+
+def test_single_flight(server):
+    computed = server.flight_stats["computed"]
+    assert server.single_flight("one", lambda: [1]) == [1]
+    assert server.single_flight("one", lambda: [2]) == [2]
+    assert server.flight_stats["computed"] == computed + 2
+    assert "one" not in server.flights
+
+
+def test_single_flight_concurrent(server):
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"rows": [1, 2, 3]}
+
+    coalesced = server.flight_stats["coalesced"]
+    results = [None] * 4
+
+    def call(i):
+        results[i] = server.single_flight("shared", compute)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    # The leader computes while the other three wait for it
+    wait_for(lambda: server.flight_stats["coalesced"] == coalesced + 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"rows": [1, 2, 3]}] * 4
+    # Each waiter gets its own copy
+    assert len({id(result) for result in results}) == 4
+    assert "shared" not in server.flights
+
+
+def test_single_flight_error(server):
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        release.wait(5)
+        raise ValueError("failed")
+
+    def call():
+        try:
+            server.single_flight("failing", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    coalesced = server.flight_stats["coalesced"]
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: server.flight_stats["coalesced"] == coalesced + 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    # A failure is not remembered
+    assert server.single_flight("failing", lambda: "ok") == "ok"
+
+
+def test_counts_shared(server, monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def compute_counts(args):
+        calls.append(args)
+        release.wait(5)
+        return {"epitope": {"count": 3}}
+
+    monkeypatch.setattr(server, "compute_counts", compute_counts)
+    client = server.app.test_client()
+    query = {"source_organism": "NCBITaxon:9606"}
+    key = server.count_key(query)
+    results = [None] * 3
+
+    def call(i):
+        results[i] = client.get("/search/counts.json", query_string=query).get_json()
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(3)]
+    threads[0].start()
+    wait_for(lambda: calls and key in server.count_futures)
+    running = server.count_futures[key]
+    for thread in threads[1:]:
+        thread.start()
+    # The other requests wait on the same future
+    assert server.submit_counts(query) is running
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [dict(key)]
+    assert results == [{"epitope": {"count": 3}}] * 3
+    wait_for(lambda: key not in server.count_futures)
+
+
+def test_counts_done(server, monkeypatch):
+    class Pool:
+        def submit(self, fn, *args):
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+    monkeypatch.setattr(server, "compute_counts", lambda args: {"epitope": {"count": 1}})
+    monkeypatch.setattr(server, "count_pool", Pool())
+    results = []
+    # A future that is already done must not deadlock on count_lock
+    thread = threading.Thread(target=lambda: results.append(server.submit_counts({}).result()))
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    assert results == [{"epitope": {"count": 1}}]
+    assert server.count_futures == {}
+
+
+sequences = ["SIINFEKL", "GILGFVFTL", "NLVPMVATV", "SIINFEKLAAA", "FEKSIIN", "LLL"]
+cdr3s = ["CASSLAPGATNEKLFF", "CASSIRSSYEQYF", "CAVRDSNYQLIW"]
+
+
+@pytest.fixture
+def sequence_db():
+    """Return a database with the sequence and CDR3 indexes built by sequence.sql."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE epitope (linear_sequence TEXT)")
+    conn.executemany("INSERT INTO epitope VALUES (?)", [(s,) for s in sequences + [None]])
+    for table in ["tcr_fact", "bcr_fact"]:
+        conn.execute(f"CREATE TABLE {table} (chain1_cdr3_sequence TEXT, chain2_cdr3_sequence TEXT)")
+    conn.executemany("INSERT INTO tcr_fact VALUES (?, NULL)", [(s,) for s in cdr3s])
+    with open(os.path.join(src, "sequence.sql")) as f:
+        conn.executescript(f.read())
+    yield conn
+    conn.close()
+
+
+def motif_matches(server, conn, motif, table="sequence", column="linear_sequence"):
+    params = {}
+    query = server.motif_query(motif, params, "motif", table, column)
+    ids = [row[0] for row in conn.execute(query, params)]
+    return sorted(
+        conn.execute(f"SELECT {column} FROM {table} WHERE {table}_id = ?", (i,)).fetchone()[0]
+        for i in ids
+    )
+
+
+@pytest.mark.parametrize(
+    "motif", ["IIN", "SIINFEKL", "INFEK", "FEKL", "KSIIN", "GFVF", "LL", "L", "XYZ", "SIINFEKLAAAA"]
+)
+def test_motif_query(server, sequence_db, motif):
+    assert motif_matches(server, sequence_db, motif) == sorted(s for s in sequences if motif in s)
+
+
+def test_motif_query_kmers(server):
+    # Three 3-mers cover a motif of eight residues; the last one overlaps the second
+    params = {}
+    query = server.motif_query("SIINFEKL", params, "motif")
+    assert params == {
+        "motif": "SIINFEKL",
+        "motif_0": "SII",
+        "motif_1": "NFE",
+        "motif_2": "EKL",
+    }
+    assert query.count("INTERSECT") == 2
+    # A motif shorter than a k-mer is only checked with instr()
+    params = {}
+    assert "sequence_kmer" not in server.motif_query("LL", params, "motif")
+    assert params == {"motif": "LL"}
+
+
+def test_motif_query_cdr3(server, sequence_db):
+    assert motif_matches(server, sequence_db, "CASS", "cdr3", "cdr3_sequence") == sorted(cdr3s[:2])
+    assert motif_matches(server, sequence_db, "YQL", "cdr3", "cdr3_sequence") == cdr3s[2:]
+
+
+@pytest.mark.parametrize(
+    "value,distance", [(None, 1), ("", 1), ("abc", 1), ("1.5", 1), ("0", 0), ("3", 3), ("-2", 0)]
+)
+def test_parse_distance(server, value, distance):
+    assert server.parse_distance(value) == distance
+
+
+def test_parse_distance_max(server):
+    assert server.parse_distance("99") == server.max_distance
+
+
+@pytest.mark.parametrize(
+    "a,b,distance",
+    [
+        ("CASSLGQAYEQYF", "CASSLGQAYEQYF", 0),
+        ("CASSLGQAYEQYF", "CASSLGQAYEQY", 1),
+        ("CASSLGQAYEQYF", "CASRLGQAYEQYF", 1),
+        ("CASSLGQAYEQYF", "CSSLGQAYEQYFA", 2),
+        ("CASS", "", 4),
+        ("", "", 0),
+    ],
+)
+def test_edit_distance(server, a, b, distance):
+    assert server.edit_distance(a, b, 5) == distance
+    assert server.edit_distance(b, a, 5) == distance
+    assert server.peptides.edit_distances(a, [b]) == [distance]
+
+
+def test_edit_distance_limit(server):
+    # Past the limit, the distance is only known to be more than the limit
+    assert server.edit_distance("CASSLGQAYEQYF", "CAVRDSNYQLIW", 2) == 3
+    assert server.edit_distance("CASSLGQAYEQYF", "CASS", 2) == 3
+    assert server.edit_distance("CASSLGQAYEQYF", "CASRLGQAYEQYF", 1) == 1
+
+
+def cached_response(server, headers):
+    """Return the response of a large JSON view behind http_cache and compress."""
+    view = server.http_cache()(lambda: server.jsonify(list(range(1000))))
+    with server.app.test_request_context("/page?a=1", headers=headers):
+        return server.compress(view())
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "identity"])
+def test_http_cache(server, monkeypatch, encoding):
+    monkeypatch.setattr(server, "build", "test")
+    response = cached_response(server, {"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert "Accept-Encoding" in response.vary
+    etag, _ = response.get_etag()
+    if encoding == "gzip":
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert etag.endswith("-gzip")
+    else:
+        assert "-" not in etag
+
+    # A 304 carries the ETag exactly as the client sent it
+    headers = {"Accept-Encoding": encoding, "If-None-Match": f'"{etag}"'}
+    response = cached_response(server, headers)
+    assert response.status_code == 304
+    assert response.get_etag() == (etag, False)
+    assert response.get_data() == b""
+    assert "Accept-Encoding" in response.vary
+
+
+def test_http_cache_changed(server, monkeypatch):
+    monkeypatch.setattr(server, "build", "test")
+    etag, _ = cached_response(server, {}).get_etag()
+    monkeypatch.setattr(server, "build", "other")
+    response = cached_response(server, {"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+
+
+def test_cursor(server, monkeypatch):
+    monkeypatch.setattr(server, "build", "test")
+    assert server.decode_cursor(None) == (0, None)
+    assert server.decode_cursor("") == (0, None)
+    for offset in [0, 25, 1000000]:
+        cursor = server.encode_cursor(offset)
+        assert server.decode_cursor(cursor) == (offset, None)
+        cursor = server.encode_cursor(offset, 123)
+        assert server.decode_cursor(cursor) == (offset, 123)
+    # Cursors are opaque but safe in a URL
+    assert all(c.isalnum() or c in "-_=" for c in server.encode_cursor(25))
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "bad",
+        "e30=",
+        base64.urlsafe_b64encode(b'{"offset": "x", "build": "test"}').decode(),
+        base64.urlsafe_b64encode(b'{"offset": 1, "after": "x", "build": "test"}').decode(),
+    ],
+)
+def test_cursor_malformed(server, monkeypatch, cursor):
+    monkeypatch.setattr(server, "build", "test")
+    with pytest.raises(ValueError, match="Malformed"):
+        server.decode_cursor(cursor)
+
+
+def test_cursor_other_build(server, monkeypatch):
+    monkeypatch.setattr(server, "build", "test")
+    cursor = server.encode_cursor(25)
+    negative = server.encode_cursor(-1)
+    monkeypatch.setattr(server, "build", "other")
+    with pytest.raises(ValueError, match="another build"):
+        server.decode_cursor(cursor)
+    monkeypatch.setattr(server, "build", "test")
+    with pytest.raises(ValueError):
+        server.decode_cursor(negative)
+
+
+def test_api_search_bad_cursor(server):
+    response = server.app.test_client().get("/api/search?cursor=bad")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Malformed cursor"}
+
+
+@pytest.mark.parametrize("tab2", ["tcell", "bcell", "elution"])
+def test_api_search_assay_pages(server, iedb, tab2):
+    # The assay pages seek past the last ID, and together they list every assay once
+    client = server.app.test_client()
+    query = {"tab": "assay", "tab2": tab2}
+    everything = client.get("/api/search", query_string={**query, "limit": 1000}).get_json()
+    assert 7 < len(everything["rows"]) < 1000
+    rows = []
+    cursor = {}
+    while True:
+        page = client.get("/api/search", query_string={**query, "limit": 7, **cursor}).get_json()
+        rows += page["rows"]
+        if not page["next_cursor"]:
+            break
+        assert server.decode_cursor(page["next_cursor"]) == (len(rows), rows[-1][f"{tab2}_id"])
+        cursor = {"cursor": page["next_cursor"]}
+    assert rows == everything["rows"]
+
+
+def test_tab_query_after(server):
+    result = {"search": {"select": [], "from": ["search"], "where": [], "params": {}}}
+    q = server.tab_query(result, "assay", "tcell", 50, 25, after=1234)
+    sql = server.build_query(q)
+    assert "tcell_id > :after" in sql
+    assert "OFFSET" not in sql
+    assert q["params"] == {"after": 1234}
+    assert "after" not in result["search"]["params"]
+
+
+def subtree(conn, organism_ids):
+    """Given a connection to iedb.db and organism IDs,
+    return them and their descendants by walking organism_tree."""
+    values = ", ".join(["(?)"] * len(organism_ids))
+    query = f"""WITH RECURSIVE below(id) AS (
+  VALUES {values}
+  UNION
+  SELECT child FROM organism_tree JOIN below ON parent = id)
+SELECT id FROM below"""
+    return {row[0] for row in conn.execute(query, organism_ids)}
+
+
+@pytest.mark.parametrize("snapshot", [True, False])
+def test_organism_filter(server, iedb, monkeypatch, snapshot):
+    if not snapshot:
+        monkeypatch.setattr(server, "snapshot", None)
+    client = server.app.test_client()
+    conn = sqlite3.connect(f"file:{iedb}?mode=ro", uri=True)
+    organisms = [row[0] for row in conn.execute("SELECT child FROM organism_tree ORDER BY sort")]
+    leaf = conn.execute(
+        "SELECT child FROM organism_tree WHERE child NOT IN (SELECT parent FROM organism_tree) "
+        "AND child IN (SELECT source_organism_id FROM search) ORDER BY sort"
+    ).fetchone()[0]
+    for organism_ids in [["NCBITaxon:1"], organisms[:1], organisms[1:3], [leaf]]:
+        below = subtree(conn, organism_ids)
+        values = ", ".join(["?"] * len(below))
+        epitopes, references = conn.execute(
+            "SELECT count(DISTINCT structure_id), count(DISTINCT reference_id) FROM search "
+            f"WHERE source_organism_id IN ({values})",
+            list(below),
+        ).fetchone()
+        assert 0 < epitopes < 1000
+        source_organism = " ".join(organism_ids)
+        response = client.get(
+            "/search/counts.json", query_string={"source_organism": source_organism}
+        )
+        result = response.get_json()
+        assert result["epitope"]["count"] == epitopes, organism_ids
+        assert result["reference"]["count"] == references, organism_ids
+
+        # The epitope tab lists the same epitopes
+        response = client.get(
+            "/api/search",
+            query_string={"tab": "epitope", "source_organism": source_organism, "limit": 1000},
+        )
+        rows = response.get_json()["rows"]
+        expected = conn.execute(
+            f"SELECT DISTINCT structure_id FROM search WHERE source_organism_id IN ({values})",
+            list(below),
+        )
+        assert {row["structure_id"] for row in rows} == {row[0] for row in expected}
+
+    # An unknown organism matches nothing
+    response = client.get("/search/counts.json?source_organism=NCBITaxon:999999999")
+    assert response.get_json()["epitope"]["count"] == 0
+    conn.close()
+
+
+snapshot_filters = [
+    {},
+    {"positive_assays_only": "true"},
+    {"source_organism": "NCBITaxon:3"},
+    {"source_organism": "NCBITaxon:3", "positive_assays_only": "true"},
+]
+
+
+@pytest.mark.parametrize(
+    "tab",
+    [{"tab": "epitope"}, {"tab": "antigen"}, {"tab": "reference"}]
+    + [{"tab": "receptor", "tab2": tab2} for tab2 in ["tcr", "bcr"]],
+)
+@pytest.mark.parametrize("filters", snapshot_filters)
+def test_snapshot_tabs(server, iedb, monkeypatch, tab, filters):
+    # The snapshot gives the same pages as SQL, in the same order
+    client = server.app.test_client()
+    pages = {}
+    for snapshot in [server.snapshot, None]:
+        monkeypatch.setattr(server, "snapshot", snapshot)
+        first = client.get("/api/search", query_string={**tab, **filters, "limit": 7}).get_json()
+        cursor = {"cursor": first["next_cursor"]} if first["next_cursor"] else {}
+        second = client.get("/api/search", query_string={**tab, **filters, "limit": 7, **cursor})
+        everything = client.get("/api/search", query_string={**tab, **filters, "limit": 1000})
+        pages[snapshot is None] = [first["rows"], second.get_json()["rows"]]
+        pages[snapshot is None].append(everything.get_json()["rows"])
+    assert pages[True] == pages[False]
+    assert pages[True][0] + pages[True][1] == pages[True][2][:14]
+
+
+def test_snapshot_disk_cache(server, iedb, monkeypatch):
+    client = server.app.test_client()
+    query = {"tab": "receptor", "tab2": "tcr", "limit": 5}
+    rows = client.get("/api/search", query_string=query).get_json()["rows"]
+    assert rows
+
+    # Another worker finds the page in the shared cache without aggregating
+    monkeypatch.setattr(server, "cache_list", [])
+    monkeypatch.setattr(server, "cache_dict", {})
+
+    def aggregate(*args):
+        raise Exception("Not cached")
+
+    monkeypatch.setattr(server.columnar, "aggregate", aggregate)
+    disk = server.metrics["cache"].get(("query", "disk"), 0)
+    assert client.get("/api/search", query_string=query).get_json()["rows"] == rows
+    assert server.metrics["cache"][("query", "disk")] == disk + 1
+
+
+def test_proxy(server, upstream):
+    client = server.app.test_client()
+    response = client.get(
+        "/iedb.db/search/query?sql=SELECT+1", headers={"X-Test": "yes", "Connection": "close"}
+    )
+    assert response.status_code == 200
+    seen = response.get_json()
+    assert seen["method"] == "GET"
+    assert seen["path"] == "/iedb.db/search/query?sql=SELECT+1"
+    assert seen["headers"]["x-test"] == "yes"
+    assert seen["headers"]["host"] == f"localhost:{upstream.port}"
+    assert seen["headers"]["connection"] != "close"
+    # The client did not ask for gzip, so neither does the proxy
+    assert seen["headers"]["accept-encoding"] == "identity"
+    assert "Content-Encoding" not in response.headers
+
+    response = client.post("/iedb.db/search/query", data={"sql": "SELECT 2"})
+    seen = response.get_json()
+    assert seen["method"] == "POST"
+    assert seen["body"] == "sql=SELECT+2"
+
+    response = client.head("/iedb.db/")
+    assert response.status_code == 200
+    assert response.data == b""
+    assert upstream.seen[-1]["method"] == "HEAD"
+
+
+def test_proxy_gzip(server, upstream):
+    # A gzipped body passes through as is
+    client = server.app.test_client()
+    response = client.get("/iedb.db/", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    seen = json.loads(gzip.decompress(response.data))
+    assert seen["headers"]["accept-encoding"] == "gzip, br"
+
+
+def test_proxy_location(server, upstream):
+    client = server.app.test_client()
+    response = client.get("/iedb.db/redirect")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/iedb.db/target"
+
+
+def test_proxy_timeout(server, upstream, monkeypatch):
+    monkeypatch.setattr(server, "proxy_timeout", (3.05, 0.2))
+    errors = server.proxy_stats["iedb"]["errors"]
+    response = server.app.test_client().get("/iedb.db/slow")
+    assert response.status_code == 504
+    assert server.proxy_stats["iedb"]["errors"] == errors + 1
+
+
+def test_proxy_connection_error(server, closed_port, monkeypatch):
+    monkeypatch.setitem(server.ports, "iedb", closed_port)
+    errors = server.proxy_stats["iedb"]["errors"]
+    response = server.app.test_client().get("/iedb.db/")
+    assert response.status_code == 502
+    assert server.proxy_stats["iedb"]["errors"] == errors + 1
+
+
+def test_proxy_unknown(server):
+    assert server.app.test_client().get("/other.db/").status_code == 404
+
+
+@pytest.fixture
+def numbers(tmp_path):
+    path = str(tmp_path / "numbers.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE number (n INT)")
+        conn.executemany("INSERT INTO number VALUES (?)", [(n,) for n in range(100)])
+    return f"file:{path}?mode=ro"
+
+
+def test_timed_cursor(server, numbers):
+    sql = "SELECT n FROM number WHERE n < ?"
+    key = server.statement_hash(sql)
+    count = server.metrics["sql"].get(key, {"count": 0})["count"]
+    with server.connect(numbers) as conn:
+        cur = conn.cursor()
+        assert isinstance(cur, server.TimedCursor)
+        cur.execute(sql, (10,))
+        assert cur.fetchone() == (0,)
+        assert len(cur.fetchall()) == 9
+        assert cur.seconds > 0
+    assert server.metrics["sql"][key]["sql"] == sql
+    assert server.metrics["sql"][key]["count"] == count + 1
+    assert server.metrics["sql"][key]["seconds"] >= cur.seconds
+
+
+def test_slow_query_log(server, numbers, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "slow_query_seconds", 0)
+    monkeypatch.setattr(server, "slow_query_log", str(tmp_path / "slow-queries.log"))
+    sql = "SELECT n FROM number WHERE n > :n ORDER BY n"
+    with server.connect(numbers) as conn:
+        cur = conn.cursor()
+        cur.execute(sql, {"n": 95})
+        assert cur.fetchall() == [(96,), (97,), (98,), (99,)]
+        cur.execute("SELECT count(*) FROM number")
+        cur.fetchall()
+    entries = [json.loads(line) for line in open(tmp_path / "slow-queries.log")]
+    # Each statement is logged once, with its query plan
+    assert [entry["sql"] for entry in entries] == [sql, "SELECT count(*) FROM number"]
+    assert entries[0]["statement"] == server.statement_hash(sql)
+    assert entries[0]["parameters"] == {"n": 95}
+    assert entries[0]["path"] is None
+    assert any("number" in step for step in entries[0]["plan"])
+
+
+def test_slow_query_log_unwritable(server, numbers, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "slow_query_seconds", 0)
+    monkeypatch.setattr(server, "slow_query_log", str(tmp_path / "missing" / "slow-queries.log"))
+    with server.connect(numbers) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM number")
+        assert cur.fetchall() == [(100,)]
+
+
+def test_prometheus_metric(server):
+    assert server.prometheus_metric(
+        "test_total", "counter", "A test.", [("", {"a": 'say "hi"\\\n', "b": 1}, 2)]
+    ) == [
+        "# HELP test_total A test.",
+        "# TYPE test_total counter",
+        'test_total{a="say \\"hi\\"\\\\\\n",b="1"} 2',
+    ]
+
+
+prometheus_sample = re.compile(r'^([a-z_]+)\{([a-z]+="([^"\\\n]|\\.)*"(,|(?=\})))*\} [0-9.e+-]+$')
+
+
+def test_metrics(server):
+    client = server.app.test_client()
+    response = client.get("/search/stats.json")
+    assert "total;dur=" in response.headers["Server-Timing"]
+    client.get("/api/search?cursor=bad")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+    lines = response.get_data(as_text=True).splitlines()
+
+    types = {}
+    samples = {}
+    for i, line in enumerate(lines):
+        if line.startswith("# HELP "):
+            name = line.split()[2]
+            assert lines[i + 1].startswith(f"# TYPE {name} ")
+            types[name] = lines[i + 1].split()[3]
+        elif not line.startswith("#"):
+            match = prometheus_sample.match(line)
+            assert match, line
+            name = match.group(1)
+            histogram = re.sub("_(bucket|count|sum)$", "", name)
+            assert name in types or types.get(histogram) == "histogram", line
+            labels, value = line.rsplit(" ", 1)
+            samples[labels] = float(value)
+    assert set(types.values()) == {"counter", "histogram"}
+    assert samples['iedbtk_requests_total{endpoint="search_stats",status="200"}'] >= 1
+    assert samples['iedbtk_requests_total{endpoint="api_search",status="400"}'] >= 1
+
+    # The histogram buckets are cumulative and end with the count
+    buckets = [
+        value
+        for labels, value in samples.items()
+        if labels.startswith('iedbtk_request_seconds_bucket{endpoint="search_stats"')
+    ]
+    assert len(buckets) == len(server.request_buckets) + 1
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == samples['iedbtk_request_seconds_count{endpoint="search_stats"}']